@@ -1,7 +1,9 @@
+import hashlib
 import pulumi
 import os
-from pulumi_azure_native import network, cache, web, dbforpostgresql, managedidentity, resources
-from pulumi import Output
+from pulumi_azure_native import network, cache, cdn, web, managedidentity, resources, insights, operationalinsights
+# A API 2023-06-01-preview expõe tier de IOPS e auto-grow do storage
+from pulumi_azure_native.dbforpostgresql import v20230601preview as dbforpostgresql
 
 # az resource list --resource-group django-azure-pulumi-123_group --output table
 # az resource show --ids "/subscriptions/SUBSCRIPTION_ID/resourceGroups/RESOURCE_GROUP" output table
@@ -11,17 +13,236 @@ from pulumi import Output
 resource_group_name = "cookiecutter-pulumi-django_group"
 location_brazilsouth = "brazilsouth"
 location_global = "global"
-secret_key = os.getenv('SECRET_KEY')
+
+# Configurações da stack (pulumi config set <chave> <valor>)
+config = pulumi.Config()
+secret_key = config.get_secret("secretKey") or os.getenv('SECRET_KEY')
+
+# Perfis de dimensionamento (pulumi config set sizingProfile prod-high-throughput).
+# Cada chave do perfil pode ser sobrescrita individualmente pela config da stack,
+# por exemplo: pulumi config set postgresStorageSizeGb 128
+SIZING_PROFILES = {
+    "dev": {
+        "appServicePlanSku": "B1",
+        "redisSku": {"name": "Standard", "family": "C", "capacity": 1},
+        "postgresSku": {"name": "Standard_B2ms", "tier": "Burstable"},
+        "postgresStorageSizeGb": 32,
+        "postgresStorageTier": "P4",
+        "pgbouncerPoolSize": 50,
+        "postgresReplicas": 0,
+        "cdnEnabled": False,
+        "gunicornMaxWorkers": 2,
+        "gunicornMaxThreads": 4,
+        "workersEnabled": False,
+        "workerPlanSku": "B1",
+        "workerInstances": 1,
+        "workerConcurrency": 2,
+        "tracingSampleRatio": 1.0,
+        "queryBudgetMode": "log",
+        "autoscale": {"enabled": False, "minimum": 1, "maximum": 3, "default": 1},
+    },
+    "staging": {
+        "appServicePlanSku": "S1",
+        "redisSku": {"name": "Standard", "family": "C", "capacity": 1},
+        "postgresSku": {"name": "Standard_B2ms", "tier": "Burstable"},
+        "postgresStorageSizeGb": 64,
+        "postgresStorageTier": "P10",
+        "pgbouncerPoolSize": 50,
+        "postgresReplicas": 0,
+        "cdnEnabled": False,
+        "gunicornMaxWorkers": 3,
+        "gunicornMaxThreads": 4,
+        "workersEnabled": True,
+        "workerPlanSku": "B1",
+        "workerInstances": 1,
+        "workerConcurrency": 4,
+        "tracingSampleRatio": 0.25,
+        "queryBudgetMode": "raise",
+        "autoscale": {"enabled": True, "minimum": 1, "maximum": 3, "default": 1},
+    },
+    "prod-high-throughput": {
+        "appServicePlanSku": "P1v3",
+        "redisSku": {"name": "Premium", "family": "P", "capacity": 1},
+        "postgresSku": {"name": "Standard_D4ds_v4", "tier": "GeneralPurpose"},
+        "postgresStorageSizeGb": 256,
+        "postgresStorageTier": "P20",
+        "pgbouncerPoolSize": 100,
+        "postgresReplicas": 1,
+        "cdnEnabled": True,
+        "gunicornMaxWorkers": 5,
+        "gunicornMaxThreads": 8,
+        "workersEnabled": True,
+        "workerPlanSku": "P1v3",
+        "workerInstances": 2,
+        "workerConcurrency": 8,
+        "tracingSampleRatio": 0.05,
+        "queryBudgetMode": "log",
+        "autoscale": {"enabled": True, "minimum": 2, "maximum": 10, "default": 2},
+    },
+}
+
+# vCPUs, memória (GB) e limite de max_connections do Azure para cada SKU do
+# PostgreSQL flexible server
+POSTGRES_SKUS = {
+    "Standard_B1ms": (1, 2, 50),
+    "Standard_B2s": (2, 4, 429),
+    "Standard_B2ms": (2, 8, 859),
+    "Standard_B4ms": (4, 16, 1718),
+    "Standard_B8ms": (8, 32, 3437),
+    "Standard_D2ds_v4": (2, 8, 859),
+    "Standard_D4ds_v4": (4, 16, 1718),
+    "Standard_D8ds_v4": (8, 32, 3437),
+    "Standard_D16ds_v4": (16, 64, 5000),
+    "Standard_E2ds_v4": (2, 16, 1718),
+    "Standard_E4ds_v4": (4, 32, 3437),
+    "Standard_E8ds_v4": (8, 64, 5000),
+}
+
+sizing_profile_name = config.get("sizingProfile") or "dev"
+if sizing_profile_name not in SIZING_PROFILES:
+    raise ValueError(f"sizingProfile '{sizing_profile_name}' inválido; use um de {sorted(SIZING_PROFILES)}")
+sizing_profile = SIZING_PROFILES[sizing_profile_name]
+
+
+def sizing(key, getter=config.get):
+    value = getter(key)
+    return sizing_profile[key] if value is None else value
+
+
+redis_sku = {**sizing_profile["redisSku"], **(config.get_object("redisSku") or {})}
+postgres_sku = {**sizing_profile["postgresSku"], **(config.get_object("postgresSku") or {})}
+if postgres_sku["name"] not in POSTGRES_SKUS:
+    raise ValueError(f"postgresSku.name '{postgres_sku['name']}' inválido; use um de {sorted(POSTGRES_SKUS)}")
+# Réplicas de leitura (pulumi config set postgresReplicas 2); o Azure não
+# oferece réplicas no tier Burstable
+postgres_replica_count = sizing("postgresReplicas", config.get_int)
+if postgres_replica_count and postgres_sku["tier"] == "Burstable":
+    raise ValueError("Réplicas de leitura exigem um SKU GeneralPurpose ou MemoryOptimized do PostgreSQL")
+# Front Door na frente de /static/ (pulumi config set cdnEnabled true)
+cdn_enabled = sizing("cdnEnabled", config.get_bool)
+postgres_storage_size_gb = sizing("postgresStorageSizeGb", config.get_int)
+postgres_storage_tier = sizing("postgresStorageTier")
+# O gunicorn.conf.py calcula workers e threads pela CPU e memória do
+# container; o perfil só limita esse cálculo. Valores fixos só quando a stack
+# pede (pulumi config set gunicornWorkers 4)
+gunicorn_max_workers = sizing("gunicornMaxWorkers", config.get_int)
+gunicorn_max_threads = sizing("gunicornMaxThreads", config.get_int)
+gunicorn_workers = config.get_int("gunicornWorkers")
+gunicorn_threads = config.get_int("gunicornThreads")
+# Workers da fila de tarefas (core/taskqueue.py) num plano próprio, que escala
+# sem disputar CPU com o gunicorn. Sem eles as tarefas rodam na própria requisição.
+workers_enabled = sizing("workersEnabled", config.get_bool)
+worker_plan_sku = sizing("workerPlanSku")
+worker_instances = sizing("workerInstances", config.get_int)
+worker_concurrency = sizing("workerConcurrency", config.get_int)
+# Fração das requisições rastreadas no Application Insights (core/telemetry.py)
+tracing_sample_ratio = sizing("tracingSampleRatio", config.get_float)
+if not 0 <= tracing_sample_ratio <= 1:
+    raise ValueError("tracingSampleRatio precisa estar entre 0 e 1")
+# Orçamentos de queries por view (core/querybudget.py): "raise" falha a
+# requisição que estoura o orçamento, "log" só registra uma amostra delas
+query_budget_mode = sizing("queryBudgetMode")
+if query_budget_mode not in ("raise", "log", "off"):
+    raise ValueError(f"queryBudgetMode '{query_budget_mode}' inválido; use raise, log ou off")
+
+# O PgBouncer embutido do flexible server não existe no tier Burstable: fica
+# desligado por padrão nele e ligado nos tiers GeneralPurpose/MemoryOptimized
+pgbouncer_enabled = config.get_bool("pgbouncerEnabled")
+if pgbouncer_enabled is None:
+    pgbouncer_enabled = postgres_sku["tier"] != "Burstable"
+elif pgbouncer_enabled and postgres_sku["tier"] == "Burstable":
+    raise ValueError(
+        f"O PgBouncer embutido não é suportado no tier Burstable ({postgres_sku['name']}); "
+        f"use um SKU GeneralPurpose ou MemoryOptimized ou pulumi config set pgbouncerEnabled false"
+    )
+pgbouncer_pool_mode = config.get("pgbouncerPoolMode") or "transaction"
+pgbouncer_pool_size = sizing("pgbouncerPoolSize", config.get_int)
+postgres_port = "6432" if pgbouncer_enabled else "5432"
+# "wsgi" (padrão) ou "asgi" para rodar o gunicorn com workers do uvicorn
+server_mode = config.get("serverMode") or "wsgi"
+
+# SKU do App Service Plan e autoscale (pulumi config set --path autoscale.maximum 5)
+APP_SERVICE_TIERS = {
+    "F1": "Free",
+    "B1": "Basic", "B2": "Basic", "B3": "Basic",
+    "S1": "Standard", "S2": "Standard", "S3": "Standard",
+    "P1v2": "PremiumV2", "P2v2": "PremiumV2", "P3v2": "PremiumV2",
+    "P0v3": "PremiumV3", "P1v3": "PremiumV3", "P2v3": "PremiumV3", "P3v3": "PremiumV3",
+}
+AUTOSCALE_TIERS = {"Standard", "PremiumV2", "PremiumV3"}
+
+app_service_sku = sizing("appServicePlanSku")
+if app_service_sku not in APP_SERVICE_TIERS:
+    raise ValueError(f"appServicePlanSku '{app_service_sku}' inválido; use um de {sorted(APP_SERVICE_TIERS)}")
+app_service_tier = APP_SERVICE_TIERS[app_service_sku]
+if worker_plan_sku not in APP_SERVICE_TIERS:
+    raise ValueError(f"workerPlanSku '{worker_plan_sku}' inválido; use um de {sorted(APP_SERVICE_TIERS)}")
+
+# Cada limite de entrada fica abaixo do de saída dividido por 2: ao sair de 2
+# instâncias o Azure projeta a métrica em 1 e não escala para dentro se a
+# projeção disparar a regra de saída (benchmarks/autoscale_rules.py)
+autoscale = {
+    **sizing_profile["autoscale"],
+    "cooldown": "PT5M",
+    "cpuScaleOut": 70, "cpuScaleIn": 30,
+    "memoryScaleOut": 80, "memoryScaleIn": 35,
+    "httpQueueScaleOut": 100, "httpQueueScaleIn": 10,
+    **(config.get_object("autoscale") or {}),
+}
+if autoscale["enabled"] and app_service_tier not in AUTOSCALE_TIERS:
+    raise ValueError(
+        f"Autoscale não é suportado no tier {app_service_tier} ({app_service_sku}); "
+        f"use um SKU Standard ou Premium, por exemplo S1 ou P1v3"
+    )
+if not autoscale["minimum"] <= autoscale["default"] <= autoscale["maximum"]:
+    raise ValueError("autoscale precisa de minimum <= default <= maximum")
+
+# Nomes físicos fixos, sem o sufixo aleatório do Pulumi (o antigo maincopy.py):
+# pulumi config set fixedNames true
+fixed_names = config.get_bool("fixedNames") or False
+
+
+def physical_name(arg, name):
+    return {arg: name} if fixed_names else {}
+
+
+# Nomes determinísticos para o Postgres e o Redis (opcional): com os hostnames
+# conhecidos de antemão a WebApp não depende desses recursos (os mais lentos,
+# 10-20 min) e tudo é provisionado em paralelo. Mudar o nome substitui o
+# servidor e o cache, então stacks existentes mantêm os nomes gerados pelo
+# Pulumi, a não ser que fixem os atuais com postgresServerName / redisCacheName:
+# pulumi config set deterministicNames true
+deterministic_names = config.get_bool("deterministicNames") or False
+explicit_names = fixed_names or deterministic_names
+if fixed_names:
+    name_suffix = ""
+else:
+    name_suffix = "-" + hashlib.sha1(f"{pulumi.get_project()}/{pulumi.get_stack()}".encode()).hexdigest()[:6]
+postgres_server_name = config.get("postgresServerName") or (
+    f"cookiecutter-pulumi-django-server{name_suffix}" if explicit_names else None
+)
+redis_cache_name = config.get("redisCacheName") or (
+    f"cookiecutter-pulumi-django-cache{name_suffix}" if explicit_names else None
+)
+
+
+def postgres_host(server, server_name):
+    if server_name:
+        return f"{server_name}.postgres.database.azure.com"
+    return pulumi.Output.concat(server.name, ".postgres.database.azure.com")
+
 
 # Criando o Resource Group
 resource_group = resources.ResourceGroup(
     resource_group_name,
-    location=location_brazilsouth
+    location=location_brazilsouth,
+    **physical_name("resource_group_name", resource_group_name)
 )
 
 # Criando Virtual Network
 vnet = network.VirtualNetwork(
     "cookiecutter-pulumi-djangoVnet",
+    **physical_name("virtual_network_name", "cookiecutter-pulumi-django-vnet"),
     resource_group_name=resource_group.name,
     location=resource_group.location,
     address_space=network.AddressSpaceArgs(
@@ -32,6 +253,7 @@ vnet = network.VirtualNetwork(
 # Criando Subnet para PostgreSQL e Redis
 subnet_main = network.Subnet(
     "cookiecutter-pulumi-django-subnet",
+    **physical_name("subnet_name", "cookiecutter-pulumi-django-subnet"),
     resource_group_name=resource_group.name,
     virtual_network_name=vnet.name,
     address_prefix="10.0.1.0/24"
@@ -40,6 +262,7 @@ subnet_main = network.Subnet(
 # Criando Subnet para PostgreSQL com delegação para PostgreSQL
 subnet_postgres = network.Subnet(
     "cookiecutter-pulumi-django-subnet-postgres",
+    **physical_name("subnet_name", "cookiecutter-pulumi-django-subnet-postgres"),
     resource_group_name=resource_group.name,
     virtual_network_name=vnet.name,
     address_prefix="10.0.2.0/24",
@@ -52,6 +275,7 @@ subnet_postgres = network.Subnet(
 
 subnet_app = network.Subnet(
     "cookiecutter-pulumi-django-subnet-app",
+    **physical_name("subnet_name", "cookiecutter-pulumi-django-subnet-app"),
     resource_group_name=resource_group.name,
     virtual_network_name=vnet.name,
     address_prefix="10.0.3.0/24",
@@ -81,18 +305,20 @@ private_dns_postgres = network.PrivateZone(
 # Criando Redis Cache
 redis_cache = cache.Redis(
     "cookiecutter-pulumi-django-cache",
+    **({"name": redis_cache_name} if redis_cache_name else {}),
     resource_group_name=resource_group.name,
     location=resource_group.location,
     sku=cache.SkuArgs(
-        name="Standard",
-        family="C",
-        capacity=1
+        name=redis_sku["name"],
+        family=redis_sku["family"],
+        capacity=redis_sku["capacity"]
     )
 )
 
 # Criando Private Endpoint para Redis Cache
 private_endpoint_redis = network.PrivateEndpoint(
     "cookiecutter-pulumi-django-cache-privateEndpoint",
+    **physical_name("private_endpoint_name", "cookiecutter-pulumi-django-cache-privateEndpoint"),
     resource_group_name=resource_group.name,
     location=resource_group.location,
     private_link_service_connections=[network.PrivateLinkServiceConnectionArgs(
@@ -108,6 +334,7 @@ private_endpoint_redis = network.PrivateEndpoint(
 # Criando Virtual Network Link para Redis DNS
 vnet_link_redis = network.VirtualNetworkLink(
     "privatelink.redis.cache.windows.net-applink",
+    **physical_name("virtual_network_link_name", "privatelink.redis.cache.windows.net-applink"),
     resource_group_name=resource_group.name,
     location=location_global,
     private_zone_name=private_dns_redis.name,
@@ -120,11 +347,12 @@ vnet_link_redis = network.VirtualNetworkLink(
 # PostgreSQL Server
 postgres_server = dbforpostgresql.Server(
     "cookiecutter-pulumi-django-server",
+    **({"server_name": postgres_server_name} if postgres_server_name else {}),
     resource_group_name=resource_group.name,
     location="brazilsouth",
     sku=dbforpostgresql.SkuArgs(
-        name="Standard_B2ms",
-        tier="Burstable",
+        name=postgres_sku["name"],
+        tier=postgres_sku["tier"],
     ),
     version=dbforpostgresql.ServerVersion.SERVER_VERSION_12,
     administrator_login="admin_user",
@@ -133,7 +361,11 @@ postgres_server = dbforpostgresql.Server(
         password_auth=dbforpostgresql.PasswordAuthEnum.DISABLED,
         active_directory_auth=dbforpostgresql.ActiveDirectoryAuthEnum.ENABLED,
     ),
-    storage=dbforpostgresql.StorageArgs(storage_size_gb=32),
+    storage=dbforpostgresql.StorageArgs(
+        storage_size_gb=postgres_storage_size_gb,
+        tier=postgres_storage_tier,
+        auto_grow=dbforpostgresql.StorageAutoGrow.ENABLED,
+    ),
     backup=dbforpostgresql.BackupArgs(
         backup_retention_days=7,
         geo_redundant_backup=dbforpostgresql.GeoRedundantBackupEnum.DISABLED,
@@ -144,9 +376,143 @@ postgres_server = dbforpostgresql.Server(
     )
 )
 
+
+
+def postgres_parameters(vcpus, memory_gb, connection_limit):
+    """Parâmetros do servidor calculados a partir de vCPUs e memória do SKU."""
+    memory_kb = memory_gb * 1024 * 1024
+    max_connections = min(connection_limit, max(50, memory_gb * 25))
+    # work_mem é por operação de sort/hash; ~3 por conexão no pior caso
+    work_mem_kb = (memory_kb - memory_kb // 4) // (max_connections * 3)
+    return {
+        # shared_buffers e effective_cache_size são em páginas de 8 kB
+        "shared_buffers": memory_kb // 4 // 8,
+        "effective_cache_size": memory_kb * 3 // 4 // 8,
+        "work_mem": min(max(work_mem_kb, 4096), 262144),
+        "maintenance_work_mem": min(memory_kb // 16, 2 * 1024 * 1024),
+        "max_connections": max_connections,
+        # Storage em SSD: acesso aleatório custa quase o mesmo que o sequencial
+        "random_page_cost": "1.1",
+        # Os thresholds do autovacuum ficam no padrão (50): só aplicamos valores
+        # diferentes do padrão, cada parâmetro custa uma operação no servidor
+        "autovacuum_vacuum_scale_factor": "0.05",
+        "autovacuum_analyze_scale_factor": "0.02",
+        "autovacuum_vacuum_cost_limit": 200 * vcpus,
+        "shared_preload_libraries": "pg_stat_statements",
+        "azure.extensions": "PG_STAT_STATEMENTS",
+        "pg_stat_statements.track": "top",
+        "track_io_timing": "on",
+    }
+
+
+# Qualquer parâmetro pode ser sobrescrito pela stack:
+# pulumi config set --path 'postgresParameters.work_mem' 16384
+server_parameters = {
+    **postgres_parameters(*POSTGRES_SKUS[postgres_sku["name"]]),
+    **(config.get_object("postgresParameters") or {}),
+}
+# O pool do PgBouncer precisa deixar ao menos 15 conexões livres abaixo de
+# max_connections (superuser, replicação, migrações); nos SKUs menores o
+# tamanho do perfil é reduzido em vez de falhar
+max_pool_size = max(int(server_parameters["max_connections"]) - 15, 1)
+if pgbouncer_enabled and pgbouncer_pool_size > max_pool_size:
+    pulumi.log.warn(
+        f"pgbouncerPoolSize ({pgbouncer_pool_size}) reduzido para {max_pool_size}: "
+        f"max_connections é {server_parameters['max_connections']} no {postgres_sku['name']}"
+    )
+    pgbouncer_pool_size = max_pool_size
+
+# Habilitando o PgBouncer embutido do flexible server (porta 6432); no tier
+# Burstable os parâmetros pgbouncer.* nem existem
+if pgbouncer_enabled:
+    server_parameters.update({
+        "pgbouncer.enabled": "true",
+        "pgbouncer.pool_mode": pgbouncer_pool_mode,
+        "pgbouncer.default_pool_size": str(pgbouncer_pool_size),
+    })
+elif postgres_sku["tier"] != "Burstable":
+    server_parameters["pgbouncer.enabled"] = "false"
+
+
+# Parâmetros que são listas: somamos os nossos itens aos que o Azure já
+# configura (pg_cron, extensões liberadas pela stack...) em vez de substituí-los
+LIST_PARAMETERS = {"shared_preload_libraries", "azure.extensions"}
+
+
+def merged_list(current, wanted):
+    items = [item.strip() for item in (current or "").split(",") if item.strip()]
+    for item in wanted.split(","):
+        if item.strip().lower() not in {existing.lower() for existing in items}:
+            items.append(item.strip())
+    return ",".join(items)
+
+
+def configure_server(server, logical_name):
+    """Aplica server_parameters ao servidor e devolve o último parâmetro."""
+    # O servidor só aceita uma alteração de parâmetro por vez (em paralelo o
+    # Azure responde ServerIsBusy), então encadeamos.
+    # shared_buffers, max_connections e shared_preload_libraries só valem depois
+    # de reiniciar o servidor (az postgres flexible-server restart).
+    previous_parameter = None
+    for parameter_name, parameter_value in server_parameters.items():
+        value = str(parameter_value)
+        if parameter_name in LIST_PARAMETERS:
+            current = dbforpostgresql.get_configuration_output(
+                configuration_name=parameter_name,
+                resource_group_name=resource_group.name,
+                server_name=server.name,
+            )
+            value = current.value.apply(lambda current_value, wanted=value: merged_list(current_value, wanted))
+        previous_parameter = dbforpostgresql.Configuration(
+            f"{logical_name}-{parameter_name}",
+            configuration_name=parameter_name,
+            resource_group_name=resource_group.name,
+            server_name=server.name,
+            source="user-override",
+            value=value,
+            opts=pulumi.ResourceOptions(depends_on=[previous_parameter] if previous_parameter else None),
+        )
+    return previous_parameter
+
+
+postgres_configured = configure_server(postgres_server, "cookiecutter-pulumi-django-server")
+
+# Réplicas de leitura: mesmo SKU, storage e rede do primário. Só são criadas
+# depois da configuração do primário, que não aceita as duas operações juntas.
+postgres_replicas = []
+postgres_replica_hosts = []
+for index in range(postgres_replica_count):
+    replica_name = f"{postgres_server_name}-replica-{index}" if postgres_server_name else None
+    replica = dbforpostgresql.Server(
+        f"cookiecutter-pulumi-django-server-replica-{index}",
+        **({"server_name": replica_name} if replica_name else {}),
+        resource_group_name=resource_group.name,
+        location="brazilsouth",
+        create_mode=dbforpostgresql.CreateMode.REPLICA,
+        source_server_resource_id=postgres_server.id,
+        sku=dbforpostgresql.SkuArgs(
+            name=postgres_sku["name"],
+            tier=postgres_sku["tier"],
+        ),
+        storage=dbforpostgresql.StorageArgs(
+            storage_size_gb=postgres_storage_size_gb,
+            tier=postgres_storage_tier,
+            auto_grow=dbforpostgresql.StorageAutoGrow.ENABLED,
+        ),
+        network=dbforpostgresql.NetworkArgs(
+            delegated_subnet_resource_id=subnet_postgres.id,
+            private_dns_zone_arm_resource_id=private_dns_postgres.id
+        ),
+        opts=pulumi.ResourceOptions(depends_on=[postgres_configured]),
+    )
+    configure_server(replica, f"cookiecutter-pulumi-django-server-replica-{index}")
+    postgres_replicas.append(replica)
+    postgres_replica_hosts.append(postgres_host(replica, replica_name))
+
 # Criando Virtual Network Link para PostgreSQL DNS
 vnet_link_postgres = network.VirtualNetworkLink(
     "privatelink.postgres.database.azure.com-dblink",
+    **physical_name("virtual_network_link_name", "privatelink.postgres.database.azure.com-dblink"),
     resource_group_name=resource_group.name,
     location=location_global,
     private_zone_name=private_dns_postgres.name,
@@ -159,42 +525,250 @@ vnet_link_postgres = network.VirtualNetworkLink(
 # Criando App Service Plan
 app_service_plan = web.AppServicePlan(
     "ASP-cookiecutterpulumi123group",
+    **physical_name("name", "ASP-cookiecutterpulumi123group"),
     resource_group_name=resource_group.name,
     location=resource_group.location,
     kind="linux",
     reserved=True,
     sku=web.SkuDescriptionArgs(
-        name="B1",
-        tier="Basic",
-        capacity=1
+        name=app_service_sku,
+        tier=app_service_tier,
+        capacity=autoscale["default"]
+    ),
+    # Com autoscale a capacidade é gerenciada pelo Azure, não pelo Pulumi
+    opts=pulumi.ResourceOptions(ignore_changes=["sku.capacity"] if autoscale["enabled"] else None),
+)
+
+
+def scale_rule(metric_name, operator, threshold, direction):
+    return insights.ScaleRuleArgs(
+        metric_trigger=insights.MetricTriggerArgs(
+            metric_name=metric_name,
+            metric_namespace="microsoft.web/serverfarms",
+            metric_resource_uri=app_service_plan.id,
+            operator=operator,
+            statistic=insights.MetricStatisticType.AVERAGE,
+            threshold=threshold,
+            time_aggregation=insights.TimeAggregationType.AVERAGE,
+            time_grain="PT1M",
+            time_window="PT10M",
+        ),
+        scale_action=insights.ScaleActionArgs(
+            direction=direction,
+            type=insights.ScaleType.CHANGE_COUNT,
+            value="1",
+            cooldown=autoscale["cooldown"],
+        ),
+    )
+
+
+# Autoscale do plano: escala para fora se QUALQUER regra de saída disparar e
+# para dentro somente quando TODAS as regras de entrada forem atendidas
+if autoscale["enabled"]:
+    scale_out, scale_in = insights.ScaleDirection.INCREASE, insights.ScaleDirection.DECREASE
+    greater, less = insights.ComparisonOperationType.GREATER_THAN, insights.ComparisonOperationType.LESS_THAN
+    app_service_autoscale = insights.AutoscaleSetting(
+        "ASP-cookiecutterpulumi123group-autoscale",
+        resource_group_name=resource_group.name,
+        location=resource_group.location,
+        target_resource_uri=app_service_plan.id,
+        enabled=True,
+        profiles=[insights.AutoscaleProfileArgs(
+            name="default",
+            capacity=insights.ScaleCapacityArgs(
+                minimum=str(autoscale["minimum"]),
+                maximum=str(autoscale["maximum"]),
+                default=str(autoscale["default"]),
+            ),
+            rules=[
+                scale_rule("CpuPercentage", greater, autoscale["cpuScaleOut"], scale_out),
+                scale_rule("CpuPercentage", less, autoscale["cpuScaleIn"], scale_in),
+                scale_rule("MemoryPercentage", greater, autoscale["memoryScaleOut"], scale_out),
+                scale_rule("MemoryPercentage", less, autoscale["memoryScaleIn"], scale_in),
+                scale_rule("HttpQueueLength", greater, autoscale["httpQueueScaleOut"], scale_out),
+                scale_rule("HttpQueueLength", less, autoscale["httpQueueScaleIn"], scale_in),
+            ],
+        )],
+    )
+
+# Azure Front Door (Standard) para os arquivos estáticos: os nomes com hash
+# gerados pelo collectstatic são imutáveis, então a borda guarda cada arquivo
+# até o próximo deploy e o Django só os serve na primeira requisição de cada PoP
+if cdn_enabled:
+    cdn_profile = cdn.Profile(
+        "cookiecutter-pulumi-django-cdn",
+        resource_group_name=resource_group.name,
+        location=location_global,
+        sku=cdn.SkuArgs(name=cdn.SkuName.STANDARD_AZURE_FRONT_DOOR),
     )
+    cdn_endpoint = cdn.AFDEndpoint(
+        "cookiecutter-pulumi-django-static",
+        resource_group_name=resource_group.name,
+        profile_name=cdn_profile.name,
+        location=location_global,
+        enabled_state=cdn.EnabledState.ENABLED,
+    )
+    static_url = pulumi.Output.concat("https://", cdn_endpoint.host_name, "/static/")
+else:
+    static_url = "/static/"
+
+# Application Insights (o mesmo do infra/appinsights.bicep) sobre um workspace
+# do Log Analytics; a aplicação envia os traces do OpenTelemetry para ele
+log_analytics_workspace = operationalinsights.Workspace(
+    "cookiecutter-pulumi-django-workspace",
+    resource_group_name=resource_group.name,
+    location=resource_group.location,
+    sku=operationalinsights.WorkspaceSkuArgs(name=operationalinsights.WorkspaceSkuNameEnum.PER_GB2018),
+    retention_in_days=30,
 )
+app_insights = insights.Component(
+    "cookiecutter-pulumi-django-appinsights",
+    resource_group_name=resource_group.name,
+    location=resource_group.location,
+    kind="web",
+    application_type=insights.ApplicationType.WEB,
+    workspace_resource_id=log_analytics_workspace.id,
+    ingestion_mode=insights.IngestionMode.LOG_ANALYTICS,
+)
+
+# Com nomes gerados pelo Pulumi, os hostnames só existem depois do recurso
+if redis_cache_name:
+    redis_url = f"redis://{redis_cache_name}.redis.cache.windows.net:6379"
+else:
+    redis_url = pulumi.Output.concat("redis://", redis_cache.host_name, ":6379")
+
+# Configurações comuns à WebApp e aos workers da fila de tarefas
+app_settings = [
+    web.NameValuePairArgs(name="POSTGRES_DB", value='postgres'),
+    web.NameValuePairArgs(name="POSTGRES_USER", value="admin_user"),
+    web.NameValuePairArgs(name="POSTGRES_PASSWORD", value="Admin@123"),
+    web.NameValuePairArgs(name="POSTGRES_HOST", value=postgres_host(postgres_server, postgres_server_name)),
+    web.NameValuePairArgs(name="POSTGRES_PORT", value=postgres_port),
+    web.NameValuePairArgs(name="POSTGRES_REPLICA_HOSTS", value=pulumi.Output.all(*postgres_replica_hosts).apply(",".join)),
+    web.NameValuePairArgs(name="POSTGRES_PGBOUNCER", value=pgbouncer_pool_mode if pgbouncer_enabled else ""),
+    web.NameValuePairArgs(name="DJANGO_SETTINGS_MODULE", value="core.settings"),
+    web.NameValuePairArgs(name="REDIS_URL", value=redis_url),
+    web.NameValuePairArgs(name="SECRET_KEY", value=secret_key),
+    web.NameValuePairArgs(name="SERVER_MODE", value=server_mode),
+    web.NameValuePairArgs(name="STATIC_URL", value=static_url),
+    web.NameValuePairArgs(name="GUNICORN_MAX_WORKERS", value=str(gunicorn_max_workers)),
+    web.NameValuePairArgs(name="GUNICORN_MAX_THREADS", value=str(gunicorn_max_threads)),
+    # Cada deploy invalida o cache de views/fragmentos (core/caching.py)
+    web.NameValuePairArgs(name="VIEW_CACHE_VERSION", value=os.getenv("GITHUB_SHA", "1")),
+    web.NameValuePairArgs(name="APPLICATIONINSIGHTS_CONNECTION_STRING", value=app_insights.connection_string),
+    web.NameValuePairArgs(name="TRACING_SAMPLE_RATIO", value=str(tracing_sample_ratio)),
+    web.NameValuePairArgs(name="QUERY_BUDGET_MODE", value=query_budget_mode),
+    # Sem workers provisionados as tarefas rodam dentro da requisição
+    web.NameValuePairArgs(name="TASKS_EAGER", value="" if workers_enabled else "true"),
+]
+if gunicorn_workers is not None:
+    app_settings.append(web.NameValuePairArgs(name="GUNICORN_WORKERS", value=str(gunicorn_workers)))
+if gunicorn_threads is not None:
+    app_settings.append(web.NameValuePairArgs(name="GUNICORN_THREADS", value=str(gunicorn_threads)))
 
 # Criar o App Service para hospedar a aplicação Django
 app_service = web.WebApp(
     "cookiecutter-pulumi-django",
+    **physical_name("name", "cookiecutter-pulumi-django"),
     resource_group_name=resource_group.name,
     server_farm_id=app_service_plan.id,
     site_config=web.SiteConfigArgs(
         linux_fx_version="PYTHON|3.10",
-        app_settings=[
-            web.NameValuePairArgs(name="POSTGRES_DB", value='postgres'),
-            web.NameValuePairArgs(name="POSTGRES_USER", value="admin_user"),
-            web.NameValuePairArgs(name="POSTGRES_PASSWORD", value="Admin@123"),
-            web.NameValuePairArgs(name="POSTGRES_HOST", value=Output.concat(postgres_server.name, ".postgres.database.azure.com")),
-            web.NameValuePairArgs(name="DJANGO_SETTINGS_MODULE", value="core.settings"),
-            web.NameValuePairArgs(name="REDIS_URL", value=Output.concat("redis://", redis_cache.host_name, ":6379")),
-            web.NameValuePairArgs(name="SECRET_KEY", value=secret_key),
-        ],
+        app_command_line="startup.sh",
+        app_settings=app_settings,
     ),
     vnet_route_all_enabled=True,
     virtual_network_subnet_id=subnet_app.id,
     location=resource_group.location
 )
 
+# Workers da fila de tarefas: plano próprio, na mesma subnet da WebApp (o Azure
+# aceita vários planos numa subnet delegada), com o mesmo Redis e banco.
+# Escalam pela quantidade de instâncias (pulumi config set workerInstances 3)
+# e pelas threads por instância (workerConcurrency).
+if workers_enabled:
+    worker_plan = web.AppServicePlan(
+        "ASP-cookiecutterpulumi123group-worker",
+        **physical_name("name", "ASP-cookiecutterpulumi123group-worker"),
+        resource_group_name=resource_group.name,
+        location=resource_group.location,
+        kind="linux",
+        reserved=True,
+        sku=web.SkuDescriptionArgs(
+            name=worker_plan_sku,
+            tier=APP_SERVICE_TIERS[worker_plan_sku],
+            capacity=worker_instances
+        ),
+    )
+    worker_app = web.WebApp(
+        "cookiecutter-pulumi-django-worker",
+        **physical_name("name", "cookiecutter-pulumi-django-worker"),
+        resource_group_name=resource_group.name,
+        server_farm_id=worker_plan.id,
+        site_config=web.SiteConfigArgs(
+            linux_fx_version="PYTHON|3.10",
+            app_command_line="worker.sh",
+            # O worker não atende usuários, mas precisa ficar sempre de pé
+            always_on=worker_plan_sku != "F1",
+            app_settings=app_settings + [
+                web.NameValuePairArgs(name="TASK_WORKER_CONCURRENCY", value=str(worker_concurrency)),
+            ],
+        ),
+        vnet_route_all_enabled=True,
+        virtual_network_subnet_id=subnet_app.id,
+        location=resource_group.location
+    )
+    pulumi.export("worker_app_name", worker_app.name)
+
+if cdn_enabled:
+    cdn_origin_group = cdn.AFDOriginGroup(
+        "cookiecutter-pulumi-django-static-origins",
+        resource_group_name=resource_group.name,
+        profile_name=cdn_profile.name,
+        load_balancing_settings=cdn.LoadBalancingSettingsParametersArgs(
+            sample_size=4,
+            successful_samples_required=3,
+        ),
+        health_probe_settings=cdn.HealthProbeParametersArgs(
+            probe_path="/healthz/",
+            probe_protocol=cdn.ProbeProtocol.HTTPS,
+            probe_request_type=cdn.HealthProbeRequestType.GET,
+            probe_interval_in_seconds=120,
+        ),
+    )
+    cdn_origin = cdn.AFDOrigin(
+        "cookiecutter-pulumi-django-static-origin",
+        resource_group_name=resource_group.name,
+        profile_name=cdn_profile.name,
+        origin_group_name=cdn_origin_group.name,
+        host_name=app_service.default_host_name,
+        origin_host_header=app_service.default_host_name,
+        https_port=443,
+        enabled_state=cdn.EnabledState.ENABLED,
+    )
+    cdn_route = cdn.Route(
+        "cookiecutter-pulumi-django-static-route",
+        resource_group_name=resource_group.name,
+        profile_name=cdn_profile.name,
+        endpoint_name=cdn_endpoint.name,
+        origin_group=cdn.ResourceReferenceArgs(id=cdn_origin_group.id),
+        patterns_to_match=["/static/*"],
+        supported_protocols=[cdn.AFDEndpointProtocols.HTTPS],
+        https_redirect=cdn.HttpsRedirect.DISABLED,
+        forwarding_protocol=cdn.ForwardingProtocol.HTTPS_ONLY,
+        link_to_default_domain=cdn.LinkToDefaultDomain.ENABLED,
+        # O WhiteNoise já entrega as variantes .br/.gz prontas; a borda só as guarda
+        cache_configuration=cdn.AfdRouteCacheConfigurationArgs(
+            query_string_caching_behavior=cdn.AfdQueryStringCachingBehavior.IGNORE_QUERY_STRING,
+        ),
+        opts=pulumi.ResourceOptions(depends_on=[cdn_origin]),
+    )
+    pulumi.export("static_url", static_url)
+
 # Criando Managed Identity
 managed_identity = managedidentity.UserAssignedIdentity(
     "cookiecutter-pul-id",
+    **physical_name("resource_name_", "cookiecutter-pul-id"),
     resource_group_name=resource_group.name,
     location=resource_group.location
 )
@@ -203,5 +777,8 @@ managed_identity = managedidentity.UserAssignedIdentity(
 pulumi.export("resource_group_name", resource_group.name)
 pulumi.export("redis_cache_name", redis_cache.name)
 pulumi.export("postgresql_server_name", postgres_server.name)
+pulumi.export("postgresql_replica_hosts", postgres_replica_hosts)
 pulumi.export("web_app_url", app_service.default_host_name)
 pulumi.export("managed_identity_name", managed_identity.name)
+pulumi.export("app_insights_name", app_insights.name)
+pulumi.export("sizing_profile", sizing_profile_name)
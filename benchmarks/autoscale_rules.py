@@ -0,0 +1,145 @@
+"""
+App Service autoscale rules of every sizing profile, offline.
+
+Runs __main__.py against Pulumi mocks once per profile in SIZING_PROFILES
+(no Azure credentials, nothing is created), collects the App Service Plan
+and its AutoscaleSetting, and checks that:
+
+- autoscale is on exactly when the profile enables it, on a tier that
+  supports it, with the plan starting at the profile's default capacity;
+- every metric has one scale-out and one scale-in rule of one instance,
+  against the plan, with the scale-in threshold below the scale-out one;
+- no scale-in would flap: Azure projects the metric over one instance less
+  (threshold x n / (n - 1)) and skips a scale-in that would cross the
+  scale-out threshold, which would keep the plan from ever shrinking.
+
+Exits non-zero if any check fails.
+
+    python benchmarks/autoscale_rules.py
+    python benchmarks/autoscale_rules.py --set memoryScaleIn=50
+"""
+import argparse
+import asyncio
+import json
+import runpy
+import sys
+from pathlib import Path
+
+import pulumi
+from pulumi.runtime.stack import wait_for_rpcs
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+class Mocks(pulumi.runtime.Mocks):
+    def __init__(self):
+        self.resources = {}
+
+    def new_resource(self, args):
+        self.resources.setdefault(args.typ.rsplit(':', 1)[-1], {})[args.name] = args.inputs
+        return [f'{args.name}_id', {'name': args.name, 'hostName': f'{args.name}.example.net', **args.inputs}]
+
+    def call(self, args):
+        return {}
+
+
+def run_program(config):
+    mocks = Mocks()
+    pulumi.runtime.set_mocks(mocks, project='pulumi-django', stack='dev', preview=False)
+    for key, value in config.items():
+        pulumi.runtime.set_config(f'pulumi-django:{key}', value)
+    namespace = runpy.run_path(str(ROOT / '__main__.py'))
+    asyncio.get_event_loop().run_until_complete(wait_for_rpcs())
+    return namespace, mocks.resources
+
+
+def check(profile, plan, setting, autoscale_tiers):
+    expected = profile['autoscale']
+    problems = []
+    if int(plan['sku']['capacity']) != expected['default']:
+        problems.append(f"plan capacity {plan['sku']['capacity']} is not the default {expected['default']}")
+    if setting is None:
+        if expected['enabled']:
+            problems.append('autoscale is enabled in the profile but no AutoscaleSetting was created')
+        return problems
+    if not expected['enabled']:
+        problems.append('autoscale is disabled in the profile but an AutoscaleSetting was created')
+    if plan['sku']['tier'] not in autoscale_tiers:
+        problems.append(f"tier {plan['sku']['tier']} does not support autoscale")
+
+    (autoscale_profile,) = setting['profiles']
+    capacity = {key: int(value) for key, value in autoscale_profile['capacity'].items()}
+    if capacity != {key: expected[key] for key in ('minimum', 'maximum', 'default')}:
+        problems.append(f'capacity {capacity} does not match the profile')
+
+    rules = {}
+    for rule in autoscale_profile['rules']:
+        trigger, action = rule['metricTrigger'], rule['scaleAction']
+        if trigger['metricResourceUri'] != setting['targetResourceUri']:
+            problems.append(f"{trigger['metricName']} rule watches another resource")
+        if (action['type'], action['value']) != ('ChangeCount', '1'):
+            problems.append(f"{trigger['metricName']} rule changes {action['value']} instances at a time")
+        key = (trigger['metricName'], action['direction'])
+        if key in rules:
+            problems.append(f'two {key[1]} rules on {key[0]}')
+        rules[key] = trigger
+    for metric in sorted({metric for metric, _ in rules}):
+        scale_out, scale_in = rules.get((metric, 'Increase')), rules.get((metric, 'Decrease'))
+        if scale_out is None or scale_in is None:
+            problems.append(f'{metric} has no {"scale-out" if scale_out is None else "scale-in"} rule')
+            continue
+        if (scale_out['operator'], scale_in['operator']) != ('GreaterThan', 'LessThan'):
+            problems.append(f'{metric} rules compare the wrong way')
+        out_threshold, in_threshold = scale_out['threshold'], scale_in['threshold']
+        if in_threshold >= out_threshold:
+            problems.append(f'{metric} scale-in threshold {in_threshold} is not below scale-out {out_threshold}')
+        for instances in range(capacity['minimum'] + 1, capacity['maximum'] + 1):
+            projected = in_threshold * instances / (instances - 1)
+            if projected >= out_threshold:
+                problems.append(
+                    f'{metric} never scales in from {instances} instances: {in_threshold} projects to '
+                    f'{projected:.0f} on {instances - 1}, over the scale-out threshold {out_threshold}'
+                )
+                break
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override an autoscale setting (pulumi config autoscale) for every profile')
+    args = parser.parse_args()
+    overrides = {key: json.loads(value) for key, value in (item.split('=', 1) for item in args.set)}
+
+    sys.path.insert(0, str(ROOT))
+    namespace, _ = run_program({})
+    profiles, autoscale_tiers = namespace['SIZING_PROFILES'], namespace['AUTOSCALE_TIERS']
+
+    print(f'{"profile":<22} {"sku":<6} {"min":>3} {"max":>3} {"default":>7}  rules')
+    failures = 0
+    for name, profile in profiles.items():
+        config = {'sizingProfile': name}
+        if overrides:
+            config['autoscale'] = json.dumps(overrides)
+        _, resources = run_program(config)
+        plan = resources['AppServicePlan']['ASP-cookiecutterpulumi123group']
+        setting = resources.get('AutoscaleSetting', {}).get('ASP-cookiecutterpulumi123group-autoscale')
+        if setting is None:
+            print(f'{name:<22} {plan["sku"]["name"]:<6} {"autoscale off":>15}')
+        else:
+            capacity = setting['profiles'][0]['capacity']
+            rules = ', '.join(
+                f'{rule["metricTrigger"]["metricName"]}{">" if rule["scaleAction"]["direction"] == "Increase" else "<"}'
+                f'{rule["metricTrigger"]["threshold"]:g}'
+                for rule in setting['profiles'][0]['rules']
+            )
+            print(f'{name:<22} {plan["sku"]["name"]:<6} {capacity["minimum"]:>3} {capacity["maximum"]:>3} '
+                  f'{capacity["default"]:>7}  {rules}')
+        for problem in check(profile, plan, setting, autoscale_tiers):
+            print(f'  FAIL {problem}')
+            failures += 1
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
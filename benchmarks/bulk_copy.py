@@ -0,0 +1,175 @@
+"""
+Throughput and peak memory of the import_rows and export_rows commands.
+
+Writes ``--rows`` users to a CSV file, then runs each command in its own
+process, against a fresh SQLite database (batched bulk_create) or, with
+POSTGRES_HOST set, a throwaway test database on that server (COPY):
+
+1. import the CSV;
+2. export it again as CSV and as JSON Lines;
+3. import the JSON Lines into an emptied table.
+
+Prints rows per second and the peak RSS of every step. With
+``--loaddata-rows``, does the same with dumpdata and loaddata on that many
+rows for comparison. Exits with status 1 if a step loses or invents rows,
+the exported CSV differs from the imported one, or a command's peak RSS
+goes over ``--max-rss-mb``.
+
+    python benchmarks/bulk_copy.py --rows 10000000
+    POSTGRES_HOST=localhost POSTGRES_USER=postgres POSTGRES_PASSWORD=... python benchmarks/bulk_copy.py
+"""
+import argparse
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+HEADER = ['id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email', 'is_staff',
+          'is_active', 'date_joined']
+
+
+def child(database, command):
+    """Run one management command (in its own process) against ``database``."""
+    import django
+    from django.conf import settings
+
+    if os.getenv('POSTGRES_HOST'):
+        if command[0] != 'create':
+            settings.DATABASES['default']['NAME'] = database
+    else:
+        settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': database}}
+    settings.DATABASE_REPLICAS = []
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+
+    if command[0] == 'count':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM auth_user')
+            print(cursor.fetchone()[0])
+    elif command[0] == 'empty':
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM auth_user')
+    elif command[0] == 'create':
+        if connection.vendor == 'postgresql':
+            print(connection.creation.create_test_db(verbosity=0, autoclobber=True))
+        else:
+            call_command('migrate', verbosity=0)
+            print(database)
+    elif command[0] == 'destroy':
+        connection.creation.destroy_test_db(command[1], verbosity=0)
+    else:
+        call_command(*command, verbosity=0)
+
+
+def run(database, *command):
+    """Seconds, peak RSS in MiB and stdout of ``child(database, command)``."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, __file__, '--child', database, *command], stdout=subprocess.PIPE)
+    output = process.stdout.read().decode()
+    _, status, usage = os.wait4(process.pid, 0)
+    if status:
+        raise SystemExit(f'{" ".join(command)} failed with status {status}')
+    # ru_maxrss is in KiB on Linux.
+    return time.perf_counter() - start, usage.ru_maxrss / 1024, output.strip()
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(HEADER)
+        for start in range(1, rows + 1, 100000):
+            writer.writerows(
+                (i, '', 'f', f'user{i}', 'First, "quoted"' if i % 7 == 0 else 'First', f'Last {i}',
+                 f'user{i}@example.com', 't' if i % 10 == 0 else 'f', 't', '2024-01-01 00:00:00+00')
+                for i in range(start, min(start + 100000, rows + 1))
+            )
+
+
+def same_rows(expected, exported):
+    """Whether the exported CSV has the generated rows, by username, names and flags."""
+    with open(expected, newline='') as a, open(exported, newline='') as b:
+        left, right = csv.DictReader(a), csv.DictReader(b)
+        for x, y in zip(left, right, strict=True):
+            if (x['id'], x['username'], x['first_name'], x['last_name']) != \
+                    (y['id'], y['username'], y['first_name'], y['last_name']) or \
+                    (x['is_staff'] == 't') != (y['is_staff'] in ('t', 'True')):
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--loaddata-rows', type=int, default=0, help='compare with dumpdata/loaddata (default: 0, off)')
+    parser.add_argument('--max-rss-mb', type=float, default=400)
+    args = parser.parse_args()
+
+    directory = Path(tempfile.mkdtemp())
+    start = time.perf_counter()
+    write_csv(directory / 'users.csv', args.rows)
+    print(f'{args.rows:,} rows written to {directory / "users.csv"} in {time.perf_counter() - start:.1f}s\n')
+
+    database = run(str(directory / 'bulk.sqlite3'), 'create')[2]
+    chunk = ['--chunk-size', str(args.chunk_size)]
+    steps = [
+        ('import csv', ('import_rows', 'auth.User', str(directory / 'users.csv'), *chunk)),
+        ('export csv', ('export_rows', 'auth.User', str(directory / 'out.csv'), *chunk)),
+        ('export jsonl', ('export_rows', 'auth.User', str(directory / 'out.jsonl'), *chunk)),
+        ('empty', ('empty',)),
+        ('import jsonl', ('import_rows', 'auth.User', str(directory / 'out.jsonl'), *chunk)),
+    ]
+    problems = []
+    print(f'{"step":<16} {"seconds":>8} {"rows/s":>10} {"peak RSS MiB":>13}')
+    for label, command in steps:
+        seconds, rss, _ = run(database, *command)
+        if label == 'empty':
+            continue
+        print(f'{label:<16} {seconds:>8.1f} {args.rows / seconds:>10,.0f} {rss:>13.0f}')
+        count = int(run(database, 'count')[2])
+        if count != args.rows:
+            problems.append(f'{label}: {count:,} rows in the table, expected {args.rows:,}')
+        if rss > args.max_rss_mb:
+            problems.append(f'{label}: peak RSS {rss:.0f} MiB is over {args.max_rss_mb:.0f} MiB')
+    if not same_rows(directory / 'users.csv', directory / 'out.csv'):
+        problems.append('the exported CSV differs from the imported one')
+
+    if args.loaddata_rows:
+        fixture = directory / 'fixture.json'
+        write_csv(directory / 'small.csv', args.loaddata_rows)
+        run(database, 'empty')
+        run(database, 'import_rows', 'auth.User', str(directory / 'small.csv'))
+        for label, command in (
+            ('dumpdata', ('dumpdata', 'auth.User', '--output', str(fixture))),
+            ('empty', ('empty',)),
+            ('loaddata', ('loaddata', str(fixture))),
+        ):
+            seconds, rss, _ = run(database, *command)
+            if label != 'empty':
+                print(f'{label:<16} {seconds:>8.1f} {args.loaddata_rows / seconds:>10,.0f} {rss:>13.0f}'
+                      f'   ({args.loaddata_rows:,} rows)')
+
+    if os.getenv('POSTGRES_HOST'):
+        run(database, 'destroy', database)
+    for problem in problems:
+        print(f'\nFAIL: {problem}')
+    if problems:
+        sys.exit(1)
+    print('\nEvery row made it through both formats with memory bounded.')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], sys.argv[3:])
+    else:
+        main()
@@ -0,0 +1,162 @@
+"""
+Bytes stored and encode/decode (or Redis set/get) latency per cache codec.
+
+Runs every SERIALIZER_FORMAT x COMPRESSOR_ALGORITHM combination from
+core/backends/codecs.py, plus the old pickle/uncompressed default, on a few
+payloads shaped like what we cache, after checking that every combination
+reads back exactly what it wrote (int-keyed dicts, tuples, datetimes, ...).
+Combinations whose optional package
+(lz4, pyzstd) isn't installed are skipped.
+
+    python benchmarks/cache_codecs.py
+    python benchmarks/cache_codecs.py --redis-url redis://localhost:6379/0
+
+Exits with status 1 if a value doesn't round-trip.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from django.conf import settings  # noqa: E402
+
+settings.configure()
+
+from django.core.exceptions import ImproperlyConfigured  # noqa: E402
+from django_redis.exceptions import CompressorError  # noqa: E402
+from django_redis.serializers.pickle import PickleSerializer  # noqa: E402
+
+from core.backends.codecs import TaggedCompressor, TaggedSerializer  # noqa: E402
+
+PAYLOADS = {
+    'session': {
+        '_auth_user_id': '1842',
+        '_auth_user_backend': 'django.contrib.auth.backends.ModelBackend',
+        '_auth_user_hash': 'b6c1f0b3e4a1d7e38d0c2f9b1a6e4c7d2f0a9b8c7d6e5f4a3b2c1d0e9f8a7b6c',
+        '_session_expiry': 1209600,
+    },
+    'changelist': [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'is_staff': i % 7 == 0,
+         'date_joined': datetime.datetime(2024, 1, 1).isoformat(), 'groups': ['editors', 'viewers']}
+        for i in range(200)
+    ],
+    'fragment': ''.join(
+        f'<tr class="row{i % 2}"><td><a href="/admin/auth/user/{i}/change/">user{i}</a></td>'
+        f'<td>user{i}@example.com</td><td><img src="/static/admin/img/icon-no.svg" alt="False"></td></tr>'
+        for i in range(200)
+    ),
+}
+
+# Values every codec must read back equal and with the same types, except
+# that JSON returns tuples as lists.
+ROUND_TRIP = {
+    'int keys': {1: 'one', 2: {3: [4, 5]}},
+    'tuple': ('a', 1, (2.5, None)),
+    'datetime': {'at': datetime.datetime(2024, 1, 1, 12, 30, tzinfo=datetime.timezone.utc)},
+    'bytes': {'blob': b'\x00\xff' * 200},
+    'nested': PAYLOADS['changelist'][:3],
+}
+
+
+def codecs():
+    yield 'pickle (legacy)', 'none', PickleSerializer({}), TaggedCompressor({'COMPRESSOR_ALGORITHM': 'none'})
+    for fmt, algorithm in itertools.product(('msgpack', 'json', 'pickle'), ('none', 'zlib', 'lz4', 'zstd')):
+        try:
+            yield fmt, algorithm, TaggedSerializer({'SERIALIZER_FORMAT': fmt}), TaggedCompressor(
+                {'COMPRESSOR_ALGORITHM': algorithm, 'COMPRESS_MIN_LENGTH': 256}
+            )
+        except ImproperlyConfigured as exc:
+            print(f'skipping {fmt}/{algorithm}: {exc}', file=sys.stderr)
+
+
+def timed(func, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings) * 1e6
+
+
+def decode(serializer, compressor, value):
+    try:
+        value = compressor.decompress(value)
+    except CompressorError:
+        pass
+    return serializer.loads(value)
+
+
+def same(a, b):
+    """Equal, with the same types all the way down (``1 == 1.0``, ``(1,) != [1]``)."""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(map(same, a, b))
+    return a == b
+
+
+def round_trip_failures():
+    failures = []
+    for fmt, algorithm, serializer, compressor in codecs():
+        for name, value in ROUND_TRIP.items():
+            try:
+                loaded = decode(serializer, compressor, compressor.compress(serializer.dumps(value)))
+            except Exception as exc:
+                failures.append(f'{fmt}/{algorithm} {name}: {exc!r}')
+                continue
+            expected = json.loads(json.dumps(value)) if fmt == 'json' and name == 'tuple' else value
+            if not same(loaded, expected):
+                failures.append(f'{fmt}/{algorithm} {name}: {loaded!r} != {expected!r}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rounds', type=int, default=500)
+    parser.add_argument('--redis-url', help='also measure set/get round trips against this Redis')
+    args = parser.parse_args()
+
+    failures = round_trip_failures()
+    for failure in failures:
+        print(f'FAIL round trip {failure}')
+    if failures:
+        sys.exit(1)
+
+    client = None
+    if args.redis_url:
+        import redis
+        client = redis.Redis.from_url(args.redis_url)
+
+    print(f"{'payload':<11} {'serializer':<16} {'compressor':<10} {'bytes':>7} {'set us':>8} {'get us':>8}")
+    for name, payload in PAYLOADS.items():
+        for fmt, algorithm, serializer, compressor in codecs():
+            key = f'bench:codec:{name}'
+
+            def encode():
+                return compressor.compress(serializer.dumps(payload))
+
+            def store():
+                value = encode()
+                client.set(key, value)
+                return value
+
+            if client is None:
+                encoded, set_us = timed(encode, args.rounds)
+                _, get_us = timed(lambda: decode(serializer, compressor, encoded), args.rounds)
+            else:
+                encoded, set_us = timed(store, args.rounds)
+                _, get_us = timed(lambda: decode(serializer, compressor, client.get(key)), args.rounds)
+                client.delete(key)
+            print(f'{name:<11} {fmt:<16} {algorithm:<10} {len(encoded):>7} {set_us:>8.1f} {get_us:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
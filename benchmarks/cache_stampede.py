@@ -0,0 +1,71 @@
+"""
+Recomputes per expiry for core.caching.get_or_compute under concurrency.
+
+Many threads read one key whose value takes ``--compute-ms`` to build and
+expires every ``--timeout`` seconds. Without protection every thread that
+sees the expired value recomputes it; the goal is about one recompute per
+expiry. Uses local memory by default, or Redis with --redis-url.
+
+    python benchmarks/cache_stampede.py --threads 200 --seconds 10
+"""
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from django.conf import settings  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--timeout', type=float, default=1)
+    parser.add_argument('--compute-ms', type=float, default=100)
+    parser.add_argument('--redis-url')
+    args = parser.parse_args()
+
+    if args.redis_url:
+        cache = {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': args.redis_url}
+    else:
+        cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    settings.configure(CACHES={'default': cache}, VIEW_CACHE_VERSION='bench')
+
+    from core.caching import get_or_compute, make_key
+
+    key = make_key('bench.stampede', time.time())
+    computes = []
+    reads = [0]
+    lock = threading.Lock()
+
+    def compute():
+        with lock:
+            computes.append(time.time())
+        time.sleep(args.compute_ms / 1000)
+        return 'value'
+
+    deadline = time.monotonic() + args.seconds
+
+    def run():
+        while time.monotonic() < deadline:
+            get_or_compute(key, compute, args.timeout)
+            with lock:
+                reads[0] += 1
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=run) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expiries = args.seconds / (args.timeout + args.compute_ms / 1000)
+    print(f'reads: {reads[0]}')
+    print(f'recomputes: {len(computes)} (~{len(computes) / expiries:.2f} per expiry)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Load test: backend connection count and query latency as gunicorn workers grow.
+
+Each worker is a process with ``--threads`` threads that emulate request
+cycles (query, then ``close_old_connections()`` like ``request_finished``).
+While it runs, a direct connection to the server (bypassing PgBouncer) samples
+``pg_stat_activity`` so the effect of the pooler on backend count is visible.
+
+    POSTGRES_DB=... POSTGRES_USER=... POSTGRES_PASSWORD=... POSTGRES_HOST=... \\
+    POSTGRES_PORT=6432 POSTGRES_PGBOUNCER=transaction \\
+    python benchmarks/db_connections.py --workers 1 2 4 8 --threads 4
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+
+def run_worker(threads, requests, query, results):
+    import django
+    django.setup()
+    from django.db import close_old_connections, connection
+
+    latencies = []
+    lock = threading.Lock()
+
+    def run_thread():
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                cursor.fetchall()
+            close_old_connections()
+            timings.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+
+    pool = [threading.Thread(target=run_thread) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(latencies)
+
+
+def count_backends(stop, samples):
+    import psycopg2
+    connection = psycopg2.connect(
+        dbname=os.environ['POSTGRES_DB'],
+        user=os.environ['POSTGRES_USER'],
+        password=os.getenv('POSTGRES_PASSWORD', ''),
+        host=os.environ['POSTGRES_HOST'],
+        port=os.getenv('POSTGRES_DIRECT_PORT', '5432'),
+        sslmode=os.getenv('POSTGRES_SSLMODE', 'require'),
+    )
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        while not stop.is_set():
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+            )
+            samples.append(cursor.fetchone()[0])
+            time.sleep(0.1)
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--query', default='SELECT 1')
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'backends(max)':>14} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers in args.workers:
+        stop, samples = threading.Event(), []
+        sampler = threading.Thread(target=count_backends, args=(stop, samples))
+        sampler.start()
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=run_worker, args=(args.threads, args.requests, args.query, results)
+            )
+            for _ in range(workers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        latencies = []
+        for _ in processes:
+            latencies.extend(results.get())
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(
+            f"{workers:>8} {max(samples, default=0):>14} {len(latencies) / elapsed:>8.0f} "
+            f"{statistics.median(latencies) * 1000:>8.2f} {p99 * 1000:>8.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
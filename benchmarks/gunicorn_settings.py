@@ -0,0 +1,129 @@
+"""
+Throughput and p99 of gunicorn.conf.py's computed settings vs the old flags.
+
+Starts gunicorn locally once per configuration, drives ``--path`` with
+``--concurrency`` client threads for ``--seconds`` and prints the worker and
+thread counts gunicorn.conf.py resolved, requests per second and latency
+percentiles. The ``asgi`` configuration serves the same
+app with uvicorn workers; /healthz/ fans out to PostgreSQL and Redis, so
+compare the two modes on it with a local redis-server running.
+
+    python benchmarks/gunicorn_settings.py --path /admin/login/ --seconds 20
+    REDIS_URL=redis://localhost:6379/0 \
+    python benchmarks/gunicorn_settings.py --configs computed asgi --path /healthz/
+"""
+import argparse
+import os
+import runpy
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# App settings applied on top of gunicorn.conf.py for each run.
+CONFIGURATIONS = {
+    # What startup.sh used to pass: --workers 2 --threads 4, nothing else.
+    'hardcoded': {
+        'GUNICORN_WORKERS': '2',
+        'GUNICORN_THREADS': '4',
+        'GUNICORN_PRELOAD_APP': 'false',
+        'GUNICORN_MAX_REQUESTS': '0',
+    },
+    'computed': {},
+    'asgi': {'SERVER_MODE': 'asgi'},
+}
+
+
+def resolved(overrides):
+    """workers and threads gunicorn.conf.py settles on with ``overrides`` applied."""
+    saved = dict(os.environ)
+    os.environ.update(overrides)
+    try:
+        namespace = runpy.run_path(str(ROOT / 'gunicorn.conf.py'))
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    return namespace['workers'], namespace['threads']
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not come up at {url}')
+
+
+def drive(url, concurrency, seconds):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def run():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(url, timeout=10).read()
+            except OSError:
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=run) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--path', default='/admin/login/')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--configs', nargs='+', choices=CONFIGURATIONS, default=['hardcoded', 'computed'])
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{args.port}{args.path}'
+    env = {**os.environ, 'APP_PATH': str(ROOT), 'PORT': str(args.port), 'GUNICORN_ACCESSLOG': '/dev/null'}
+    env.setdefault('SECRET_KEY', 'benchmark')
+
+    print(f"{'config':<10} {'workers':>7} {'threads':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name in args.configs:
+        overrides = CONFIGURATIONS[name]
+        workers, threads = resolved(overrides)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py'],
+            cwd=ROOT, env={**env, **overrides}, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(url)
+            latencies, errors = drive(url, args.concurrency, args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else 0
+        print(
+            f'{name:<10} {workers:>7} {threads if name != "asgi" else "-":>7} '
+            f'{len(latencies) / args.seconds:>8.0f} {statistics.median(latencies or [0]) * 1000:>8.1f} '
+            f'{p99 * 1000:>8.1f} {errors:>7}'
+        )
+
+
+if __name__ == '__main__':
+    main()
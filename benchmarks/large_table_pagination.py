@@ -0,0 +1,225 @@
+"""
+Counts and deep pages on a large table with core.pagination.
+
+Seeds ``--rows`` users (a tenth of them staff) in a fresh SQLite database,
+or in a throwaway test database on the PostgreSQL server in POSTGRES_HOST,
+ANALYZEd so the planner has estimates. Then
+times, fastest of ``--rounds``:
+
+* ``COUNT(*)`` against ``approximate_count`` for the whole table, a small
+  filter (staff) and a large one (active users);
+* one deep page (``--depth`` rows in, 100 per page) read with OFFSET, seeking
+  (``ApproximatePaginator``), and through ``KeysetPaginator``'s cursor;
+* the user change list, first and deep page, through a plain ``UserAdmin``
+  and one with ``ApproximateCountAdminMixin``.
+
+Checks that seeking returns the same rows as OFFSET (first, deep and last
+pages, ascending and descending), that ``KeysetPaginator`` walks every staff
+user exactly once and rejects a forged cursor, and that exact counts are
+exact. Exits with status 1 if a check fails. Cached counts go to the Redis in
+REDIS_URL.
+
+    python benchmarks/large_table_pagination.py --rows 1000000
+    POSTGRES_HOST=localhost POSTGRES_USER=postgres POSTGRES_PASSWORD=... python benchmarks/large_table_pagination.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+# Before setup, which opens the connections.
+if not os.getenv('POSTGRES_HOST'):
+    settings.DATABASES = {'default': {
+        'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(tempfile.mkdtemp(), 'pagination.sqlite3'),
+    }}
+settings.DATABASE_REPLICAS = []
+django.setup()
+
+from django.contrib.admin import AdminSite  # noqa: E402
+from django.contrib.auth.admin import UserAdmin  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.paginator import InvalidPage  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import path  # noqa: E402
+
+from core.pagination import (  # noqa: E402
+    ApproximateCountAdminMixin, ApproximatePaginator, KeysetPaginator, approximate_count,
+)
+
+
+class ApproximateUserAdmin(ApproximateCountAdminMixin, UserAdmin):
+    pass
+
+
+plain_site, approximate_site = AdminSite(name='plain'), AdminSite(name='approximate')
+plain_site.register(User, UserAdmin)
+approximate_site.register(User, ApproximateUserAdmin)
+
+urlpatterns = [
+    path('plain/', plain_site.urls),
+    path('approximate/', approximate_site.urls),
+]
+
+OVERRIDES = {
+    'DEBUG': False, 'ALLOWED_HOSTS': ['testserver'], 'ROOT_URLCONF': __name__,
+    'RATELIMIT_ENABLED': False, 'PROFILER': {'ENABLED': False}, 'QUERY_BUDGET': {'MODE': 'off'},
+    # Counts cached by earlier runs are of other databases.
+    'VIEW_CACHE_VERSION': f'pagination-benchmark-{time.time()}',
+}
+
+SEED_SQL = {
+    'sqlite': """
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s)
+        INSERT INTO auth_user (password, is_superuser, username, first_name, last_name, email,
+                               is_staff, is_active, date_joined)
+        SELECT '', 0, 'user' || i, 'First', 'Last', 'user' || i || '@example.com',
+               i %% 10 = 0, i %% 5 <> 0, datetime('now')
+        FROM n
+    """,
+    'postgresql': """
+        INSERT INTO auth_user (password, is_superuser, username, first_name, last_name, email,
+                               is_staff, is_active, date_joined)
+        SELECT '', false, 'user' || i, 'First', 'Last', 'user' || i || '@example.com',
+               i %% 10 = 0, i %% 5 <> 0, now()
+        FROM generate_series(1, %s) AS i
+    """,
+}
+
+
+def fastest(rounds, call):
+    """Milliseconds of the fastest of ``rounds`` calls, and the last result."""
+    best, result = None, None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = call()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def seed(rows):
+    if connection.vendor == 'postgresql':
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    else:
+        from django.core.management import call_command
+        call_command('migrate', verbosity=0)
+    with connection.cursor() as cursor:
+        cursor.execute(SEED_SQL[connection.vendor], [rows])
+        cursor.execute('ANALYZE auth_user' if connection.vendor == 'postgresql' else 'ANALYZE')
+    return User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+
+def ids(page):
+    return [user.pk for user in page.object_list]
+
+
+def check_seeking(rows, depth):
+    problems = []
+    for ordering in ('-pk', 'username', 'pk'):
+        queryset = User.objects.order_by(ordering)
+        paginator = ApproximatePaginator(queryset, 100)
+        for number in (1, depth // 100 + 1, paginator.num_pages):
+            offset_ids = list(queryset[(number - 1) * 100:number * 100].values_list('pk', flat=True))
+            if ids(paginator.page(number)) != offset_ids:
+                problems.append(f'seeking page {number} ordered by {ordering} differs from OFFSET')
+
+    staff = User.objects.filter(is_staff=True).order_by('-date_joined', 'pk')
+    paginator, cursor, seen = KeysetPaginator(staff, 500), None, []
+    while True:
+        page = paginator.page(cursor)
+        seen += ids(page)
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    if seen != list(staff.values_list('pk', flat=True)):
+        problems.append(f'KeysetPaginator walked {len(seen)} staff users, {len(set(seen))} distinct, not all in order')
+    try:
+        paginator.page('not-a-cursor')
+        problems.append('KeysetPaginator accepted a forged cursor')
+    except InvalidPage:
+        pass
+
+    count, exact = approximate_count(User.objects.filter(is_superuser=True))
+    if (count, exact) != (1, True):
+        problems.append(f'the superuser count is {count} (exact: {exact})')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--depth', type=int, default=200000, help='rows before the deep page (default: 200000)')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    database = connection.settings_dict['NAME']
+    start = time.perf_counter()
+    admin = seed(args.rows)
+    print(f'{args.rows} users seeded in {time.perf_counter() - start:.1f} s, database {connection.vendor}, '
+          f'Redis at {settings.CACHES["default"]["LOCATION"]}\n')
+
+    problems = []
+    with override_settings(**OVERRIDES):
+        print(f'{"count":<16} {"COUNT(*) ms":>12} {"approx. ms":>11} {"exact":>10} {"approx.":>10}')
+        for label, queryset in (
+            ('all users', User.objects.all()),
+            ('staff', User.objects.filter(is_staff=True)),
+            ('active', User.objects.filter(is_active=True)),
+        ):
+            exact_ms, exact = fastest(args.rounds, queryset.count)
+            approx_ms, (approx, is_exact) = fastest(args.rounds, lambda: approximate_count(queryset))
+            print(f'{label:<16} {exact_ms:>12.2f} {approx_ms:>11.2f} {exact:>10} {approx:>9}{"" if is_exact else "~"}')
+            if is_exact and approx != exact:
+                problems.append(f'approximate_count of {label} claims to be exact: {approx} != {exact}')
+
+        queryset = User.objects.order_by('-pk')
+        number = args.depth // 100 + 1
+        paginator = ApproximatePaginator(queryset, 100)
+        offset_ms, _ = fastest(args.rounds, lambda: list(queryset[args.depth:args.depth + 100]))
+        seek_ms, _ = fastest(args.rounds, lambda: list(paginator.page(number).object_list))
+        keyset = KeysetPaginator(queryset, 100)
+        cursor = keyset.encode([queryset.values_list('pk', flat=True)[args.depth - 1]])
+        cursor_ms, _ = fastest(args.rounds, lambda: list(keyset.page(cursor).object_list))
+        print(f'\n{"page " + str(number):<16} {"OFFSET ms":>12} {"seek ms":>11} {"cursor ms":>10}')
+        print(f'{"by -pk":<16} {offset_ms:>12.2f} {seek_ms:>11.2f} {cursor_ms:>10.2f}')
+
+        client = Client()
+        client.force_login(admin)
+        print(f'\n{"admin":<16} {"page 1 ms":>12} {"page " + str(number) + " ms":>11}')
+        for site in ('plain', 'approximate'):
+            timings = []
+            for page in (1, number):
+                def get():
+                    return client.get(f'/{site}/auth/user/', {'p': page})
+                elapsed, response = fastest(args.rounds, get)
+                timings.append(elapsed)
+                if response.status_code != 200:
+                    problems.append(f'{site} change list page {page}: status {response.status_code}')
+            print(f'{site:<16} {timings[0]:>12.2f} {timings[1]:>11.2f}')
+
+        problems += check_seeking(args.rows, args.depth)
+
+    if connection.vendor == 'postgresql':
+        connection.creation.destroy_test_db(database, verbosity=0)
+    for problem in problems:
+        print(f'\nFAIL: {problem}')
+    if problems:
+        sys.exit(1)
+    print('\nSeeking matches OFFSET, the cursor walk is complete, exact counts are exact.')
+
+
+if __name__ == '__main__':
+    main()
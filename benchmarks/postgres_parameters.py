@@ -0,0 +1,106 @@
+"""
+PostgreSQL server parameters computed for each supported SKU, offline.
+
+Runs __main__.py against Pulumi mocks once per SKU in POSTGRES_SKUS (no
+Azure credentials, nothing is created), collects the values of the
+dbforpostgresql.Configuration resources and checks them against the SKU's
+memory and connection limit. The server reports Azure's default
+shared_preload_libraries (pg_cron) as its current value, which must be kept.
+Exits non-zero if any check fails.
+
+    python benchmarks/postgres_parameters.py
+    python benchmarks/postgres_parameters.py --set work_mem=16384
+"""
+import argparse
+import asyncio
+import json
+import runpy
+import sys
+from pathlib import Path
+
+import pulumi
+from pulumi.runtime.stack import wait_for_rpcs
+
+ROOT = Path(__file__).resolve().parent.parent
+COLUMNS = ['shared_buffers', 'effective_cache_size', 'work_mem', 'maintenance_work_mem', 'max_connections',
+           'autovacuum_vacuum_cost_limit']
+# Values a new flexible server already has, as returned by getConfiguration.
+AZURE_DEFAULTS = {'shared_preload_libraries': 'pg_cron,pg_stat_statements'}
+
+
+class Mocks(pulumi.runtime.Mocks):
+    def __init__(self):
+        self.parameters = {}
+
+    def new_resource(self, args):
+        if args.typ.endswith(':Configuration'):
+            self.parameters[args.inputs['configurationName']] = args.inputs['value']
+        return [f'{args.name}_id', {'name': args.name, 'hostName': f'{args.name}.example.net', **args.inputs}]
+
+    def call(self, args):
+        if args.token.endswith(':getConfiguration'):
+            return {'value': AZURE_DEFAULTS.get(args.args['configurationName'], '')}
+        return {}
+
+
+def run_program(config):
+    mocks = Mocks()
+    pulumi.runtime.set_mocks(mocks, project='pulumi-django', stack='dev', preview=False)
+    for key, value in config.items():
+        pulumi.runtime.set_config(f'pulumi-django:{key}', value)
+    namespace = runpy.run_path(str(ROOT / '__main__.py'))
+    asyncio.get_event_loop().run_until_complete(wait_for_rpcs())
+    return namespace, mocks.parameters
+
+
+def check(parameters, memory_gb, connection_limit):
+    memory_kb = memory_gb * 1024 * 1024
+    shared_buffers_kb = int(parameters['shared_buffers']) * 8
+    max_connections = int(parameters['max_connections'])
+    problems = []
+    if shared_buffers_kb > memory_kb * 0.4:
+        problems.append('shared_buffers above 40% of RAM')
+    if int(parameters['effective_cache_size']) * 8 > memory_kb:
+        problems.append('effective_cache_size above RAM')
+    if max_connections > connection_limit:
+        problems.append(f'max_connections above the Azure limit ({connection_limit})')
+    if shared_buffers_kb + int(parameters['work_mem']) * max_connections * 3 > memory_kb * 1.25:
+        problems.append('shared_buffers + work_mem for every connection oversubscribes RAM')
+    preloaded = parameters['shared_preload_libraries'].split(',')
+    if 'pg_stat_statements' not in preloaded:
+        problems.append('pg_stat_statements is not preloaded')
+    if 'pg_cron' not in preloaded:
+        problems.append("shared_preload_libraries drops Azure's pg_cron")
+    if parameters.get('pgbouncer.enabled') == 'true' and int(parameters['pgbouncer.default_pool_size']) > max_connections - 15:
+        problems.append('PgBouncer pool does not fit in max_connections')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a server parameter (postgresParameters) for every SKU')
+    args = parser.parse_args()
+    overrides = dict(item.split('=', 1) for item in args.set)
+
+    sys.path.insert(0, str(ROOT))
+    namespace, _ = run_program({})
+    skus = namespace['POSTGRES_SKUS']
+
+    print(f'{"sku":<20} {"vcpu":>4} {"ram":>4} ' + ' '.join(f'{column[:14]:>14}' for column in COLUMNS))
+    failures = 0
+    for sku, (vcpus, memory_gb, connection_limit) in skus.items():
+        tier = 'Burstable' if sku.startswith('Standard_B') else 'GeneralPurpose'
+        config = {'postgresSku': json.dumps({'name': sku, 'tier': tier})}
+        if overrides:
+            config['postgresParameters'] = json.dumps(overrides)
+        _, parameters = run_program(config)
+        print(f'{sku:<20} {vcpus:>4} {memory_gb:>4} ' + ' '.join(f'{parameters[column]:>14}' for column in COLUMNS))
+        for problem in check(parameters, memory_gb, connection_limit):
+            print(f'  FAIL {problem}')
+            failures += 1
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
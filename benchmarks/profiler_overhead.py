@@ -0,0 +1,181 @@
+"""
+Overhead and capture checks for core.profiling, against the Redis in REDIS_URL.
+
+Serves a view that runs a few SQL queries and ~1 ms of Python in-process
+through the project's WSGI handler, with ProfilerMiddleware removed, with it
+installed but not sampling (the production case for almost every request),
+and with it sampling every request. Setups are interleaved in rounds so
+drift affects them alike. Then checks that a request slower than the
+threshold and a request with the trigger header are both stored with
+samples, SQL and Redis counts.
+
+Exits with status 1 if a check fails or the not-sampling overhead exceeds
+``--budget-ms``. SQL runs on an in-memory SQLite database unless
+POSTGRES_HOST is set.
+
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/profiler_overhead.py
+    python benchmarks/profiler_overhead.py --rounds 40 --budget-ms 0.02
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+if not os.getenv('POSTGRES_HOST'):
+    settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+    settings.DATABASE_REPLICAS = []
+
+from django.core.cache import cache  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.http import JsonResponse  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import path  # noqa: E402
+
+from core import profiling  # noqa: E402
+
+TRIGGER_TOKEN = 'benchmark-token'
+
+
+def busy(milliseconds):
+    deadline = time.perf_counter() + milliseconds / 1000
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(i * i for i in range(200))
+    return total
+
+
+def work_view(request, milliseconds):
+    with connection.cursor() as cursor:
+        for i in range(3):
+            cursor.execute('SELECT %s', [i])
+    cache.get('benchmark:profiler')
+    return JsonResponse({'total': busy(milliseconds)})
+
+
+urlpatterns = [
+    path('work/<int:milliseconds>/', work_view),
+]
+
+MIDDLEWARE = [m for m in settings.MIDDLEWARE if m != 'core.profiling.ProfilerMiddleware']
+SETUPS = {
+    'no profiler': {'MIDDLEWARE': MIDDLEWARE},
+    'not sampling': {'PROFILER': {'SAMPLE_RATE': 0, 'SLOW_THRESHOLD_MS': 60000}},
+    'sampling all': {'PROFILER': {'SAMPLE_RATE': 1, 'SLOW_THRESHOLD_MS': 60000}},
+}
+OVERRIDES = {
+    'DEBUG': False, 'ALLOWED_HOSTS': ['localhost'], 'ROOT_URLCONF': __name__,
+    'RATELIMIT_RULES': [{'key': 'ip', 'rate': '1000000/m'}],
+}
+
+
+def request(app, url, headers=None):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'REMOTE_ADDR': '10.0.0.1',
+        'wsgi.input': BytesIO(),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+        **(headers or {}),
+    }
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+
+    b''.join(app(environ, start_response))
+    assert captured['status'].startswith('200'), captured['status']
+
+
+def check_capture():
+    """Problems with what the profiler stores, if any."""
+    problems = []
+    options = {'SAMPLE_RATE': 0, 'SLOW_THRESHOLD_MS': 50, 'TRIGGER_TOKEN': TRIGGER_TOKEN, 'INTERVAL_MS': 2}
+    with override_settings(**OVERRIDES, PROFILER=options):
+        app = WSGIHandler()
+        cases = {
+            'slow': ('/work/150/', {}),
+            'triggered': ('/work/20/', {'HTTP_X_PROFILE': TRIGGER_TOKEN}),
+            'fast': ('/work/1/', {}),
+        }
+        for reason, (url, headers) in cases.items():
+            before = {entry['id'] for entry in profiling.list_profiles()}
+            request(app, url, headers)
+            new = [entry for entry in profiling.list_profiles() if entry['id'] not in before]
+            if reason == 'fast':
+                if new:
+                    problems.append(f'an unsampled fast request was stored: {new}')
+                continue
+            if len(new) != 1 or new[0]['reason'] != reason:
+                problems.append(f'{reason} request: expected one {reason!r} profile, got {new}')
+                continue
+            summary, profile = new[0], profiling.get_profile(new[0]['id'])
+            if not summary['samples'] or 'work_view' not in profile['folded']:
+                problems.append(f'{reason} profile has no samples of the view: {summary}')
+            if summary['sql_queries'] != 3 or not summary['cache_calls']:
+                problems.append(f'{reason} profile counts are off: {summary}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=100, help='requests per setup per round (default: 100)')
+    parser.add_argument('--budget-ms', type=float, default=0.05,
+                        help='allowed not-sampling overhead per request (default: 0.05)')
+    args = parser.parse_args()
+
+    apps = {}
+    for label, overrides in SETUPS.items():
+        with override_settings(**OVERRIDES, **overrides):
+            apps[label] = (WSGIHandler(), overrides)
+    timings = {label: [] for label in SETUPS}
+    for _ in range(args.rounds):
+        for label, (app, overrides) in apps.items():
+            with override_settings(**OVERRIDES, **overrides):
+                request(app, '/work/1/')  # warm up
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    request(app, '/work/1/')
+                timings[label].append((time.perf_counter() - start) / args.requests * 1000)
+
+    print(f'{args.rounds} rounds of {args.requests} requests per setup, Redis at {settings.CACHES["default"]["LOCATION"]}\n')
+    print(f'{"setup":<14} {"ms/req":>8} {"overhead ms":>12}')
+    baseline = statistics.median(timings['no profiler'])
+    for label, values in timings.items():
+        median = statistics.median(values)
+        print(f'{label:<14} {median:>8.3f} {median - baseline:>12.3f}')
+    overhead = statistics.median(timings['not sampling']) - baseline
+
+    problems = check_capture()
+    for problem in problems:
+        print(f'\nFAIL: {problem}')
+    if overhead > args.budget_ms:
+        print(f'\nFAIL: not-sampling overhead {overhead:.3f} ms/request is over the {args.budget_ms} ms budget.')
+    if problems or overhead > args.budget_ms:
+        sys.exit(1)
+    print('\nSlow and triggered requests captured; not-sampling overhead within budget.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Resource dependency graph and critical path of the Pulumi program, offline.
+
+Runs __main__.py against Pulumi mocks (no Azure credentials, nothing is
+created), records every resource and the resources its inputs depend on,
+and weights each one with a typical provisioning time to find the longest
+chain of a fresh ``pulumi up``.
+
+    python benchmarks/pulumi_critical_path.py
+    python benchmarks/pulumi_critical_path.py --config deterministicNames=true
+    python benchmarks/pulumi_critical_path.py --dot > graph.dot
+"""
+import argparse
+import asyncio
+import re
+import runpy
+import sys
+from pathlib import Path
+
+import pulumi
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Typical minutes to create each resource type in Azure. Versioned types
+# (azure-native:dbforpostgresql/v20230601preview:Server) use the same entry.
+PROVISIONING_MINUTES = {
+    'azure-native:cache:Redis': 20,
+    'azure-native:dbforpostgresql:Server': 12,
+    'azure-native:network:PrivateEndpoint': 2,
+    'azure-native:network:PrivateZone': 1,
+    'azure-native:network:VirtualNetworkLink': 1,
+    'azure-native:web:AppServicePlan': 1,
+    'azure-native:web:WebApp': 1,
+    'azure-native:dbforpostgresql:Configuration': 0.5,
+}
+DEFAULT_MINUTES = 0.2
+
+
+class Mocks(pulumi.runtime.Mocks):
+    def new_resource(self, args):
+        return [f'{args.name}_id', {'name': args.name, **args.inputs}]
+
+    def call(self, args):
+        return {}
+
+
+def collect_outputs(value, found):
+    if isinstance(value, pulumi.Output):
+        found.append(value)
+    elif isinstance(value, dict):
+        for item in value.values():
+            collect_outputs(item, found)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            collect_outputs(item, found)
+    elif hasattr(value, '__dict__') and not isinstance(value, pulumi.Resource):
+        collect_outputs(vars(value), found)
+    return found
+
+
+def record_resources():
+    """Patch Resource.__init__ to remember each resource's inputs and options."""
+    registered = []
+    original = pulumi.Resource.__init__
+
+    def init(self, t, name, custom, props=None, opts=None, *args, **kwargs):
+        registered.append((self, t, name, props or {}, opts))
+        original(self, t, name, custom, props, opts, *args, **kwargs)
+
+    pulumi.Resource.__init__ = init
+    return registered
+
+
+async def dependency_graph(registered):
+    names = {id(resource): f'{t.rsplit(":", 1)[-1]}:{name}' for resource, t, name, _, _ in registered}
+    graph = {}
+    for resource, t, name, props, opts in registered:
+        dependencies = set()
+        for output in collect_outputs(props, []):
+            dependencies |= await output.resources()
+        if opts is not None and opts.depends_on:
+            depends_on = opts.depends_on if isinstance(opts.depends_on, list) else [opts.depends_on]
+            dependencies |= {dependency for dependency in depends_on if dependency is not None}
+        graph[names[id(resource)]] = {
+            'type': re.sub(r'/v\w+:', ':', t),
+            'depends_on': sorted(names[id(dep)] for dep in dependencies if id(dep) in names and dep is not resource),
+        }
+    return graph
+
+
+def critical_path(graph):
+    finish, via = {}, {}
+
+    def finish_time(node):
+        if node not in finish:
+            deps = graph[node]['depends_on']
+            start = max((finish_time(dep) for dep in deps), default=0)
+            via[node] = max(deps, key=finish_time) if deps else None
+            finish[node] = start + PROVISIONING_MINUTES.get(graph[node]['type'], DEFAULT_MINUTES)
+        return finish[node]
+
+    last = max(graph, key=finish_time)
+    path = []
+    while last is not None:
+        path.append(last)
+        last = via[last]
+    return list(reversed(path)), finish
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--stack', default='dev')
+    parser.add_argument('--config', action='append', default=[], metavar='KEY=VALUE',
+                        help='stack config, as with pulumi config set')
+    parser.add_argument('--dot', action='store_true', help='print the graph in Graphviz format')
+    args = parser.parse_args()
+
+    pulumi.runtime.set_mocks(Mocks(), project='pulumi-django', stack=args.stack, preview=False)
+    for item in args.config:
+        key, value = item.split('=', 1)
+        pulumi.runtime.set_config(f'pulumi-django:{key}', value)
+    registered = record_resources()
+    sys.path.insert(0, str(ROOT))
+    runpy.run_path(str(ROOT / '__main__.py'))
+    graph = asyncio.get_event_loop().run_until_complete(dependency_graph(registered))
+
+    if args.dot:
+        print('digraph pulumi {')
+        for node, info in graph.items():
+            for dep in info['depends_on']:
+                print(f'  "{dep}" -> "{node}";')
+        print('}')
+        return
+
+    path, finish = critical_path(graph)
+    for node in sorted(graph, key=lambda node: finish[node]):
+        deps = ', '.join(graph[node]['depends_on']) or '-'
+        print(f'{finish[node]:>6.1f} min  {node}  <- {deps}')
+    print(f'\nCritical path (~{finish[path[-1]]:.1f} min): ' + ' -> '.join(path))
+
+
+if __name__ == '__main__':
+    main()
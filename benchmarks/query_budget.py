@@ -0,0 +1,222 @@
+"""
+Detection checks and per-request overhead of core.querybudget.
+
+Serves views in-process that run an N+1 (the same statement once per item,
+from one line), the batched equivalent, and more queries than their declared
+budget, and checks that:
+
+* with ``MODE='raise'`` the N+1 and the overrun raise ``QueryBudgetExceeded``
+  naming the statement and the line that ran it, and the batched view passes;
+* with ``MODE='log'`` the same requests succeed and are logged instead;
+* ``QueryBudgetTestRunner``'s result fails a test with an N+1 and passes one
+  without, and ``assert_query_budget`` fails a block over its budget.
+
+Then times ``QueryBudgetMiddleware`` around a 3-query view, against calling
+the view directly: off, in log mode not sampling (almost every production
+request), and recording every request. Exits with
+status 1 if a check fails or the not-sampling overhead exceeds
+``--budget-ms``. SQL runs on an in-memory SQLite database unless
+POSTGRES_HOST is set.
+
+    python benchmarks/query_budget.py
+    python benchmarks/query_budget.py --rounds 40 --budget-ms 0.01
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+if not os.getenv('POSTGRES_HOST'):
+    settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+    settings.DATABASE_REPLICAS = []
+
+from django.db import connection  # noqa: E402
+from django.http import JsonResponse  # noqa: E402
+from django.test import Client, RequestFactory  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import path, resolve  # noqa: E402
+
+from core.querybudget import (  # noqa: E402
+    QueryBudgetExceeded, QueryBudgetMiddleware, QueryBudgetResult, assert_query_budget, fingerprint, query_budget,
+)
+
+
+def fetch_each(ids):
+    with connection.cursor() as cursor:
+        for pk in ids:
+            cursor.execute('SELECT %s', [pk])  # the N+1
+    return len(ids)
+
+
+def fetch_batched(ids):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT 1 WHERE 1 IN ({', '.join(['%s'] * len(ids))})", ids)
+    return len(ids)
+
+
+def n_plus_one_view(request):
+    return JsonResponse({'rows': fetch_each(range(20))})
+
+
+def batched_view(request):
+    return JsonResponse({'rows': fetch_batched(list(range(20)))})
+
+
+def work_view(request):
+    return JsonResponse({'rows': fetch_batched([1]) + fetch_batched([2]) + fetch_batched([3])})
+
+
+urlpatterns = [
+    path('n-plus-one/', query_budget(n_plus_one_view, queries=30), name='n-plus-one'),
+    path('batched/', query_budget(batched_view, queries=1), name='batched'),
+    path('over/', query_budget(work_view, queries=2), name='over'),
+    path('work/', work_view, name='work'),
+]
+
+OVERRIDES = {
+    'DEBUG': False, 'ALLOWED_HOSTS': ['testserver'], 'ROOT_URLCONF': __name__,
+    'RATELIMIT_ENABLED': False, 'PROFILER': {'ENABLED': False},
+}
+DEFAULT = {'queries': 30, 'n_plus_one': 5}
+SETUPS = {
+    'no middleware': None,
+    'off': {'MODE': 'off'},
+    'not sampling': {'MODE': 'log', 'SAMPLE_RATE': 0},
+    'recording all': {'MODE': 'raise', 'DEFAULT': DEFAULT},
+}
+
+
+def get(url, mode):
+    """Status and QueryBudgetExceeded message (or None) of one request."""
+    with override_settings(**OVERRIDES, QUERY_BUDGET={'MODE': mode, 'SAMPLE_RATE': 1, 'DEFAULT': DEFAULT}):
+        try:
+            return Client().get(url).status_code, None
+        except QueryBudgetExceeded as exc:
+            return None, str(exc)
+
+
+class CapturingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def check_requests():
+    problems = []
+    status, error = get('/n-plus-one/', 'raise')
+    if error is None or 'N+1: 20x at benchmarks/query_budget.py' not in error or 'in fetch_each' not in error:
+        problems.append(f'raise mode: N+1 view not reported with its call site: {status} {error}')
+    status, error = get('/batched/', 'raise')
+    if status != 200:
+        problems.append(f'raise mode: batched view failed: {status} {error}')
+    status, error = get('/over/', 'raise')
+    if error is None or '3 queries (budget 2)' not in error:
+        problems.append(f'raise mode: view over its declared budget not reported: {status} {error}')
+
+    handler = CapturingHandler()
+    logging.getLogger('core.querybudget').addHandler(handler)
+    try:
+        statuses = [get(url, 'log')[0] for url in ('/n-plus-one/', '/batched/', '/over/')]
+    finally:
+        logging.getLogger('core.querybudget').removeHandler(handler)
+    if statuses != [200, 200, 200] or len(handler.messages) != 2:
+        problems.append(f'log mode: expected 3 OK responses and 2 warnings, got {statuses} {handler.messages}')
+    return problems
+
+
+class ExampleTests(unittest.TestCase):
+    def test_n_plus_one(self):
+        fetch_each(range(10))
+
+    def test_batched(self):
+        fetch_batched(list(range(10)))
+
+
+def check_tests():
+    problems = []
+    with override_settings(QUERY_BUDGET={'TEST': {'n_plus_one': 5}}):
+        result = QueryBudgetResult(io.StringIO(), descriptions=True, verbosity=0)
+        unittest.TestLoader().loadTestsFromTestCase(ExampleTests).run(result)
+    failed = [test.id().rsplit('.', 1)[-1] for test, _ in result.failures]
+    if failed != ['test_n_plus_one']:
+        problems.append(f'test runner: expected only test_n_plus_one to fail, got {failed}')
+    try:
+        with assert_query_budget(queries=1):
+            fetch_batched([1])
+            fetch_batched([2])
+        problems.append('assert_query_budget let 2 queries through a budget of 1')
+    except QueryBudgetExceeded:
+        pass
+    shapes = {fingerprint('SELECT * FROM "t" WHERE "t"."id" IN (%s, %s, %s) LIMIT 21'),
+              fingerprint('SELECT * FROM  "t" WHERE "t"."id" IN (%s) LIMIT 5'),
+              fingerprint("SELECT * FROM \"t\" WHERE \"t\".\"id\" IN (%s, %s) LIMIT 1")}
+    if len(shapes) != 1:
+        problems.append(f'fingerprint: one statement shape gave {shapes}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per setup per round (default: 1000)')
+    parser.add_argument('--budget-ms', type=float, default=0.02,
+                        help='allowed not-sampling overhead per request (default: 0.02)')
+    args = parser.parse_args()
+
+    request = RequestFactory().get('/work/')
+    with override_settings(ROOT_URLCONF=__name__):
+        request.resolver_match = resolve('/work/')
+    middleware = QueryBudgetMiddleware(work_view)
+    timings = {label: [] for label in SETUPS}
+    labels = list(SETUPS)
+    for round_number in range(args.rounds):
+        # Rotated so no setup always runs first.
+        for label in labels[round_number % len(labels):] + labels[:round_number % len(labels)]:
+            handler = work_view if SETUPS[label] is None else middleware
+            with override_settings(QUERY_BUDGET=SETUPS[label] or {}):
+                handler(request)  # warm up
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    handler(request)
+                timings[label].append((time.perf_counter() - start) / args.requests * 1000)
+
+    print(f'{args.rounds} rounds of {args.requests} requests per setup, database {connection.vendor}\n')
+    # Fastest round: the overheads are a few microseconds, well under the
+    # jitter of the queries themselves.
+    print(f'{"setup":<14} {"ms/req":>8} {"overhead ms":>12}')
+    baseline = min(timings['no middleware'])
+    for label, values in timings.items():
+        print(f'{label:<14} {min(values):>8.3f} {min(values) - baseline:>12.3f}')
+    overhead = min(timings['not sampling']) - baseline
+
+    problems = check_requests() + check_tests()
+    for problem in problems:
+        print(f'\nFAIL: {problem}')
+    if overhead > args.budget_ms:
+        print(f'\nFAIL: not-sampling overhead {overhead:.3f} ms/request is over the {args.budget_ms} ms budget.')
+    if problems or overhead > args.budget_ms:
+        sys.exit(1)
+    print('\nN+1s and overruns caught, logged or raised as configured; not-sampling overhead within budget.')
+
+
+if __name__ == '__main__':
+    main()
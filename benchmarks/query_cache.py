@@ -0,0 +1,201 @@
+"""
+Hit rate and latency of core.querycache on a list-heavy admin page.
+
+Serves the user change list (``--users`` users, 100 per page) in-process
+through two admin sites, one plain and one whose ModelAdmin uses
+``QueryCacheAdminMixin``, logged in as a superuser. Each round requests
+every page on both. ``--write-every`` requests, one user is renamed to show
+what invalidation costs. Prints time and SQL queries per request and the
+cache's hit rate.
+
+SQL runs on an in-memory SQLite database, which answers faster than any
+Redis round trip; ``--db-latency-ms`` adds that much to every query to stand
+in for the network between App Service and the PostgreSQL server (about 1
+ms in one region). The cache is the Redis in REDIS_URL.
+
+Before timing, checks that cached results never go stale or get poisoned:
+
+* after ``save()``, ``update()``, ``bulk_create()`` and a raw ``UPDATE``;
+* inside a transaction that wrote the table (reads see its own writes);
+* after that transaction rolls back (the old value), or commits (the new);
+* after a write Django never saw, once ``invalidate_tables()`` is called.
+
+Exits with status 1 if a check fails, the hit rate is under
+``--min-hit-rate`` or the cached page doesn't run fewer queries.
+
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/query_cache.py --db-latency-ms 1
+    python benchmarks/query_cache.py --users 5000 --write-every 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+# Before setup, which opens the connections. Kept open across requests:
+# closing an in-memory database drops it.
+settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:', 'CONN_MAX_AGE': None}}
+settings.DATABASE_REPLICAS = []
+django.setup()
+
+from django.contrib.admin import AdminSite  # noqa: E402
+from django.contrib.auth.admin import UserAdmin  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import path  # noqa: E402
+
+from core import querycache  # noqa: E402
+from core.querybudget import QueryRecorder  # noqa: E402
+from core.querycache import QueryCacheAdminMixin, cached, invalidate_tables  # noqa: E402
+
+
+class CachedUserAdmin(QueryCacheAdminMixin, UserAdmin):
+    pass
+
+
+plain_site, cached_site = AdminSite(name='plain'), AdminSite(name='cached')
+plain_site.register(User, UserAdmin)
+cached_site.register(User, CachedUserAdmin)
+
+urlpatterns = [
+    path('plain/', plain_site.urls),
+    path('cached/', cached_site.urls),
+]
+
+OVERRIDES = {
+    'DEBUG': False, 'ALLOWED_HOSTS': ['testserver'], 'ROOT_URLCONF': __name__,
+    'RATELIMIT_ENABLED': False, 'PROFILER': {'ENABLED': False}, 'QUERY_BUDGET': {'MODE': 'off'},
+}
+
+
+def network_latency(seconds):
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    return wrapper
+
+
+def first_name(pk):
+    return cached(User.objects.filter(pk=pk)).get().first_name
+
+
+def check_invalidation():
+    """Problems with what cached querysets return after writes, if any."""
+    problems = []
+
+    def expect(what, condition):
+        if not condition:
+            problems.append(what)
+
+    first = User.objects.order_by('pk').first()
+    first_name(first.pk)
+    first.first_name = 'Saved'
+    first.save()
+    expect('stale after save()', first_name(first.pk) == 'Saved')
+    User.objects.filter(pk=first.pk).update(first_name='Updated')
+    expect('stale after update()', first_name(first.pk) == 'Updated')
+    count = cached(User.objects.all()).count()
+    User.objects.bulk_create([User(username='bulk-created')])
+    expect('stale count() after bulk_create()', cached(User.objects.all()).count() == count + 1)
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE auth_user SET first_name = %s WHERE id = %s', ['Raw', first.pk])
+    expect('stale after a raw UPDATE', first_name(first.pk) == 'Raw')
+
+    try:
+        with transaction.atomic():
+            User.objects.filter(pk=first.pk).update(first_name='Uncommitted')
+            expect('a transaction does not see its own write', first_name(first.pk) == 'Uncommitted')
+            raise RuntimeError('roll back')
+    except RuntimeError:
+        pass
+    expect('a rolled back write poisoned the cache', first_name(first.pk) == 'Raw')
+    with transaction.atomic():
+        User.objects.filter(pk=first.pk).update(first_name='Committed')
+    expect('stale after a commit', first_name(first.pk) == 'Committed')
+
+    # The DB-API connection under Django's: no execute wrappers see this.
+    connection.connection.execute("UPDATE auth_user SET first_name = 'Unseen' WHERE id = %d" % first.pk)
+    expect('a write Django never saw was noticed anyway (the check is broken)', first_name(first.pk) == 'Committed')
+    invalidate_tables('auth_user')
+    expect('stale after invalidate_tables()', first_name(first.pk) == 'Unseen')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--write-every', type=int, default=50, help='requests between writes; 0 for none (default: 50)')
+    parser.add_argument('--db-latency-ms', type=float, default=0, help='added to every query (default: 0)')
+    parser.add_argument('--min-hit-rate', type=float, default=0.5, help='(default: 0.5)')
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    # A fresh database reuses primary keys: make last run's entries unreachable.
+    invalidate_tables(*connection.introspection.table_names())
+    User.objects.bulk_create(
+        [User(username=f'user{i}', email=f'user{i}@example.com', first_name=f'First {i}') for i in range(args.users)]
+    )
+    admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    with override_settings(**OVERRIDES):
+        problems = check_invalidation()
+        client = Client()
+        client.force_login(admin)
+        connection.execute_wrappers.append(network_latency(args.db_latency_ms / 1000))
+        pages = range((args.users + 99) // 100)
+        timings = {'plain': [], 'cached': []}
+        queries = {'plain': [], 'cached': []}
+        querycache.stats.clear()
+        requests = 0
+        for _ in range(args.rounds):
+            for page in pages:
+                for site in timings:
+                    requests += 1
+                    if args.write_every and requests % args.write_every == 0:
+                        User.objects.filter(pk=page + 1).update(last_name=f'Renamed {requests}')
+                    with QueryRecorder() as recorder:
+                        start = time.perf_counter()
+                        response = client.get(f'/{site}/auth/user/', {'p': page + 1})
+                        timings[site].append((time.perf_counter() - start) * 1000)
+                    queries[site].append(recorder.queries)
+                    if response.status_code != 200:
+                        problems.append(f'{site} change list page {page + 1}: status {response.status_code}')
+
+    lookups = querycache.stats['hits'] + querycache.stats['misses']
+    hit_rate = querycache.stats['hits'] / max(lookups, 1)
+    print(f'{args.users} users, {len(pages)} pages x {args.rounds} rounds, a write every {args.write_every} requests, '
+          f'{args.db_latency_ms} ms added per query, Redis at {settings.CACHES["default"]["LOCATION"]}\n')
+    print(f'{"admin":<8} {"ms/req":>8} {"p95 ms":>8} {"queries/req":>12}')
+    for site, values in timings.items():
+        p95 = statistics.quantiles(values, n=20)[-1]
+        print(f'{site:<8} {statistics.mean(values):>8.2f} {p95:>8.2f} {statistics.mean(queries[site]):>12.1f}')
+    print(f'\nquery cache: {querycache.stats["hits"]} hits, {querycache.stats["misses"]} misses '
+          f'({hit_rate:.0%} hit rate), {querycache.stats["uncached"]} uncached')
+
+    if hit_rate < args.min_hit_rate:
+        problems.append(f'hit rate {hit_rate:.0%} is under {args.min_hit_rate:.0%}')
+    if statistics.mean(queries['cached']) >= statistics.mean(queries['plain']):
+        problems.append('the cached change list runs as many queries as the plain one')
+    for problem in problems:
+        print(f'\nFAIL: {problem}')
+    if problems:
+        sys.exit(1)
+    print('\nNo stale or poisoned results.')
+
+if __name__ == '__main__':
+    main()
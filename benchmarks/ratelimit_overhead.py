@@ -0,0 +1,131 @@
+"""
+Per-request cost of core.ratelimit, against the Redis in REDIS_URL.
+
+Serves a trivial view in-process through the project's WSGI handler with
+RateLimitMiddleware removed, with it checking Redis on every request
+(RATELIMIT_LOCAL_BATCH=1), and with the default local allowance. Requests
+come from ``--clients`` addresses in turn, with limits high enough that
+none is denied. Prints the time per request, the overhead over the
+baseline, and the Redis round trips per request. Exits with status 1 if the
+default setup's overhead exceeds ``--budget-ms``.
+
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/ratelimit_overhead.py
+    python benchmarks/ratelimit_overhead.py --clients 1000 --requests 20000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import path  # noqa: E402
+
+from core import ratelimit  # noqa: E402
+
+urlpatterns = [
+    path('', lambda request: HttpResponse('ok')),
+]
+
+RULES = [
+    {'key': 'user_or_ip', 'rate': '1000000/m'},
+    {'key': 'ip', 'rate': '1000000/m', 'algorithm': 'sliding_window'},
+]
+MIDDLEWARE = [m for m in settings.MIDDLEWARE if m != 'core.ratelimit.RateLimitMiddleware']
+SETUPS = {
+    'baseline': {'MIDDLEWARE': MIDDLEWARE},
+    'redis every request': {'RATELIMIT_LOCAL_BATCH': 1},
+    'local allowance': {},
+}
+
+
+def request(app, address):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'REMOTE_ADDR': address,
+        'wsgi.input': BytesIO(),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+    }
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+
+    b''.join(app(environ, start_response))
+    return captured['status']
+
+
+def count_round_trips():
+    calls = [0]
+    run = ratelimit.limiter._run
+
+    def counted(keys, args):
+        calls[0] += 1
+        return run(keys, args)
+
+    ratelimit.limiter._run = counted
+    return calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--budget-ms', type=float, default=0.5,
+                        help='allowed overhead of the default setup per request (default: 0.5)')
+    args = parser.parse_args()
+
+    cache.client.get_client(write=True).ping()
+    addresses = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(args.clients)]
+    calls = count_round_trips()
+    print(f'{args.requests} requests from {args.clients} clients, Redis at {settings.CACHES["default"]["LOCATION"]}\n')
+    print(f'{"setup":<20} {"ms/req":>8} {"p99 ms":>8} {"overhead ms":>12} {"redis calls/req":>16}')
+    baseline = overhead = None
+    for label, overrides in SETUPS.items():
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], ROOT_URLCONF=__name__,
+                               RATELIMIT_RULES=RULES, **overrides):
+            app = WSGIHandler()
+            for address in addresses:  # warm up, and fill the local allowance
+                request(app, address)
+            calls[0], timings = 0, []
+            for i in range(args.requests):
+                start = time.perf_counter()
+                status = request(app, addresses[i % len(addresses)])
+                timings.append(time.perf_counter() - start)
+                assert status.startswith('200'), status
+        mean = statistics.mean(timings) * 1000
+        p99 = statistics.quantiles(timings, n=100)[98] * 1000
+        baseline = mean if baseline is None else baseline
+        overhead = mean - baseline
+        print(f'{label:<20} {mean:>8.3f} {p99:>8.3f} {overhead:>12.3f} {calls[0] / args.requests:>16.2f}')
+
+    if overhead > args.budget_ms:
+        print(f'\nOverhead {overhead:.3f} ms/request is over the {args.budget_ms} ms budget.')
+        sys.exit(1)
+    print(f'\nOverhead within the {args.budget_ms} ms/request budget.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Cache/session load that survives killing Redis mid-run.
+
+Start a local redis-server, migrate the local database (sessions fall back to
+it), run this, and kill/restart redis-server while it prints one line per
+second: operations, errors, p99 latency and the circuit breaker state.
+
+    redis-server --port 6379 &
+    python manage.py migrate
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/redis_failover.py --seconds 60
+    # in another shell: redis-cli shutdown nosave; sleep 20; redis-server &
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import close_old_connections  # noqa: E402
+
+from core.backends.sessions import SessionStore  # noqa: E402
+
+
+def request_cycle(i):
+    """What an authenticated request does with the cache and its session."""
+    session = SessionStore()
+    session['user_id'] = i
+    session.save()
+    SessionStore(session.session_key).load()
+    cache.get(f'bench:hot:{i % 50}')
+    cache.set(f'bench:hot:{i % 50}', {'n': i}, 30)
+    close_old_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    buckets = defaultdict(lambda: {'ops': 0, 'errors': 0, 'latencies': []})
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def run():
+        i = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                request_cycle(i)
+                error = False
+            except Exception:
+                error = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                bucket = buckets[int(time.monotonic())]
+                bucket['ops'] += 1
+                bucket['errors'] += error
+                bucket['latencies'].append(elapsed)
+            i += 1
+
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    print(f"{'second':>6} {'ops':>6} {'errors':>6} {'p99 ms':>8} circuit")
+    first = int(time.monotonic())
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(1)
+        second = int(time.monotonic()) - 1
+        with lock:
+            bucket = buckets.pop(second, None)
+        if bucket:
+            latencies = sorted(bucket['latencies'])
+            p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+            print(
+                f"{second - first:>6} {bucket['ops']:>6} {bucket['errors']:>6} {p99 * 1000:>8.1f} "
+                f"{cache.stats()['circuit_state']}"
+            )
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    main()
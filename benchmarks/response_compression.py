@@ -0,0 +1,150 @@
+"""
+Bandwidth and latency of dynamic responses with and without core.middleware.
+
+Serves three synthetic views in-process through the project's WSGI handler:
+an HTML table, a JSON list and a streamed CSV export, each ``--rows`` rows
+long and each spending ``--render-ms`` building its rows. A polling client
+fetches each view ``--requests`` times, sending back the ETag it got. Prints,
+per setup, the bytes on the wire and the time a worker spends per request.
+Latency adds the transfer time at ``--mbps``.
+
+    python benchmarks/response_compression.py
+    python benchmarks/response_compression.py --mbps 5 --rows 2000
+"""
+import argparse
+import csv
+import io
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import path  # noqa: E402
+
+ARGS = argparse.Namespace(rows=500, render_ms=20.0)
+
+
+def rows():
+    time.sleep(ARGS.render_ms / 1000)
+    return [
+        {'id': i, 'name': f'Customer {i}', 'email': f'customer{i}@example.com', 'balance': f'{i * 13.37:.2f}'}
+        for i in range(ARGS.rows)
+    ]
+
+
+def html_view(request):
+    body = ''.join(
+        f'<tr><td>{r["id"]}</td><td>{r["name"]}</td><td>{r["email"]}</td><td>{r["balance"]}</td></tr>'
+        for r in rows()
+    )
+    return HttpResponse(f'<html><body><table>{body}</table></body></html>')
+
+
+def json_view(request):
+    return JsonResponse({'results': rows()})
+
+
+def csv_view(request):
+    def lines():
+        for r in rows():
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(r.values())
+            yield buffer.getvalue()
+
+    return StreamingHttpResponse(lines(), content_type='text/csv')
+
+
+urlpatterns = [
+    path('html/', html_view),
+    path('json/', json_view),
+    path('csv/', csv_view),
+]
+
+CORE_MIDDLEWARE = ('core.middleware.CompressionMiddleware', 'core.middleware.ETagMiddleware')
+# The rate limiter needs django_redis; the views run against a local memory cache.
+MIDDLEWARE = [m for m in settings.MIDDLEWARE if m != 'core.ratelimit.RateLimitMiddleware']
+SETUPS = {
+    'baseline': [m for m in MIDDLEWARE if m not in CORE_MIDDLEWARE],
+    'compression': [m for m in MIDDLEWARE if m != 'core.middleware.ETagMiddleware'],
+    'compression+etag': MIDDLEWARE,
+}
+
+
+def request(app, url, etag=None):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'HTTP_ACCEPT_ENCODING': 'br, gzip',
+        'wsgi.input': BytesIO(),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+    }
+    if etag:
+        environ['HTTP_IF_NONE_MATCH'] = etag
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured.update(status=status, headers=dict(headers))
+
+    start = time.perf_counter()
+    result = app(environ, start_response)
+    size = sum(len(chunk) for chunk in result)
+    if hasattr(result, 'close'):
+        result.close()
+    return time.perf_counter() - start, size, captured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=ARGS.rows)
+    parser.add_argument('--render-ms', type=float, default=ARGS.render_ms)
+    parser.add_argument('--mbps', type=float, default=10, help='client bandwidth used for latency (default: 10)')
+    args = parser.parse_args()
+    ARGS.rows, ARGS.render_ms = args.rows, args.render_ms
+
+    print(f'{args.requests} polls per view, {args.rows} rows, {args.render_ms:.0f} ms render, {args.mbps:g} Mbit/s\n')
+    print(f'{"view":<6} {"setup":<18} {"KiB/req":>9} {"server ms":>10} {"latency ms":>11} {"304s":>5}  encoding')
+    cache = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    for url in ('/html/', '/json/', '/csv/'):
+        for label, middleware in SETUPS.items():
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], ROOT_URLCONF=__name__,
+                                   MIDDLEWARE=middleware, CACHES=cache):
+                app = WSGIHandler()
+                etag, timings, sizes, not_modified = None, [], [], 0
+                for _ in range(args.requests):
+                    elapsed, size, captured = request(app, url, etag)
+                    etag = captured['headers'].get('ETag', etag)
+                    not_modified += captured['status'].startswith('304')
+                    timings.append(elapsed)
+                    sizes.append(size)
+            server = statistics.mean(timings) * 1000
+            transfer = statistics.mean(sizes) * 8 / (args.mbps * 1e6) * 1000
+            encoding = captured['headers'].get('Content-Encoding', '-')
+            print(
+                f'{url.strip("/"):<6} {label:<18} {statistics.mean(sizes) / 1024:>9.1f} {server:>10.2f} '
+                f'{server + transfer:>11.2f} {not_modified:>5}  {encoding}'
+            )
+
+
+if __name__ == '__main__':
+    main()
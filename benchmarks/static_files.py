@@ -0,0 +1,139 @@
+"""
+Cost of serving the admin's static files: Django's static view vs WhiteNoise.
+
+Runs collectstatic if needed and requests every admin CSS/JS file through
+the project's WSGI handler, in-process, as a browser would (Accept-Encoding:
+br, gzip). For each setup it prints how long a worker thread is busy per
+request, the bytes sent and the Cache-Control header. It also prints how
+many requests reach gunicorn per 1000 page views behind a CDN that honours
+that header.
+
+    python benchmarks/static_files.py
+    python benchmarks/static_files.py --rounds 50
+
+For requests per second under concurrency, point
+benchmarks/gunicorn_settings.py at a /static/ path.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.staticfiles.storage import staticfiles_storage  # noqa: E402
+from django.contrib.staticfiles.views import serve  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import re_path  # noqa: E402
+
+# ROOT_URLCONF for the "django" setup: what serving static files from the
+# app looks like without WhiteNoise, every request through the full stack.
+urlpatterns = [
+    re_path(r'^static/(?P<path>.*)$', lambda request, path: serve(request, path, insecure=True)),
+]
+
+PAGE_VIEWS = 1000
+SETUPS = {
+    'django': {
+        'MIDDLEWARE': [m for m in settings.MIDDLEWARE if not m.startswith('whitenoise.')],
+        'ROOT_URLCONF': __name__,
+        'hashed': False,
+    },
+    'whitenoise': {
+        'MIDDLEWARE': settings.MIDDLEWARE,
+        'hashed': True,
+    },
+}
+
+
+def static_files():
+    manifest = Path(settings.STATIC_ROOT) / 'staticfiles.json'
+    if not manifest.exists():
+        call_command('collectstatic', interactive=False, verbosity=0)
+    return sorted(
+        name for name in staticfiles_storage.hashed_files
+        if name.startswith('admin/') and name.endswith(('.css', '.js'))
+    )
+
+
+def request(app, url):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'HTTP_ACCEPT_ENCODING': 'br, gzip',
+        'wsgi.input': BytesIO(),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+    }
+    status_headers = {}
+
+    def start_response(status, headers, exc_info=None):
+        status_headers.update(status=status, headers=dict(headers))
+
+    start = time.perf_counter()
+    result = app(environ, start_response)
+    size = sum(len(chunk) for chunk in result)
+    if hasattr(result, 'close'):
+        result.close()
+    return time.perf_counter() - start, size, status_headers
+
+
+def cdn_origin_requests(cache_control, files):
+    # A CDN keeps a 'public, max-age=N' response for N seconds; without it
+    # every page view goes back to gunicorn.
+    cacheable = 'max-age=' in cache_control and 'max-age=0' not in cache_control and 'private' not in cache_control
+    return files if cacheable else PAGE_VIEWS * files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    names = static_files()
+    print(f'{len(names)} admin CSS/JS files, {args.rounds} rounds\n')
+    print(f'{"setup":<12} {"thread ms/req":>14} {"p99 ms":>8} {"KiB sent":>10} {"origin reqs/1000 views":>23}  cache-control')
+    for label, setup in SETUPS.items():
+        overrides = {key: value for key, value in setup.items() if key != 'hashed'}
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], **overrides):
+            app = WSGIHandler()
+            urls = [
+                '/static/' + (staticfiles_storage.stored_name(name) if setup['hashed'] else name)
+                for name in names
+            ]
+            request(app, urls[0])  # warm up
+            timings, sent, headers = [], 0, {}
+            for _ in range(args.rounds):
+                for url in urls:
+                    elapsed, size, headers = request(app, url)
+                    assert headers['status'].startswith('200'), (url, headers['status'])
+                    timings.append(elapsed)
+                    sent += size
+        cache_control = headers['headers'].get('Cache-Control', '-')
+        p99 = statistics.quantiles(timings, n=100)[98]
+        print(
+            f'{label:<12} {statistics.mean(timings) * 1000:>14.3f} {p99 * 1000:>8.3f} '
+            f'{sent / args.rounds / 1024:>10.1f} {cdn_origin_requests(cache_control, len(names)):>23}  {cache_control}'
+        )
+
+
+if __name__ == '__main__':
+    main()
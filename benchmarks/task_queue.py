@@ -0,0 +1,160 @@
+"""
+Leases, wakeups and throughput of core.taskqueue against a real Redis.
+
+Runs a Worker in-process, under a throwaway key prefix, with a short
+``--lease`` and checks that:
+
+1. a job running for several lease timeouts keeps its lease (heartbeat)
+   and runs once;
+2. a job claimed by a worker that dies is reclaimed once its lease runs out
+   and then succeeds;
+3. a job that overruns its ``timeout`` is retried once its lease runs out,
+   and the overrunning attempt, when it ends, leaves the retry's result
+   alone;
+4. ``--jobs`` jobs enqueued while no worker waits leave at most
+   NOTIFY_LENGTH wakeups behind, and all of them succeed.
+
+Prints the throughput of 4. and exits with status 1 if a check fails. The
+Redis is the one in REDIS_URL.
+
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/task_queue.py
+    python benchmarks/task_queue.py --jobs 20000 --concurrency 8
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from core.taskqueue import NOTIFY_LENGTH, SUCCEEDED, Job, Worker, get_broker, task  # noqa: E402
+
+
+@task
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+@task
+def noop(index):
+    return index
+
+
+overran = set()
+
+
+@task(timeout=1, retry_backoff=0.1)
+def overrun(seconds, key):
+    # Only the first attempt overruns.
+    if key not in overran:
+        overran.add(key)
+        time.sleep(seconds)
+        return 'overran'
+    return 'retried'
+
+
+def start_worker(concurrency):
+    worker = Worker(['default'], concurrency)
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    return worker, thread
+
+
+def stop_worker(worker, thread):
+    worker.stop()
+    thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lease', type=int, default=3, help='LEASE_TIMEOUT in seconds (default: 3)')
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    settings.TASK_QUEUE = {**settings.TASK_QUEUE, 'EAGER': False, 'LEASE_TIMEOUT': args.lease,
+                           'PREFIX': f'bench-tasks-{uuid.uuid4().hex[:8]}'}
+    broker = get_broker()
+    problems = []
+
+    # 1. Heartbeat: a job running for 2.5 leases is never reclaimed.
+    worker, thread = start_worker(1)
+    job = sleep.delay(args.lease * 2.5)
+    status = job.wait(timeout=args.lease * 5)
+    fields = job.fetch()
+    print(f'long job: {status} after {fields.get("attempts")} attempt(s)')
+    if status != SUCCEEDED or fields.get('attempts') != '1':
+        problems.append(f'a job running for 2.5 leases ended {status} after {fields.get("attempts")} attempts')
+
+    # 2. Reclaim: a job claimed by a dead worker runs again after its lease.
+    stop_worker(worker, thread)
+    job = noop.delay(1)
+    claimed = broker.claim(['default'], args.lease)
+    start = time.monotonic()
+    worker, thread = start_worker(1)
+    status = job.wait(timeout=args.lease * 4)
+    fields = job.fetch()
+    print(f'orphaned job: {status} after {fields.get("attempts")} attempt(s), {time.monotonic() - start:.1f}s')
+    if claimed != job.id or status != SUCCEEDED or 'Lease expired' not in fields.get('error', ''):
+        problems.append(f'an orphaned job ended {status} without its lease expiring')
+    stop_worker(worker, thread)
+
+    # 3. Timeout: the overrunning attempt loses its lease and its outcome.
+    worker, thread = start_worker(2)
+    job = overrun.delay(args.lease * 2, uuid.uuid4().hex)
+    job.wait(timeout=args.lease * 4)
+    # Let the first attempt end too.
+    time.sleep(args.lease * 2)
+    fields = job.fetch()
+    print(f'overrunning job: {fields.get("status")} with {fields.get("result")} after '
+          f'{fields.get("attempts")} attempt(s); worker stats {dict(worker.stats)}')
+    if (fields.get('status'), fields.get('result'), fields.get('attempts')) != (SUCCEEDED, '"retried"', '2') \
+            or worker.stats['succeeded'] != 1 or worker.stats['retried'] != 1:
+        problems.append('the attempt that overran its timeout overwrote the retry or was counted')
+    stop_worker(worker, thread)
+
+    # 4. Backlog: wakeups stay bounded and every job runs.
+    start = time.monotonic()
+    jobs = [noop.delay(index) for index in range(args.jobs)]
+    enqueued = time.monotonic() - start
+    wakeups = broker.redis.llen(broker.key('notify', 'default'))
+    print(f'\n{args.jobs:,} jobs enqueued in {enqueued:.1f}s ({args.jobs / enqueued:,.0f}/s), {wakeups} wakeups')
+    if wakeups > NOTIFY_LENGTH:
+        problems.append(f'{wakeups} wakeups queued for {args.jobs} jobs, more than {NOTIFY_LENGTH}')
+
+    start = time.monotonic()
+    worker, thread = start_worker(args.concurrency)
+    while worker.stats['succeeded'] + worker.stats['failed'] < args.jobs and time.monotonic() - start < 600:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - start
+    stop_worker(worker, thread)
+    print(f'{worker.stats["succeeded"]:,} run in {elapsed:.1f}s ({worker.stats["succeeded"] / elapsed:,.0f}/s) '
+          f'on {args.concurrency} threads')
+    succeeded = sum(Job(job.id, broker).status == SUCCEEDED for job in jobs[-100:])
+    if worker.stats['succeeded'] != args.jobs or succeeded != 100:
+        problems.append(f'{worker.stats["succeeded"]:,} of {args.jobs:,} jobs succeeded')
+
+    broker.redis.delete(*broker.redis.keys(broker.prefix + '*') or ['-'])
+    for problem in problems:
+        print(f'\nFAIL: {problem}')
+    if problems:
+        sys.exit(1)
+    print('\nLeases renewed, orphans reclaimed, wakeups bounded.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Span structure and per-request overhead of core.telemetry, without Azure.
+
+Serves a view that runs one SQL query and one cache read in-process through
+the project's WSGI handler, first untraced and then with tracing set up with
+the in-memory exporter at several sample ratios. Checks that a sampled
+request produces one server span with the query and the Redis calls as its
+children, in one trace, and that an unsampled one produces nothing. Prints
+the time per request and spans per request for each ratio, and exits with
+status 1 if a check fails or tracing at ``--ratio`` costs more than
+``--budget-ms`` per request.
+
+The query runs on an in-memory SQLite database unless POSTGRES_HOST is set;
+the cache read goes to the Redis in REDIS_URL.
+
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/tracing.py
+    python benchmarks/tracing.py --requests 5000 --ratio 0.05
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/0')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+if not os.getenv('POSTGRES_HOST'):
+    settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+    settings.DATABASE_REPLICAS = []
+
+from django.core.cache import cache  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.http import JsonResponse  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from django.urls import path  # noqa: E402
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased  # noqa: E402
+from opentelemetry.trace import SpanKind, get_tracer_provider  # noqa: E402
+
+from core import telemetry  # noqa: E402
+
+
+def traced_view(request, pk):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT %s', [pk])
+        row = cursor.fetchone()
+    return JsonResponse({'row': row[0], 'cached': cache.get(f'benchmark:{pk}')})
+
+
+urlpatterns = [
+    path('items/<int:pk>/', traced_view),
+]
+
+
+def request(app, pk):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': f'/items/{pk}/',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'REMOTE_ADDR': '10.0.0.1',
+        'wsgi.input': BytesIO(),
+        'wsgi.url_scheme': 'http',
+        'wsgi.errors': sys.stderr,
+    }
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+
+    b''.join(app(environ, start_response))
+    assert captured['status'].startswith('200'), captured['status']
+
+
+def measure(requests):
+    app = WSGIHandler()
+    request(app, 0)  # warm up
+    timings = []
+    for pk in range(requests):
+        start = time.perf_counter()
+        request(app, pk)
+        timings.append(time.perf_counter() - start)
+    return statistics.mean(timings) * 1000
+
+
+def set_ratio(ratio):
+    get_tracer_provider().sampler.delegate = ParentBased(TraceIdRatioBased(ratio))
+
+
+def check_structure():
+    """Problems with the spans of one sampled request, if any."""
+    set_ratio(1.0)
+    telemetry.memory_exporter.clear()
+    request(WSGIHandler(), 1)
+    spans = telemetry.memory_exporter.get_finished_spans()
+    servers = [span for span in spans if span.kind == SpanKind.SERVER]
+    if len(servers) != 1:
+        return [f'expected one server span, got {[span.name for span in spans]}']
+    server = servers[0]
+    children = [span for span in spans if span.parent is not None and span.parent.span_id == server.context.span_id]
+    problems = []
+    if server.attributes.get('http.route') != 'items/<int:pk>/':
+        problems.append(f'server span has route {server.attributes.get("http.route")!r}')
+    if not any(span.attributes.get('db.statement', '').startswith('SELECT') for span in children):
+        problems.append('no SQL query span under the request')
+    if not any(span.attributes.get('db.system') == 'redis' for span in children):
+        problems.append('no Redis span under the request')
+    if len({span.context.trace_id for span in spans}) != 1:
+        problems.append('spans of one request are in several traces')
+
+    set_ratio(0.0)
+    telemetry.memory_exporter.clear()
+    request(WSGIHandler(), 2)
+    if telemetry.memory_exporter.get_finished_spans():
+        problems.append('an unsampled request still exported spans')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--ratio', type=float, default=0.1, help='sample ratio held to the budget (default: 0.1)')
+    parser.add_argument('--budget-ms', type=float, default=0.5,
+                        help='allowed overhead per request at --ratio (default: 0.5)')
+    args = parser.parse_args()
+
+    overrides = {
+        'DEBUG': False, 'ALLOWED_HOSTS': ['localhost'], 'ROOT_URLCONF': __name__,
+        # High enough to never deny; the rate limiter's Redis call stays in.
+        'RATELIMIT_RULES': [{'key': 'ip', 'rate': '1000000/m'}],
+    }
+    with override_settings(**overrides):
+        baseline = measure(args.requests)
+
+    settings.TRACING = {**settings.TRACING, 'EXPORTER': 'memory', 'SAMPLE_RATIO': 1.0}
+    telemetry.configure_tracing()
+    with override_settings(**overrides, MIDDLEWARE=settings.MIDDLEWARE):
+        problems = check_structure()
+        print(f'{args.requests} requests, database {connection.vendor}, Redis at {settings.CACHES["default"]["LOCATION"]}\n')
+        print(f'{"sample ratio":<14} {"ms/req":>8} {"overhead ms":>12} {"spans/req":>10}')
+        print(f'{"untraced":<14} {baseline:>8.3f} {0:>12.3f} {0:>10.2f}')
+        overhead = None
+        for ratio in sorted({1.0, 0.5, args.ratio, 0.0}, reverse=True):
+            set_ratio(ratio)
+            telemetry.memory_exporter.clear()
+            mean = measure(args.requests)
+            spans = len(telemetry.memory_exporter.get_finished_spans()) / (args.requests + 1)
+            print(f'{ratio:<14g} {mean:>8.3f} {mean - baseline:>12.3f} {spans:>10.2f}')
+            if ratio == args.ratio:
+                overhead = mean - baseline
+
+    for problem in problems:
+        print(f'\nFAIL: {problem}')
+    if overhead > args.budget_ms:
+        print(f'\nFAIL: tracing at {args.ratio:g} costs {overhead:.3f} ms/request, over the {args.budget_ms} ms budget.')
+    if problems or overhead > args.budget_ms:
+        sys.exit(1)
+    print(f'\nSpan structure OK; overhead at {args.ratio:g} within {args.budget_ms} ms/request.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import atexit
+
+from django.apps import AppConfig
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+
+class CoreConfig(AppConfig):
+    name = 'core'
+
+    def ready(self):
+        from core.middleware import flush_etag_invalidation, invalidate_etags
+        from core.profiling import install_query_counting
+        from core.querybudget import install_query_comments, install_query_recording
+        from core.querycache import install_write_tracking
+
+        for signal in (post_save, post_delete, m2m_changed):
+            signal.connect(invalidate_etags, dispatch_uid='core.invalidate_etags')
+        # Writes only mark ETags stale; they are dropped once the request (or
+        # the command, at exit) is done. Workers flush after every task.
+        request_finished.connect(flush_etag_invalidation, dispatch_uid='core.flush_etag_invalidation')
+        atexit.register(flush_etag_invalidation)
+        # Per-request SQL counts for core.profiling
+        connection_created.connect(install_query_counting, dispatch_uid='core.install_query_counting')
+        # Query budgets and N+1 detection (core.querybudget)
+        connection_created.connect(install_query_recording, dispatch_uid='core.install_query_recording')
+        # Table generations for core.querycache, bumped by every write
+        connection_created.connect(install_write_tracking, dispatch_uid='core.install_write_tracking')
+        # Call sites in pg_stat_statements for query_report; after the others
+        connection_created.connect(install_query_comments, dispatch_uid='core.install_query_comments')
@@ -0,0 +1,140 @@
+"""
+Async access to the Redis behind ``CACHES`` for async views.
+
+Django's own ``cache.aget()`` and friends run the sync client in a thread.
+``AsyncRedisCache`` talks to the same ``REDIS_URL`` with ``redis.asyncio``
+instead, reusing the sync backend's key function and serializer/compressor
+so values are interchangeable with ``django.core.cache.cache``. Writes
+publish on the invalidation channel like ``TieredRedisCache`` does, and
+every call goes through the sync backend's circuit breaker: while it is open
+calls are served by its local fallback instead of waiting on Redis.
+
+One client (and connection pool) is kept per event loop. Under
+``SERVER_MODE=asgi`` that is one per uvicorn worker; under WSGI every async
+view runs in a loop of its own, whose pool is never reused, so use the sync
+cache there.
+"""
+import asyncio
+import logging
+import weakref
+
+import redis.asyncio as redis
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from core.backends.cache import _REDIS_ERRORS, call_counter
+
+logger = logging.getLogger(__name__)
+
+_clients = weakref.WeakKeyDictionary()
+
+
+class AsyncRedisCache:
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.params = settings.CACHES[alias]
+        self.options = self.params.get('OPTIONS', {})
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @property
+    def client(self):
+        loop = asyncio.get_running_loop()
+        clients = _clients.setdefault(loop, {})
+        if self.alias not in clients:
+            pool_kwargs = self.options.get('CONNECTION_POOL_KWARGS', {})
+            # Blocking like the sync pool: a burst waits for a connection
+            # instead of failing (and tripping the circuit breaker).
+            pool = redis.BlockingConnectionPool.from_url(
+                self.params['LOCATION'],
+                socket_timeout=self.options.get('SOCKET_TIMEOUT'),
+                socket_connect_timeout=self.options.get('SOCKET_CONNECT_TIMEOUT'),
+                max_connections=pool_kwargs.get('max_connections', 10),
+                timeout=pool_kwargs.get('timeout', 1),
+            )
+            clients[self.alias] = redis.Redis(connection_pool=pool)
+        return clients[self.alias]
+
+    def make_key(self, key, version=None):
+        return str(self.backend.make_key(key, version=version))
+
+    def _timeout(self, timeout):
+        timeout = self.backend.get_backend_timeout(timeout)
+        return None if timeout is None else max(int(timeout * 1000), 1)
+
+    async def _guard(self, call, fallback):
+        """``await call()`` through the sync backend's circuit breaker, if it has one."""
+        counter = call_counter.get()
+        if counter is not None:
+            counter['cache'] += 1
+        breaker = getattr(self.backend, 'breaker', None)
+        if breaker is None:
+            return await call()
+        if not breaker.allow():
+            return fallback()
+        try:
+            result = await call()
+        except _REDIS_ERRORS:
+            logger.debug('Redis call failed, using local fallback', exc_info=True)
+            breaker.record_failure()
+            return fallback()
+        except Exception:
+            breaker.record_success()
+            raise
+        if breaker.is_open:
+            self.backend.fallback.clear()
+        breaker.record_success()
+        return result
+
+    async def _invalidate(self, key):
+        channel = self.options.get('INVALIDATION_CHANNEL')
+        if channel:
+            await self._guard(lambda: self.client.publish(channel, f'async:{key}'), lambda: None)
+
+    async def ping(self):
+        """Whether Redis answered; False while the circuit is open."""
+        return await self._guard(self.client.ping, lambda: False)
+
+    async def get(self, key, default=None, version=None):
+        async def call():
+            value = await self.client.get(self.make_key(key, version))
+            return default if value is None else self.backend.client.decode(value)
+
+        return await self._guard(call, lambda: self.backend.fallback.get(key, default, version))
+
+    async def get_many(self, keys, version=None):
+        keys = list(keys)
+
+        async def call():
+            values = await self.client.mget([self.make_key(key, version) for key in keys])
+            return {
+                key: self.backend.client.decode(value)
+                for key, value in zip(keys, values)
+                if value is not None
+            }
+
+        return await self._guard(call, lambda: self.backend.fallback.get_many(keys, version))
+
+    async def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        redis_key = self.make_key(key, version)
+
+        await self._guard(
+            lambda: self.client.set(redis_key, self.backend.client.encode(value), px=self._timeout(timeout)),
+            lambda: self.backend.fallback.set(key, value, timeout, version),
+        )
+        await self._invalidate(redis_key)
+
+    async def delete(self, key, version=None):
+        redis_key = self.make_key(key, version)
+        deleted = await self._guard(
+            lambda: self.client.delete(redis_key), lambda: self.backend.fallback.delete(key, version),
+        )
+        await self._invalidate(redis_key)
+        return bool(deleted)
+
+
+def get_async_cache(alias='default'):
+    return AsyncRedisCache(alias)
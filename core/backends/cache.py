@@ -0,0 +1,548 @@
+"""
+Two-tier cache backend: a bounded in-process LRU in front of django_redis.
+
+Hot keys are served from process memory. Every write still goes to Redis and
+publishes the key on a pub/sub channel so the other gunicorn workers and App
+Service instances drop their local copy. ``LOCAL_TIMEOUT`` bounds how long a
+local entry can be served if an invalidation message is ever lost.
+
+Underneath, ``ResilientRedisCache`` puts a circuit breaker around every Redis
+call. After ``CIRCUIT_FAILURE_THRESHOLD`` consecutive connection errors or
+timeouts the circuit opens and calls go to a process-local ``LocMemCache``
+instead of waiting on Redis; after ``CIRCUIT_RESET_TIMEOUT`` seconds a single
+probe is let through to decide whether to close it again.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "core.backends.cache.TieredRedisCache",
+            "LOCATION": os.environ.get('REDIS_URL'),
+            "OPTIONS": {
+                "LOCAL_MAX_ENTRIES": 1000,
+                "LOCAL_TIMEOUT": 5,
+                "INVALIDATION_CHANNEL": "cache-invalidation",
+                "CIRCUIT_FAILURE_THRESHOLD": 5,
+                "CIRCUIT_RESET_TIMEOUT": 30,
+            },
+        }
+    }
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django_redis.cache import RedisCache
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+logger = logging.getLogger(__name__)
+
+_REDIS_ERRORS = (ConnectionInterrupted, RedisConnectionError, RedisTimeoutError)
+
+_MISSING = object()
+_CLEAR_ALL = '*'
+_IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+
+# Counter that Redis calls are added to (as 'cache') while someone measures
+# the current request (core.profiling); None otherwise.
+call_counter = ContextVar('core.backends.cache.call_counter', default=None)
+
+_process_state = {}
+_process_state_lock = threading.Lock()
+
+
+def per_process(key, factory):
+    """
+    Return the object stored under ``key`` for this process, creating it once.
+
+    Django builds one cache object per thread, so state that must be shared by
+    all threads lives here. The pid is part of the key so workers forked after
+    ``--preload`` don't inherit the master's threads or sockets.
+    """
+    key = (os.getpid(),) + key
+    with _process_state_lock:
+        if key not in _process_state:
+            _process_state[key] = factory()
+        return _process_state[key]
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._stats = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.state != self.CLOSED
+
+    def allow(self):
+        """Whether the next call may go to Redis."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._stats['circuit_fallback_calls'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self.state != self.CLOSED:
+                self._probing = False
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._stats['circuit_failures'] += 1
+            self._stats['circuit_fallback_calls'] += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._probing = False
+                self._opened_at = time.monotonic()
+                if self.state != self.OPEN:
+                    self._transition(self.OPEN)
+
+    def _transition(self, state):
+        logger.warning('Cache circuit %s: %s -> %s', self.name, self.state, state)
+        self._stats[f'circuit_{state}'] += 1
+        self.state = state
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['circuit_state'] = self.state
+        return stats
+
+
+class LocalTier:
+    """
+    Per-process LRU shared by every thread's cache instance.
+
+    Django builds one cache object per thread, so the local tier and its
+    pub/sub listener live here instead of on the backend instance.
+    """
+
+    def __init__(self, max_entries, timeout, channel):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.generation = 0
+        self.subscribed = False
+        self._data = OrderedDict()
+        self._stats = Counter()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key) if self.subscribed else None
+            if entry is None or entry[0] < time.monotonic():
+                self._stats['local_misses'] += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self._stats['local_hits'] += 1
+        value = entry[1]
+        # Cached objects are handed out as copies so a caller mutating the
+        # result (e.g. a session dict) can't change it for everyone else.
+        return pickle.loads(value) if isinstance(value, _Pickled) else value
+
+    def set(self, key, value, timeout, generation=None):
+        if not self.subscribed or self.max_entries <= 0:
+            return
+        if timeout is not None:
+            timeout = min(timeout, self.timeout)
+        else:
+            timeout = self.timeout
+        if not isinstance(value, _IMMUTABLE_TYPES):
+            value = _Pickled(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            # An invalidation arrived while the value was being read from
+            # Redis; it may already be stale, so don't keep it locally.
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def record(self, name, count=1):
+        with self._lock:
+            self._stats[name] += count
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_entries'] = len(self._data)
+        return stats
+
+    def ensure_listening(self, redis_client):
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(
+                    target=self._listen, args=(redis_client,), name='cache-invalidation', daemon=True
+                )
+                self._listener.start()
+
+    def _listen(self, redis_client):
+        backoff = 0.1
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were not subscribed was missed.
+                self.clear()
+                self.subscribed = True
+                backoff = 0.1
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._on_message(message['data'])
+            except Exception:
+                self.subscribed = False
+                self.clear()
+                logger.warning('Cache invalidation listener disconnected, retrying in %.1fs', backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _on_message(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        origin, _, key = data.partition(':')
+        if origin == self.origin:
+            return
+        if key == _CLEAR_ALL:
+            self.clear()
+        else:
+            self.delete(key)
+
+
+class _Pickled(bytes):
+    pass
+
+
+class ResilientRedisCache(RedisCache):
+    """django_redis cache that falls back to local memory while Redis is down."""
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        self._server_location = server
+        self._fallback_params = {
+            'TIMEOUT': params.get('TIMEOUT', 300),
+            'KEY_PREFIX': params.get('KEY_PREFIX', ''),
+            'VERSION': params.get('VERSION', 1),
+            'KEY_FUNCTION': params.get('KEY_FUNCTION'),
+            'OPTIONS': {'MAX_ENTRIES': params.get('OPTIONS', {}).get('FALLBACK_MAX_ENTRIES', 1000)},
+        }
+
+    @property
+    def breaker(self):
+        options = self._params.get('OPTIONS', {})
+        return per_process(
+            ('breaker', str(self._server_location)),
+            lambda: CircuitBreaker(
+                name=str(self._server_location).rpartition('@')[2],
+                failure_threshold=options.get('CIRCUIT_FAILURE_THRESHOLD', 5),
+                reset_timeout=options.get('CIRCUIT_RESET_TIMEOUT', 30),
+            ),
+        )
+
+    @property
+    def circuit_open(self):
+        return self.breaker.is_open
+
+    @property
+    def fallback(self):
+        return per_process(
+            ('fallback', str(self._server_location)),
+            lambda: LocMemCache(f'redis-fallback-{self._server_location}', self._fallback_params),
+        )
+
+    def stats(self):
+        return self.breaker.stats()
+
+    def _guard(self, call, fallback):
+        counter = call_counter.get()
+        if counter is not None:
+            counter['cache'] += 1
+        breaker = self.breaker
+        if not breaker.allow():
+            return fallback()
+        try:
+            result = call()
+        except _REDIS_ERRORS:
+            logger.debug('Redis call failed, using local fallback', exc_info=True)
+            breaker.record_failure()
+            return fallback()
+        except Exception:
+            # Redis answered (e.g. incr on a missing key); it's reachable.
+            breaker.record_success()
+            raise
+        if breaker.is_open:
+            # Writes made during the outage never reached Redis; drop them
+            # rather than serve them after Redis is back.
+            self.fallback.clear()
+        breaker.record_success()
+        return result
+
+    def get(self, key, default=None, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).get(key, default=default, version=version, client=client),
+            lambda: self.fallback.get(key, default, version=version),
+        )
+
+    def get_many(self, keys, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).get_many(keys, version=version, client=client),
+            lambda: self.fallback.get_many(keys, version=version),
+        )
+
+    def has_key(self, key, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).has_key(key, version=version, client=client),
+            lambda: self.fallback.has_key(key, version=version),
+        )
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, nx=False, xx=False):
+        def fallback():
+            if nx:
+                return self.fallback.add(key, value, timeout, version=version)
+            if xx and not self.fallback.has_key(key, version=version):
+                return False
+            self.fallback.set(key, value, timeout, version=version)
+            return True
+
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).set(
+                key, value, timeout=timeout, version=version, client=client, nx=nx, xx=xx
+            ),
+            fallback,
+        )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).add(key, value, timeout=timeout, version=version, client=client),
+            lambda: self.fallback.add(key, value, timeout, version=version),
+        )
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).set_many(data, timeout=timeout, version=version, client=client),
+            lambda: self.fallback.set_many(data, timeout, version=version),
+        )
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).touch(key, timeout=timeout, version=version, client=client),
+            lambda: self.fallback.touch(key, timeout, version=version),
+        )
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).delete(key, version=version, prefix=prefix, client=client),
+            lambda: self.fallback.delete(key, version=version),
+        )
+
+    def delete_many(self, keys, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).delete_many(keys, version=version, client=client),
+            lambda: self.fallback.delete_many(keys, version=version),
+        )
+
+    def delete_pattern(self, *args, **kwargs):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).delete_pattern(*args, **kwargs),
+            lambda: self.fallback.clear(),
+        )
+
+    def clear(self):
+        return self._guard(lambda: super(ResilientRedisCache, self).clear(), lambda: self.fallback.clear())
+
+    def incr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        def fallback():
+            if ignore_key_check and not self.fallback.has_key(key, version=version):
+                self.fallback.set(key, delta, version=version)
+                return delta
+            return self.fallback.incr(key, delta, version=version)
+
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).incr(
+                key, delta=delta, version=version, client=client, ignore_key_check=ignore_key_check
+            ),
+            fallback,
+        )
+
+    def decr(self, key, delta=1, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).decr(key, delta=delta, version=version, client=client),
+            lambda: self.fallback.decr(key, delta, version=version),
+        )
+
+    def incr_version(self, key, delta=1, version=None, client=None):
+        return self._guard(
+            lambda: super(ResilientRedisCache, self).incr_version(key, delta=delta, version=version, client=client),
+            lambda: self.fallback.incr_version(key, delta, version=version),
+        )
+
+
+class TieredRedisCache(ResilientRedisCache):
+    @property
+    def local(self):
+        options = self._params.get('OPTIONS', {})
+        channel = options.get('INVALIDATION_CHANNEL', 'cache-invalidation')
+        tier = per_process(
+            ('local', str(self._server_location), channel),
+            lambda: LocalTier(
+                max_entries=options.get('LOCAL_MAX_ENTRIES', 1000),
+                timeout=options.get('LOCAL_TIMEOUT', 5),
+                channel=channel,
+            ),
+        )
+        tier.ensure_listening(self.client.get_client(write=True))
+        return tier
+
+    def stats(self):
+        """Hit/miss counters per tier and circuit breaker state for this process."""
+        return {**self.local.stats(), **super().stats()}
+
+    def _invalidate(self, key):
+        local = self.local
+        if key == _CLEAR_ALL:
+            local.clear()
+        else:
+            local.delete(key)
+
+        def publish():
+            return self.client.get_client(write=True).publish(local.channel, f'{local.origin}:{key}')
+
+        # If this fails other processes fall back to LOCAL_TIMEOUT for the key.
+        self._guard(publish, lambda: None)
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            return self.default_timeout
+        return timeout
+
+    def get(self, key, default=None, version=None, client=None):
+        local_key = self.make_key(key, version=version)
+        local = self.local
+        value = local.get(local_key)
+        if value is not _MISSING:
+            return value
+        generation = local.generation
+        tier = 'fallback' if self.circuit_open else 'redis'
+        value = super().get(key, default=_MISSING, version=version, client=client)
+        if value is _MISSING:
+            local.record(f'{tier}_misses')
+            return default
+        local.record(f'{tier}_hits')
+        local.set(local_key, value, self.default_timeout, generation=generation)
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        local = self.local
+        found, remote_keys = {}, []
+        for key in keys:
+            value = local.get(self.make_key(key, version=version))
+            if value is _MISSING:
+                remote_keys.append(key)
+            else:
+                found[key] = value
+        if remote_keys:
+            generation = local.generation
+            tier = 'fallback' if self.circuit_open else 'redis'
+            remote = super().get_many(remote_keys, version=version, client=client)
+            local.record(f'{tier}_hits', len(remote))
+            local.record(f'{tier}_misses', len(remote_keys) - len(remote))
+            for key, value in remote.items():
+                local.set(self.make_key(key, version=version), value, self.default_timeout, generation=generation)
+            found.update(remote)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None, nx=False, xx=False):
+        result = super().set(key, value, timeout=timeout, version=version, client=client, nx=nx, xx=xx)
+        local_key = self.make_key(key, version=version)
+        self._invalidate(local_key)
+        if result and not (nx or xx):
+            self.local.set(local_key, value, self._local_timeout(timeout))
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().add(key, value, timeout=timeout, version=version, client=client)
+        if result:
+            self._invalidate(self.make_key(key, version=version))
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, client=None):
+        result = super().set_many(data, timeout=timeout, version=version, client=client)
+        for key in data:
+            self._invalidate(self.make_key(key, version=version))
+        return result
+
+    def delete(self, key, version=None, prefix=None, client=None):
+        result = super().delete(key, version=version, prefix=prefix, client=client)
+        self._invalidate(self.make_key(key, version=version))
+        return result
+
+    def delete_many(self, keys, version=None, client=None):
+        result = super().delete_many(keys, version=version, client=client)
+        for key in keys:
+            self._invalidate(self.make_key(key, version=version))
+        return result
+
+    def delete_pattern(self, *args, **kwargs):
+        result = super().delete_pattern(*args, **kwargs)
+        self._invalidate(_CLEAR_ALL)
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._invalidate(_CLEAR_ALL)
+        return result
+
+    def incr(self, key, delta=1, version=None, client=None, ignore_key_check=False):
+        result = super().incr(key, delta=delta, version=version, client=client, ignore_key_check=ignore_key_check)
+        self._invalidate(self.make_key(key, version=version))
+        return result
+
+    def decr(self, key, delta=1, version=None, client=None):
+        result = super().decr(key, delta=delta, version=version, client=client)
+        self._invalidate(self.make_key(key, version=version))
+        return result
+
+    def incr_version(self, key, delta=1, version=None, client=None):
+        result = super().incr_version(key, delta=delta, version=version, client=client)
+        self._invalidate(self.make_key(key, version=version))
+        return result
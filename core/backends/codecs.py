@@ -0,0 +1,144 @@
+"""
+Compact serializer and compressor for django_redis.
+
+Both write a one-byte tag in front of the payload so values can be read back
+no matter which format or algorithm wrote them. Untagged values written by
+the default django_redis ``PickleSerializer``/``IdentityCompressor`` (pickle
+streams start with ``0x80``) keep loading, so the settings can be switched
+without flushing Redis or logging everybody out.
+
+    "OPTIONS": {
+        "SERIALIZER": "core.backends.codecs.TaggedSerializer",
+        "SERIALIZER_FORMAT": "msgpack",      # msgpack | json | pickle
+        "COMPRESSOR": "core.backends.codecs.TaggedCompressor",
+        "COMPRESSOR_ALGORITHM": "zlib",      # zlib | lz4 | zstd | none
+        "COMPRESS_MIN_LENGTH": 256,
+    }
+"""
+import json
+import pickle
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django_redis.compressors.base import BaseCompressor
+from django_redis.exceptions import CompressorError
+from django_redis.serializers.base import BaseSerializer
+
+_LEGACY_PICKLE = 0x80
+
+_PICKLE = b'\x01'
+_JSON = b'\x02'
+_MSGPACK = b'\x03'
+
+# Compressed payloads use tags the serializer never emits, so anything else
+# is passed through to the serializer uncompressed.
+_ZLIB = b'\xf0'
+_LZ4 = b'\xf1'
+_ZSTD = b'\xf2'
+
+
+def _import(module):
+    try:
+        return __import__(module)
+    except ImportError as exc:
+        raise ImproperlyConfigured(f"The '{module}' package is required by this cache option.") from exc
+
+
+def _string_keys(value):
+    """Whether every dict in ``value`` is keyed by strings, so JSON keeps the keys as they are."""
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and _string_keys(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return all(map(_string_keys, value))
+    return True
+
+
+class TaggedSerializer(BaseSerializer):
+    """
+    Serialize with msgpack or JSON, falling back to pickle per value.
+
+    msgpack runs with ``strict_types`` so tuples, subclasses (``SafeString``,
+    ``OrderedDict``...) and other types it can't round-trip exactly are stored
+    as pickle instead of being silently converted. JSON only checks mapping
+    keys, which it would turn into strings: tuples come back as lists, as
+    with Django's JSON session serializer.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.format = options.get('SERIALIZER_FORMAT', 'msgpack')
+        if self.format == 'msgpack':
+            self._msgpack = _import('msgpack')
+        elif self.format not in ('json', 'pickle'):
+            raise ImproperlyConfigured(f"Unknown SERIALIZER_FORMAT '{self.format}'.")
+
+    def dumps(self, value):
+        try:
+            if self.format == 'msgpack':
+                return _MSGPACK + self._msgpack.packb(value, use_bin_type=True, strict_types=True)
+            if self.format == 'json' and _string_keys(value):
+                return _JSON + json.dumps(value, separators=(',', ':')).encode()
+        except (TypeError, ValueError, OverflowError):
+            pass
+        return _PICKLE + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, value):
+        if value[0] == _LEGACY_PICKLE:
+            return pickle.loads(value)
+        tag, payload = value[:1], value[1:]
+        if tag == _MSGPACK:
+            # Integer keys are packed as-is; msgpack only reads them back
+            # with strict_map_key off.
+            return _import('msgpack').unpackb(payload, raw=False, strict_map_key=False)
+        if tag == _JSON:
+            return json.loads(payload)
+        if tag == _PICKLE:
+            return pickle.loads(payload)
+        raise ValueError(f'Unknown cache serialization tag {tag!r}')
+
+
+class TaggedCompressor(BaseCompressor):
+    """Compress payloads longer than ``COMPRESS_MIN_LENGTH`` bytes."""
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.algorithm = options.get('COMPRESSOR_ALGORITHM', 'zlib')
+        self.min_length = options.get('COMPRESS_MIN_LENGTH', 256)
+        self.level = options.get('COMPRESS_LEVEL')
+        if self.algorithm == 'lz4':
+            _import('lz4')
+        elif self.algorithm == 'zstd':
+            _import('pyzstd')
+        elif self.algorithm not in ('zlib', 'none'):
+            raise ImproperlyConfigured(f"Unknown COMPRESSOR_ALGORITHM '{self.algorithm}'.")
+
+    def compress(self, value):
+        if self.algorithm == 'none' or len(value) < self.min_length:
+            return value
+        if self.algorithm == 'zlib':
+            compressed = _ZLIB + zlib.compress(value, 6 if self.level is None else self.level)
+        elif self.algorithm == 'lz4':
+            from lz4 import frame
+            compressed = _LZ4 + frame.compress(value, compression_level=self.level or 0)
+        else:
+            import pyzstd
+            compressed = _ZSTD + pyzstd.compress(value, self.level or 3)
+        # Incompressible payloads (already compressed images, ...) stay raw.
+        return compressed if len(compressed) < len(value) else value
+
+    def decompress(self, value):
+        tag, payload = value[:1], value[1:]
+        try:
+            if tag == _ZLIB:
+                return zlib.decompress(payload)
+            if tag == _LZ4:
+                from lz4 import frame
+                return frame.decompress(payload)
+            if tag == _ZSTD:
+                import pyzstd
+                return pyzstd.decompress(payload)
+        except Exception as exc:
+            raise CompressorError(exc)
+        # Not compressed (short value or legacy format): django_redis hands
+        # the raw bytes to the serializer.
+        raise CompressorError('value is not compressed')
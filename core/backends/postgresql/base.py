@@ -0,0 +1,130 @@
+"""
+PostgreSQL backend with a bounded, per-process connection pool.
+
+Django keeps one connection per thread and, with ``CONN_MAX_AGE``, reuses it
+between requests. Every time that connection expires or fails a health check
+the next request pays the TCP + TLS + auth handshake with the flexible server
+again. This backend hands closed connections back to a psycopg2 pool instead,
+so they are reused by the next thread that needs one.
+
+Enable it through ``OPTIONS['pool']`` (same shape as Django 5.1's native
+pool option)::
+
+    'OPTIONS': {'pool': {'min_size': 0, 'max_size': 4, 'timeout': 10}}
+"""
+import os
+import threading
+
+import psycopg2
+import psycopg2.extras
+from psycopg2 import pool as psycopg2_pool
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.base import IsolationLevel
+from django.utils.asyncio import async_unsafe
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """ThreadedConnectionPool that blocks (up to ``timeout``) when exhausted."""
+
+    def __init__(self, min_size, max_size, timeout, **conn_params):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._pool = psycopg2_pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(
+                "Timed out after %ss waiting for a pooled connection." % self.timeout
+            )
+        try:
+            return self._pool.getconn()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        try:
+            self._pool.putconn(connection, close=close or bool(connection.closed))
+        finally:
+            self._slots.release()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    pool = None
+
+    @property
+    def pool_options(self):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if options is True:
+            return {}
+        return options or None
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_pool(self, conn_params):
+        # Keyed by pid so gunicorn workers forked after --preload never share
+        # sockets inherited from the master process.
+        key = (os.getpid(), self.alias)
+        with _pools_lock:
+            if key not in _pools:
+                options = self.pool_options
+                _pools[key] = ConnectionPool(
+                    min_size=options.get('min_size', 0),
+                    max_size=options.get('max_size', 4),
+                    timeout=options.get('timeout', 10),
+                    **conn_params,
+                )
+            return _pools[key]
+
+    def _ping(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        if self.pool_options is None:
+            return super().get_new_connection(conn_params)
+
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = IsolationLevel(
+                options.get('isolation_level', IsolationLevel.READ_COMMITTED)
+            )
+        except ValueError:
+            raise ImproperlyConfigured(
+                f"Invalid transaction isolation level {options['isolation_level']} "
+                f"specified. Use one of the psycopg.IsolationLevel values."
+            )
+
+        self.pool = self.get_pool(conn_params)
+        connection = self.pool.getconn()
+        # Connections may sit idle in the pool long enough for the server or
+        # a NAT to drop them; only hand out ones that still answer.
+        while self.settings_dict['CONN_HEALTH_CHECKS'] and not self._ping(connection):
+            self.pool.putconn(connection, close=True)
+            connection = self.pool.getconn()
+
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.putconn(self.connection, close=self.errors_occurred)
@@ -0,0 +1,45 @@
+"""
+Cache-based session store that moves to the database while Redis is down.
+
+Sessions normally live only in the cache (like
+``django.contrib.sessions.backends.cache``). When the cache's circuit breaker
+is open (see ``core.backends.cache.ResilientRedisCache``) they are read from
+and written to the ``django_session`` table instead, so logins and CSRF keep
+working during a Redis failover rather than every request blocking on it.
+"""
+from django.contrib.sessions.backends import cache, db
+
+
+class SessionStore(cache.SessionStore, db.SessionStore):
+    @property
+    def _use_db(self):
+        return getattr(self._cache, 'circuit_open', False)
+
+    def load(self):
+        if self._use_db:
+            return db.SessionStore.load(self)
+        return cache.SessionStore.load(self)
+
+    def exists(self, session_key):
+        if self._use_db:
+            return db.SessionStore.exists(self, session_key)
+        return cache.SessionStore.exists(self, session_key)
+
+    def create(self):
+        if self._use_db:
+            return db.SessionStore.create(self)
+        return cache.SessionStore.create(self)
+
+    def save(self, must_create=False):
+        if self._use_db:
+            return db.SessionStore.save(self, must_create=must_create)
+        return cache.SessionStore.save(self, must_create=must_create)
+
+    def delete(self, session_key=None):
+        if self._use_db:
+            return db.SessionStore.delete(self, session_key)
+        return cache.SessionStore.delete(self, session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        db.SessionStore.clear_expired()
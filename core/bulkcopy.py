@@ -0,0 +1,277 @@
+"""
+Streaming bulk import and export of model rows, for ``import_rows`` and
+``export_rows``.
+
+On PostgreSQL rows move with ``COPY``: CSV straight in and out, JSON Lines
+through ``row_to_json`` out and ``jsonb_populate_record`` in. Elsewhere
+(SQLite in development) they are parsed in Python and inserted with batched
+``bulk_create``. Either way at most one chunk of rows is held in memory, and
+each chunk is committed in its own transaction, so a failure keeps the
+chunks before it and the import can resume with ``--skip``.
+
+CSV files start with a header of column names (``attname``s, e.g.
+``owner_id``); an unquoted empty value is NULL in nullable columns and an
+empty string in the others. In JSON Lines, every line is an object keyed by
+column name; keys missing from a line load as NULL.
+
+``COPY`` bypasses Django's cursors, so imports bump core.querycache's table
+generations and forget remembered ETags themselves.
+"""
+import csv
+import io
+import json
+import time
+from itertools import islice
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.base import CommandError
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections, transaction
+
+from core.middleware import flush_etag_invalidation, invalidate_etags
+from core.querycache import invalidate_tables
+
+CSV, JSONL = 'csv', 'jsonl'
+FORMATS = (CSV, JSONL)
+
+# One text column passed through untouched: neither delimiter nor quote ever
+# appears in JSON, which escapes every control character.
+_RAW_LINES = "FORMAT csv, DELIMITER E'\\x02', QUOTE E'\\x01'"
+
+
+def resolve_model(label):
+    try:
+        return apps.get_model(label)
+    except (LookupError, ValueError):
+        raise CommandError(f"Unknown model '{label}'; use app_label.ModelName.")
+
+
+def resolve_columns(model, names=None):
+    """The model's concrete fields named by ``names`` (all of them by default)."""
+    fields = [field for field in model._meta.concrete_fields]
+    if not names:
+        return fields
+    by_name = {field.attname: field for field in fields}
+    columns = []
+    for name in names:
+        try:
+            field = by_name.get(name) or model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = None
+        if field is None or field not in fields:
+            raise CommandError(f"{model._meta.label} has no column '{name}'; use one of {sorted(by_name)}.")
+        columns.append(field)
+    return columns
+
+
+def csv_records(lines):
+    """Whole CSV records from ``lines``, joining the lines of quoted values that span several."""
+    record = ''
+    for line in lines:
+        record += line
+        # An odd number of quotes so far means a quoted value goes on.
+        if record.count('"') % 2 == 0:
+            yield record
+            record = ''
+    if record:
+        yield record
+
+
+def jsonl_records(lines):
+    return (line for line in lines if line.strip())
+
+
+def chunks(records, size):
+    records = iter(records)
+    while chunk := list(islice(records, size)):
+        yield chunk
+
+
+class Progress:
+    """Rows done and the rate so far, written to ``stream`` at most every ``interval`` seconds."""
+
+    def __init__(self, stream, verb, interval=5.0):
+        self.stream = stream
+        self.verb = verb
+        self.interval = interval
+        self.rows = 0
+        self.start = self.last = time.monotonic()
+
+    @property
+    def rate(self):
+        return self.rows / max(time.monotonic() - self.start, 1e-9)
+
+    def add(self, rows):
+        self.rows += rows
+        now = time.monotonic()
+        if self.stream is not None and now - self.last >= self.interval:
+            self.last = now
+            self.stream.write(f'{self.rows:,} rows {self.verb}, {self.rate:,.0f} rows/s')
+
+
+class _CountingWriter(io.TextIOBase):
+    """Text file wrapper for ``copy_expert``, which writes one row per call."""
+
+    def __init__(self, file, progress):
+        super().__init__()
+        self.file = file
+        self.progress = progress
+
+    def write(self, data):
+        self.progress.add(1)
+        return self.file.write(data)
+
+
+def _quoted(connection, fields):
+    return ', '.join(connection.ops.quote_name(field.column) for field in fields)
+
+
+def import_rows(model, file, fmt, *, fields=None, database='default', chunk_size=100000, skip=0, progress=None):
+    """
+    Load ``file`` into ``model``'s table. ``fields`` applies to JSON Lines;
+    CSV files name their columns in the header. Returns the rows loaded.
+    """
+    connection = connections[database]
+    lines = iter(file)
+    if fmt == CSV:
+        header = next(csv.reader([next(lines, '')]), [])
+        if not header:
+            raise CommandError('The CSV file is empty; it must start with a header of column names.')
+        columns = resolve_columns(model, header)
+        records = csv_records(lines)
+    else:
+        columns = resolve_columns(model, fields)
+        records = jsonl_records(lines)
+    for _ in islice(records, skip):
+        pass
+
+    load = _copy_chunk if connection.vendor == 'postgresql' else _bulk_create_chunk
+    progress = progress or Progress(None, 'imported')
+    first = skip + 1
+    for chunk in chunks(records, chunk_size):
+        try:
+            with transaction.atomic(using=database):
+                load(connection, model, columns, chunk, fmt)
+                transaction.on_commit(lambda: invalidate_tables(model._meta.db_table), using=database)
+        except (DatabaseError, ValidationError, ValueError) as e:
+            resume = f'\nThe rows before them are committed; rerun with --skip {first - 1} to resume.'
+            raise CommandError(
+                f'Rows {first:,} to {first + len(chunk) - 1:,} failed: {e}{resume if first > skip + 1 else ""}'
+            )
+        first += len(chunk)
+        progress.add(len(chunk))
+
+    _reset_sequences(connection, model)
+    invalidate_etags()
+    flush_etag_invalidation()
+    return progress.rows
+
+
+def _copy_chunk(connection, model, columns, chunk, fmt):
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if fmt == CSV:
+            not_null = [field for field in columns if not field.null]
+            force_not_null = f', FORCE_NOT_NULL ({_quoted(connection, not_null)})' if not_null else ''
+            cursor.copy_expert(
+                f'COPY {table} ({_quoted(connection, columns)}) FROM STDIN WITH (FORMAT csv{force_not_null})',
+                io.StringIO(''.join(chunk)),
+            )
+            return
+        cursor.execute('CREATE TEMPORARY TABLE core_bulkcopy_jsonl (data jsonb) ON COMMIT DROP')
+        cursor.copy_expert(
+            f'COPY core_bulkcopy_jsonl (data) FROM STDIN WITH ({_RAW_LINES})',
+            io.StringIO(''.join(line if line.endswith('\n') else line + '\n' for line in chunk)),
+        )
+        selected = ', '.join(f'r.{connection.ops.quote_name(field.column)}' for field in columns)
+        cursor.execute(
+            f'INSERT INTO {table} ({_quoted(connection, columns)}) '
+            f'SELECT {selected} FROM core_bulkcopy_jsonl, jsonb_populate_record(NULL::{table}, data) r'
+        )
+
+
+def _bulk_create_chunk(connection, model, columns, chunk, fmt):
+    if fmt == CSV:
+        rows = (dict(zip(columns, _row_values(values, columns))) for values in csv.reader(chunk))
+        convert = _from_csv
+    else:
+        rows = ({field: data.get(field.attname) for field in columns} for data in map(_json_object, chunk))
+        convert = _from_json
+    objects = [
+        model(**{field.attname: convert(field, value) for field, value in row.items()})
+        for row in rows
+    ]
+    model._base_manager.using(connection.alias).bulk_create(objects, batch_size=1000)
+
+
+def _row_values(values, columns):
+    if len(values) != len(columns):
+        raise ValueError(f'{len(values)} values in a row under a header of {len(columns)} columns: {values!r}')
+    return values
+
+
+def _json_object(line):
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError(f'Expected a JSON object per line, got {line[:100]!r}')
+    return data
+
+
+def _from_csv(field, value):
+    if value == '':
+        return None if field.null else ''
+    return field.to_python(value)
+
+
+def _from_json(field, value):
+    return None if value is None else field.to_python(value)
+
+
+def _reset_sequences(connection, model):
+    # Rows loaded with their ids leave the id sequence behind them.
+    statements = connection.ops.sequence_reset_sql(no_style(), [model])
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def export_rows(model, file, fmt, *, fields=None, database='default', chunk_size=100000, progress=None):
+    """Write ``model``'s rows, in primary key order, to ``file``. Returns the rows written."""
+    connection = connections[database]
+    columns = resolve_columns(model, fields)
+    progress = progress or Progress(None, 'exported')
+    if connection.vendor == 'postgresql':
+        _copy_out(connection, model, columns, file, fmt, progress)
+        return progress.rows
+
+    names = [field.attname for field in columns]
+    rows = model._base_manager.using(database).order_by('pk').values_list(*names).iterator(chunk_size=chunk_size)
+    if fmt == CSV:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(names)
+        for chunk in chunks(rows, chunk_size):
+            writer.writerows(chunk)
+            progress.add(len(chunk))
+    else:
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+        for chunk in chunks(rows, chunk_size):
+            file.writelines(encoder.encode(dict(zip(names, values))) + '\n' for values in chunk)
+            progress.add(len(chunk))
+    return progress.rows
+
+
+def _copy_out(connection, model, columns, file, fmt, progress):
+    table = connection.ops.quote_name(model._meta.db_table)
+    select = f'SELECT {_quoted(connection, columns)} FROM {table} ORDER BY {connection.ops.quote_name(model._meta.pk.column)}'
+    if fmt == CSV:
+        sql = f'COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)'
+    else:
+        sql = f'COPY (SELECT row_to_json(r) FROM ({select}) r) TO STDOUT WITH ({_RAW_LINES})'
+    # One statement, so one snapshot however long it runs.
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, _CountingWriter(file, progress))
+    if fmt == CSV:
+        progress.rows -= 1  # the header
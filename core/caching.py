@@ -0,0 +1,181 @@
+"""
+Per-view and fragment caching with stampede protection.
+
+``get_or_compute`` stores each value with its soft expiry and the time it took
+to compute. Readers recompute a little before expiry with a probability that
+grows as expiry approaches (XFetch, weighted by compute time), and only the
+worker holding the per-key lock recomputes; everybody else gets the stale
+value, or waits briefly for the first one.
+
+All keys carry ``settings.VIEW_CACHE_VERSION`` so a deploy that changes it
+invalidates every cached view and fragment at once, without touching
+sessions or other data in the same cache.
+"""
+import hashlib
+import logging
+import math
+import random
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import has_vary_header
+
+from core.backends.cache import _REDIS_ERRORS, per_process
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'core.caching'
+
+# Delete the lock only if it still holds our token: it may have expired and
+# been taken by another worker since.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def make_key(name, *parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'{KEY_PREFIX}:{settings.VIEW_CACHE_VERSION}:{name}:{digest}'
+
+
+def get_or_compute(key, compute, timeout, *, cache_alias='default', beta=1.0, stale_timeout=None,
+                   lock_timeout=10, wait_timeout=5, should_cache=None):
+    """
+    Return the cached value for ``key``, calling ``compute()`` at most once per
+    expiry across all workers.
+
+    Values stay in the cache for ``stale_timeout`` (default: ``timeout``)
+    seconds past their soft expiry so they can be served while one worker
+    recomputes. ``should_cache(value)`` may veto storing a computed value.
+    """
+    cache = caches[cache_alias]
+    if stale_timeout is None:
+        stale_timeout = timeout
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None:
+        value, expires_at, delta = entry
+        if now - delta * beta * math.log(random.random() or 1e-12) < expires_at:
+            return value
+
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, lock_timeout):
+        if entry is not None:
+            return entry[0]
+        # Nothing to serve yet: wait for the worker holding the lock.
+        deadline = time.monotonic() + wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        # The lock holder is too slow or died; compute without storing over it.
+        return compute()
+
+    try:
+        # Another worker may have refreshed the value between our read and
+        # taking the lock.
+        entry = cache.get(key)
+        if entry is not None and time.time() < entry[1] - entry[2] * beta:
+            return entry[0]
+        start = time.time()
+        value = compute()
+        delta = time.time() - start
+        if should_cache is None or should_cache(value):
+            cache.set(key, (value, time.time() + timeout, delta), timeout + stale_timeout)
+        return value
+    finally:
+        release_lock(cache, lock_key, token)
+
+
+def release_lock(cache, lock_key, token):
+    """Delete ``lock_key`` if it still holds ``token``, atomically on Redis."""
+
+    def release_local(local_cache):
+        if local_cache.get(lock_key) == token:
+            local_cache.delete(lock_key)
+
+    get_client = getattr(getattr(cache, 'client', None), 'get_client', None)
+    if get_client is None:
+        # Not django_redis (e.g. LocMemCache in development).
+        return release_local(cache)
+
+    redis_key = cache.make_key(lock_key)
+
+    def call():
+        client = get_client(write=True)
+        script = per_process(('caching-release-script',), lambda: client.register_script(RELEASE_SCRIPT))
+        if script(keys=[str(redis_key)], args=[cache.client.encode(token)], client=client):
+            # Drop the process-local copies TieredRedisCache may hold.
+            invalidate = getattr(cache, '_invalidate', None)
+            if invalidate is not None:
+                invalidate(redis_key)
+
+    # The cache's circuit breaker, when it has one, skips Redis while it's
+    # down; the lock was then taken in its local fallback.
+    guard = getattr(cache, '_guard', None)
+    try:
+        guard(call, lambda: release_local(cache.fallback)) if guard else call()
+    except _REDIS_ERRORS:
+        logger.warning('Could not release %s; it expires on its own', lock_key, exc_info=True)
+
+
+def cached_fragment(name, compute, timeout, *vary_on, **kwargs):
+    """Cache a rendered fragment (or any value) under ``name`` + ``vary_on``."""
+    return get_or_compute(make_key(f'fragment.{name}', *vary_on), compute, timeout, **kwargs)
+
+
+def _is_cacheable(response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and 'private' not in response.get('Cache-Control', '')
+        and not has_vary_header(response, 'Cookie')
+    )
+
+
+def cache_view(timeout, *, vary_on_user=False, vary_on_headers=(), **kwargs):
+    """
+    Cache GET/HEAD responses of a view with stampede protection.
+
+    Only successful, non-streaming responses that set no cookies, aren't
+    ``Cache-Control: private`` or ``Vary: Cookie`` and didn't use the CSRF
+    token (a form's ``{% csrf_token %}``) are stored.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **view_kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **view_kwargs)
+
+            parts = [request.get_full_path()]
+            if vary_on_user:
+                parts.append(request.user.pk if request.user.is_authenticated else '')
+            parts.extend(request.headers.get(header, '') for header in vary_on_headers)
+
+            def compute():
+                response = view(request, *args, **view_kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response = response.render()
+                return response
+
+            def should_cache(response):
+                # get_token() flags the request; the CSRF middleware only
+                # adds the cookie and Vary: Cookie after this decorator.
+                return _is_cacheable(response) and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+
+            key = make_key(f'view.{view.__module__}.{view.__qualname__}', *parts)
+            return get_or_compute(key, compute, timeout, should_cache=should_cache, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,132 @@
+"""
+Read/write splitting between the primary and the read replicas.
+
+Writes always go to ``default``. Reads go to a random healthy alias from
+``settings.DATABASE_REPLICAS``, except:
+
+* for the rest of a request once it has written anything, so a request never
+  reads its own writes from a replica that hasn't replayed them yet
+  (``PrimaryPinningMiddleware`` scopes this to the request);
+* inside ``transaction.atomic()`` on the primary.
+
+Each process checks a replica at most every
+``DATABASE_REPLICA_HEALTH_CHECK_INTERVAL`` seconds (connectivity and replay
+lag against ``DATABASE_REPLICA_MAX_LAG``); failing replicas are left out of
+rotation until a later check passes. With no healthy replica reads fall
+back to the primary.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+_request_state = ContextVar('core.db_router.request_state', default=None)
+
+# Seconds the replica is behind the primary; 0 when it has replayed all the
+# WAL it received (an idle primary would otherwise look like growing lag).
+LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class ReplicaHealth:
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def is_healthy(self, alias):
+        healthy, checked_at = self._state.get(alias, (True, 0))
+        interval = getattr(settings, 'DATABASE_REPLICA_HEALTH_CHECK_INTERVAL', 10)
+        # One thread re-checks; the others keep using the last result.
+        if time.monotonic() - checked_at < interval or not self._lock.acquire(blocking=False):
+            return healthy
+        try:
+            self._state[alias] = (self.check(alias), time.monotonic())
+        finally:
+            self._lock.release()
+        if self._state[alias][0] != healthy:
+            logger.warning('Database replica %s is %s', alias, 'back in rotation' if not healthy else 'out of rotation')
+        return self._state[alias][0]
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor != 'postgresql':
+                    return True
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0] or 0
+        except DatabaseError:
+            logger.debug('Health check of database replica %s failed', alias, exc_info=True)
+            connection.close()
+            return False
+        return lag <= getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 30)
+
+
+health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    @property
+    def replicas(self):
+        return getattr(settings, 'DATABASE_REPLICAS', [])
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas:
+            return None
+        state = _request_state.get()
+        if (state is not None and state['wrote']) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        healthy = [alias for alias in self.replicas if health.is_healthy(alias)]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in self.replicas else None
+
+
+class PrimaryPinningMiddleware:
+    """Scope ``PrimaryReplicaRouter``'s read-your-writes pinning to one request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # A dict rather than a flag: sync views run in a copy of the context
+        # under ASGI, and must still be able to pin the request.
+        token = _request_state.set({'wrote': False})
+        try:
+            return self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+    async def __acall__(self, request):
+        token = _request_state.set({'wrote': False})
+        try:
+            return await self.get_response(request)
+        finally:
+            _request_state.reset(token)
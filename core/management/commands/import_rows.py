@@ -0,0 +1,47 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.bulkcopy import CSV, FORMATS, Progress, import_rows, resolve_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream rows from a CSV or JSON Lines file into a model's table: COPY on PostgreSQL, batched "
+        "bulk_create elsewhere, one transaction per chunk. Unlike loaddata, memory stays bounded by the chunk."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='app_label.ModelName')
+        parser.add_argument('path', help="File to read, or '-' for stdin.")
+        parser.add_argument('--format', dest='fmt', choices=FORMATS, help='Default: from the file extension, else csv.')
+        parser.add_argument('--fields', help='Comma-separated columns of JSON Lines files (default: all).')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Rows per transaction (default: 100000).')
+        parser.add_argument('--skip', type=int, default=0, help='Rows to skip, e.g. those a failed run committed.')
+
+    def handle(self, *args, model, path, fmt, fields, database, chunk_size, skip, verbosity, **options):
+        model = resolve_model(model)
+        fmt = fmt or (path.rsplit('.', 1)[-1] if path.endswith(FORMATS) else CSV)
+        if fields and fmt == CSV:
+            raise CommandError('CSV files name their columns in the header; --fields is for JSON Lines.')
+        progress = Progress(self.stderr if verbosity else None, 'imported')
+        start = time.monotonic()
+        if path == '-':
+            rows = self.load(model, sys.stdin, fmt, fields, database, chunk_size, skip, progress)
+        else:
+            with open(path, newline='', encoding='utf-8') as file:
+                rows = self.load(model, file, fmt, fields, database, chunk_size, skip, progress)
+        elapsed = time.monotonic() - start
+        self.stderr.write(self.style.SUCCESS(
+            f'Imported {rows:,} rows into {model._meta.db_table} in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s).'
+        ))
+
+    def load(self, model, file, fmt, fields, database, chunk_size, skip, progress):
+        return import_rows(
+            model, file, fmt, fields=fields.split(',') if fields else None, database=database,
+            chunk_size=chunk_size, skip=skip, progress=progress,
+        )
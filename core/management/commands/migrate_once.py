@@ -0,0 +1,103 @@
+import hashlib
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STATE_TABLE = 'core_migration_state'
+LOCK_ID = zlib.crc32(b'core.migrate_once')
+
+
+def migrations_fingerprint():
+    """Hash of every installed app's migration files, without importing them."""
+    digest = hashlib.sha256()
+    for app_config in sorted(apps.get_app_configs(), key=lambda app: app.label):
+        migrations_dir = Path(app_config.path) / 'migrations'
+        for path in sorted(migrations_dir.glob('*.py')):
+            digest.update(f'{app_config.label}/{path.name}\0'.encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run 'migrate' at container start: only one instance at a time (PostgreSQL "
+        "advisory lock) and only if the migration files changed since the last run."
+    )
+    # Checks are the migrate command's job; skipping them here keeps the
+    # unchanged-fingerprint path fast.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--force', action='store_true', help='Migrate even if the fingerprint matches.')
+
+    def handle(self, *args, database, force, verbosity, **options):
+        start = time.monotonic()
+        connection = connections[database]
+        fingerprint = migrations_fingerprint()
+        self.ensure_state_table(connection)
+
+        state = self.read_state(connection)
+        if not force and state and state[0] == fingerprint:
+            return self.report_skip(state, start)
+
+        with self.advisory_lock(connection):
+            # Another instance may have migrated while we waited for the lock.
+            state = self.read_state(connection)
+            if not force and state and state[0] == fingerprint:
+                return self.report_skip(state, start)
+            call_command('migrate', database=database, interactive=False, verbosity=verbosity)
+            duration = time.monotonic() - start
+            self.write_state(connection, fingerprint, duration)
+        self.stdout.write(self.style.SUCCESS(f'Migrated in {duration:.1f}s (fingerprint {fingerprint[:12]}).'))
+
+    def report_skip(self, state, start):
+        elapsed = time.monotonic() - start
+        self.stdout.write(
+            f'Migrations unchanged (fingerprint {state[0][:12]}), skipped in {elapsed:.2f}s; '
+            f'saved ~{max(state[1] - elapsed, 0):.1f}s of startup.'
+        )
+
+    @contextmanager
+    def advisory_lock(self, connection):
+        if connection.vendor != 'postgresql':
+            yield
+            return
+        # Session-level lock: startup.sh runs this against the server port,
+        # not PgBouncer, so the session outlives each migration transaction.
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [LOCK_ID])
+            if not cursor.fetchone()[0]:
+                self.stdout.write('Another instance is migrating, waiting for it...')
+                cursor.execute('SELECT pg_advisory_lock(%s)', [LOCK_ID])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [LOCK_ID])
+
+    def ensure_state_table(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {STATE_TABLE} ('
+                'id integer PRIMARY KEY, fingerprint varchar(64) NOT NULL, duration double precision NOT NULL)'
+            )
+
+    def read_state(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT fingerprint, duration FROM {STATE_TABLE} WHERE id = 1')
+            return cursor.fetchone()
+
+    def write_state(self, connection, fingerprint, duration):
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {STATE_TABLE} SET fingerprint = %s, duration = %s WHERE id = 1', [fingerprint, duration])
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    f'INSERT INTO {STATE_TABLE} (id, fingerprint, duration) VALUES (1, %s, %s)', [fingerprint, duration]
+                )
@@ -0,0 +1,217 @@
+import json
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+RANKINGS = {
+    'total_time': 'total_time_ms',
+    'mean_time': 'mean_time_ms',
+    'calls': 'calls',
+    'rows': 'rows',
+}
+# Django quotes every table it touches: FROM "app_model", JOIN "app_model" ...
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+"(?P<table>[^"]+)"', re.IGNORECASE)
+# ... and qualifies every column in filters: "app_model"."column" = $1
+PREDICATE_RE = re.compile(
+    r'"(?P<table>[^"]+)"\."(?P<column>[^"]+)"\s*(?:=|<|>|<=|>=|IN\b|LIKE\b|ILIKE\b|IS\b|BETWEEN\b)',
+    re.IGNORECASE,
+)
+# Call sites appended by core.querybudget.comment_call_site (QUERY_COMMENTS),
+# e.g. /* shop/views.py:42 in detail */. pg_stat_statements keeps the text
+# of the first execution of each normalized statement, so its first call site.
+COMMENT_RE = re.compile(r'/\*\s*(?P<comment>.*?)\s*\*/', re.DOTALL)
+
+
+def statements_sql(server_version):
+    # PostgreSQL 13 renamed total_time/mean_time to *_exec_time.
+    suffix = '_exec_time' if server_version >= 130000 else '_time'
+    return (
+        f'SELECT queryid, query, calls, total{suffix}, mean{suffix}, rows, shared_blks_hit, shared_blks_read '
+        'FROM pg_stat_statements '
+        'WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) AND calls >= %s'
+    )
+
+
+TABLE_STATS_SQL = (
+    'SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), n_live_tup '
+    'FROM pg_stat_user_tables WHERE schemaname = current_schema()'
+)
+# Leading column of every index, per table.
+INDEXED_COLUMNS_SQL = (
+    'SELECT t.relname, a.attname FROM pg_index i '
+    'JOIN pg_class t ON t.oid = i.indrelid '
+    'JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = i.indkey[0] '
+    'WHERE t.relnamespace = current_schema()::regnamespace'
+)
+
+
+def model_tables():
+    return {model._meta.db_table: model._meta.label for model in apps.get_models(include_auto_created=True)}
+
+
+def describe_statement(row, models):
+    queryid, query, calls, total_time, mean_time, rows, blks_hit, blks_read = row
+    tables = sorted(set(TABLE_RE.findall(query)))
+    comments = COMMENT_RE.findall(query)
+    return {
+        'queryid': str(queryid),
+        'query': query,
+        'calls': calls,
+        'total_time_ms': round(total_time, 3),
+        'mean_time_ms': round(mean_time, 3),
+        'rows': rows,
+        'rows_per_call': round(rows / calls, 2) if calls else 0,
+        'cache_hit_ratio': round(blks_hit / (blks_hit + blks_read), 4) if blks_hit + blks_read else None,
+        'tables': tables,
+        'models': [models[table] for table in tables if table in models],
+        'call_site': comments[0] if comments else None,
+    }
+
+
+def rank(statements, limit):
+    """Top ``limit`` queryids for every ranking, plus the statements they cover."""
+    rankings = {
+        name: [s['queryid'] for s in sorted(statements, key=lambda s: s[field], reverse=True)[:limit]]
+        for name, field in RANKINGS.items()
+    }
+    selected = {queryid for queryids in rankings.values() for queryid in queryids}
+    return rankings, [s for s in statements if s['queryid'] in selected]
+
+
+def missing_indexes(table_stats, indexed_columns, statements, models, min_rows):
+    """
+    Tables read mostly by sequential scans despite being large, with the
+    filtered columns of the statements touching them that lead no index.
+    """
+    predicates = defaultdict(lambda: defaultdict(set))
+    for statement in statements:
+        for table, column in PREDICATE_RE.findall(statement['query']):
+            predicates[table][column].add(statement['queryid'])
+
+    suspects = []
+    for table, seq_scan, seq_tup_read, idx_scan, live_rows in table_stats:
+        if live_rows < min_rows or seq_scan <= idx_scan:
+            continue
+        candidates = {
+            column: sorted(queryids)
+            for column, queryids in predicates[table].items()
+            if column not in indexed_columns.get(table, ())
+        }
+        suspects.append({
+            'table': table,
+            'model': models.get(table),
+            'seq_scan': seq_scan,
+            'seq_tup_read': seq_tup_read,
+            'avg_rows_per_seq_scan': seq_tup_read // seq_scan if seq_scan else 0,
+            'idx_scan': idx_scan,
+            'live_rows': live_rows,
+            'candidate_columns': candidates,
+        })
+    return sorted(suspects, key=lambda suspect: suspect['seq_tup_read'], reverse=True)
+
+
+class Command(BaseCommand):
+    help = (
+        'Rank the normalized queries in pg_stat_statements by total time, mean time, calls '
+        'and rows, map them to Django models and flag tables that look like they miss an index.'
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--limit', type=int, default=20, help='Queries kept per ranking (default: 20).')
+        parser.add_argument('--min-calls', type=int, default=1)
+        parser.add_argument(
+            '--min-table-rows', type=int, default=10000,
+            help='Smaller tables are never flagged for missing indexes (default: 10000).',
+        )
+        parser.add_argument('--format', dest='output_format', choices=['text', 'json'], default='text')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout.')
+        parser.add_argument('--reset', action='store_true', help='Reset pg_stat_statements after reporting.')
+
+    def handle(self, *args, database, limit, min_calls, min_table_rows, output_format, output, reset, **options):
+        connection = connections[database]
+        if connection.vendor != 'postgresql':
+            raise CommandError(f"Database '{database}' is {connection.vendor}; pg_stat_statements needs PostgreSQL.")
+
+        report = self.build_report(connection, limit, min_calls, min_table_rows)
+        rendered = json.dumps(report, indent=2) if output_format == 'json' else self.render_text(report)
+        if output:
+            with open(output, 'w') as f:
+                f.write(rendered + '\n')
+        else:
+            self.stdout.write(rendered)
+
+        if reset:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_stat_statements_reset()')
+
+    def build_report(self, connection, limit, min_calls, min_table_rows):
+        models = model_tables()
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_stat_statements')
+                cursor.execute(statements_sql(connection.pg_version), [min_calls])
+            except DatabaseError as e:
+                raise CommandError(
+                    f'Cannot read pg_stat_statements ({e}). It must be in shared_preload_libraries '
+                    '(and azure.extensions on Azure) and the user allowed to create the extension.'
+                )
+            statements = [describe_statement(row, models) for row in cursor.fetchall()]
+            cursor.execute(TABLE_STATS_SQL)
+            table_stats = cursor.fetchall()
+            cursor.execute(INDEXED_COLUMNS_SQL)
+            indexed_columns = defaultdict(set)
+            for table, column in cursor.fetchall():
+                indexed_columns[table].add(column)
+
+        total_time = sum(statement['total_time_ms'] for statement in statements)
+        for statement in statements:
+            statement['share_of_total_time'] = round(statement['total_time_ms'] / total_time, 4) if total_time else 0
+        rankings, selected = rank(statements, limit)
+        return {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'database': connection.settings_dict['NAME'],
+            'server_version': connection.pg_version,
+            'totals': {
+                'statements': len(statements),
+                'calls': sum(statement['calls'] for statement in statements),
+                'total_time_ms': round(total_time, 3),
+            },
+            'rankings': rankings,
+            'statements': sorted(selected, key=lambda s: s['total_time_ms'], reverse=True),
+            'missing_indexes': missing_indexes(table_stats, indexed_columns, statements, models, min_table_rows),
+        }
+
+    def render_text(self, report):
+        statements = {statement['queryid']: statement for statement in report['statements']}
+        totals = report['totals']
+        lines = [
+            f"{totals['statements']} statements, {totals['calls']} calls, "
+            f"{totals['total_time_ms'] / 1000:.1f}s total in {report['database']}",
+        ]
+        for name, queryids in report['rankings'].items():
+            lines += ['', f'Top by {name.replace("_", " ")}:', f'{"total ms":>12} {"mean ms":>10} {"calls":>9} {"rows":>10}  query']
+            for queryid in queryids:
+                s = statements[queryid]
+                where = ', '.join(s['models']) or ', '.join(s['tables'])
+                query = ' '.join(s['query'].split())[:100]
+                lines.append(
+                    f"{s['total_time_ms']:>12.1f} {s['mean_time_ms']:>10.2f} {s['calls']:>9} {s['rows']:>10}  "
+                    f"{query}" + (f'  [{where}]' if where else '')
+                )
+        if report['missing_indexes']:
+            lines += ['', 'Tables read mostly by sequential scans:']
+            for suspect in report['missing_indexes']:
+                lines.append(
+                    f"  {suspect['model'] or suspect['table']}: {suspect['seq_scan']} seq scans "
+                    f"(~{suspect['avg_rows_per_seq_scan']} rows each) vs {suspect['idx_scan']} index scans, "
+                    f"{suspect['live_rows']} rows"
+                )
+                for column, queryids in suspect['candidate_columns'].items():
+                    lines.append(f"    filtered on unindexed {column!r} by {len(queryids)} statement(s)")
+        return '\n'.join(lines)
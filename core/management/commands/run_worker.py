@@ -0,0 +1,71 @@
+import json
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from core.taskqueue import Worker, queue_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background tasks from the Redis task queue (core.taskqueue). Queues are "
+        "consumed in the order given, so list the most urgent first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queues', default=os.getenv('TASK_WORKER_QUEUES') or queue_settings()['DEFAULT_QUEUE'],
+            help='Comma-separated queues, highest priority first (default: TASK_WORKER_QUEUES or "default").',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=int(os.getenv('TASK_WORKER_CONCURRENCY', '4')),
+            help='Jobs run at once, one thread each (default: TASK_WORKER_CONCURRENCY or 4).',
+        )
+        parser.add_argument(
+            '--http-port', type=int, default=int(os.getenv('PORT', '0')) or None,
+            help='Serve queue depths and worker counters as JSON on this port (default: PORT). '
+                 'App Service restarts containers that never answer HTTP.',
+        )
+
+    def handle(self, *args, queues, concurrency, http_port, **options):
+        # Tasks live in each app's tasks.py; importing them registers them.
+        autodiscover_modules('tasks')
+        worker = Worker([queue.strip() for queue in queues.split(',') if queue.strip()], concurrency)
+
+        def shutdown(signum, frame):
+            self.stdout.write('Finishing running jobs before exiting...')
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        if http_port:
+            server = ThreadingHTTPServer(('0.0.0.0', http_port), health_handler(worker))
+            threading.Thread(target=server.serve_forever, name='task-worker-http', daemon=True).start()
+
+        self.stdout.write(f'Consuming {", ".join(worker.queues)} with {concurrency} threads.')
+        worker.run()
+        self.stdout.write(self.style.SUCCESS(f'Stopped: {json.dumps(worker.stats)}'))
+
+
+def health_handler(worker):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                body, status = json.dumps(worker.health()).encode(), 200
+            except Exception as e:
+                body, status = json.dumps({'error': e.__class__.__name__}).encode(), 503
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,280 @@
+"""
+Response compression and conditional GET for dynamic responses.
+
+``CompressionMiddleware`` negotiates brotli or gzip for responses whose
+content type is in ``COMPRESS_CONTENT_TYPES`` and that are at least
+``COMPRESS_MIN_SIZE`` bytes, streaming responses included. Strong ETags stay
+strong: each encoding gets its own (``"<hash>-br"``, ``"<hash>-gz"``).
+
+``ETagMiddleware`` gives every cacheable GET/HEAD response a strong ETag
+(a hash of the body) and remembers it in the cache, keyed like Django's
+cache middleware on the URL and the response's ``Vary`` headers. A request
+whose ``If-None-Match`` matches the remembered ETag gets a 304 without the
+view running at all. Remembered ETags expire after ``ETAG_CACHE_TIMEOUT``
+seconds and are all dropped after a model is saved or deleted (see
+``core.apps``): the write marks them stale in its process, and the next ETag
+lookup or the end of the request, task or command drops them for every
+process, so a 304 is never based on data older than the last finished ORM
+write, and writing never needs Redis. ``QuerySet.update()`` and raw SQL don't
+send signals; pages that depend on them are bounded by the timeout only.
+Pages built from anything else (Redis, the clock) opt out with
+``@etag_exempt``: they still get an ETag, but the view always runs. Responses
+marked ``Cache-Control: no-cache``, ``private`` or ``no-store`` are never
+remembered either.
+"""
+import hashlib
+import re
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponseNotModified
+from django.utils.cache import get_cache_key, learn_cache_key, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import parse_etags
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ETAG_GENERATION_KEY = 'core.etag.generation'
+ENCODING_SUFFIXES = {'br': '-br', 'gzip': '-gz'}
+_SUFFIX_RE = re.compile(r'-(?:br|gz)"$')
+
+
+def strip_encoding(etag):
+    """``"abc-br"`` -> ``"abc"``: the ETag of the uncompressed representation."""
+    return _SUFFIX_RE.sub('"', etag)
+
+
+def accepted_encodings(header):
+    """Encodings from an Accept-Encoding header with their q-values."""
+    encodings = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        match = re.search(r'q\s*=\s*([0-9.]+)', params)
+        if match:
+            try:
+                q = float(match[1])
+            except ValueError:
+                continue
+        if name:
+            encodings[name.strip().lower()] = q
+    return encodings
+
+
+def choose_encoding(header):
+    encodings = accepted_encodings(header)
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    wildcard = encodings.get('*', 0)
+    scored = [(encodings.get(name, wildcard), -rank, name) for rank, name in enumerate(candidates)]
+    q, _, name = max(scored)
+    return name if q > 0 else None
+
+
+class Compressor:
+    def __init__(self, encoding):
+        self.brotli = encoding == 'br'
+        if self.brotli:
+            self._compressor = brotli.Compressor(quality=getattr(settings, 'COMPRESS_BROTLI_QUALITY', 4))
+        else:
+            # wbits=31: deflate stream with a gzip header and trailer
+            self._compressor = zlib.compressobj(getattr(settings, 'COMPRESS_GZIP_LEVEL', 6), zlib.DEFLATED, 31)
+
+        self._pending = 0
+
+    def compress(self, data):
+        """
+        Compress ``data``, flushing once ``COMPRESS_STREAM_FLUSH_SIZE`` bytes
+        went in since the last flush: streamed output reaches the client in
+        bounded steps without a flush (and a worse ratio) for every tiny chunk.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        out = self._compressor.process(data) if self.brotli else self._compressor.compress(data)
+        self._pending += len(data)
+        if self._pending >= getattr(settings, 'COMPRESS_STREAM_FLUSH_SIZE', 16384):
+            self._pending = 0
+            out += self._compressor.flush() if self.brotli else self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return out
+
+    def finish(self):
+        return self._compressor.finish() if self.brotli else self._compressor.flush()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code in (204, 304):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in getattr(settings, 'COMPRESS_CONTENT_TYPES', ()):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'COMPRESS_MIN_SIZE', 500):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async(response.streaming_content, encoding)
+            else:
+                response.streaming_content = self.compress_stream(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            compressor = Compressor(encoding)
+            compressed = compressor.compress(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response.headers['ETag'] = etag[:-1] + ENCODING_SUFFIXES[encoding] + '"'
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compress_stream(chunks, encoding):
+        compressor = Compressor(encoding)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    async def compress_async(chunks, encoding):
+        compressor = Compressor(encoding)
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+def etag_exempt(view):
+    """Always run this view: its content doesn't come (only) from the ORM."""
+    view.etag_exempt = True
+    return view
+
+
+class _SetIfChanged:
+    """The cache, minus the writes of values it already holds."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def set(self, key, value, timeout):
+        # Every set is a Redis write and an invalidation message to the
+        # other processes' local tier.
+        if self.cache.get(key) != value:
+            self.cache.set(key, value, timeout)
+
+
+class ETagMiddleware(MiddlewareMixin):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.cache = caches[getattr(settings, 'ETAG_CACHE_ALIAS', 'default')]
+        self.timeout = getattr(settings, 'ETAG_CACHE_TIMEOUT', 300)
+
+    def key_prefix(self):
+        flush_etag_invalidation()
+        generation = self.cache.get(ETAG_GENERATION_KEY, 0)
+        return f'core.etag.{settings.VIEW_CACHE_VERSION}.{generation}'
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'etag_exempt', False):
+            request.etag_exempt = True
+            return None
+        if request.method not in ('GET', 'HEAD') or 'If-None-Match' not in request.headers:
+            return None
+        key = get_cache_key(request, self.key_prefix(), 'GET', cache=self.cache)
+        etag = key and self.cache.get(key)
+        matched = etag and self.matching_etag(request, etag)
+        if matched:
+            response = HttpResponseNotModified()
+            response.headers['ETag'] = matched
+            return response
+        return None
+
+    def process_response(self, request, response):
+        if (
+            request.method not in ('GET', 'HEAD')
+            or response.status_code != 200
+            or response.streaming
+            or 'no-store' in response.get('Cache-Control', '')
+        ):
+            return response
+        if not response.has_header('ETag'):
+            response.headers['ETag'] = f'"{hashlib.blake2b(response.content, digest_size=16).hexdigest()}"'
+        etag = response['ETag']
+        cache_control = response.get('Cache-Control', '')
+        # Responses that set cookies must reach the client in full.
+        if (
+            not response.cookies
+            and not etag.startswith('W/')
+            and not getattr(request, 'etag_exempt', False)
+            and 'no-cache' not in cache_control
+            and 'private' not in cache_control
+        ):
+            cache = _SetIfChanged(self.cache)
+            key = learn_cache_key(request, response, self.timeout, self.key_prefix(), cache=cache)
+            cache.set(key, etag, self.timeout)
+        matched = self.matching_etag(request, etag)
+        if matched:
+            not_modified = HttpResponseNotModified()
+            for header in ('Cache-Control', 'Vary', 'Expires', 'Last-Modified'):
+                if response.has_header(header):
+                    not_modified.headers[header] = response[header]
+            not_modified.headers['ETag'] = matched
+            not_modified.cookies = response.cookies
+            return not_modified
+        return response
+
+    @staticmethod
+    def matching_etag(request, etag):
+        """
+        The ETag from If-None-Match that matches ``etag`` in any encoding, so
+        the 304 names the representation the client already has.
+        """
+        for requested in parse_etags(request.headers.get('If-None-Match', '')):
+            if requested == '*':
+                return etag
+            if strip_encoding(requested) == strip_encoding(etag):
+                return requested
+        return None
+
+
+_etags_stale = False
+
+
+def invalidate_etags(**kwargs):
+    """
+    Signal receiver: forget every remembered ETag after an ORM write. Only
+    marks them stale; ``flush_etag_invalidation()`` bumps the generation.
+    """
+    global _etags_stale
+    _etags_stale = True
+
+
+def flush_etag_invalidation(**kwargs):
+    """Bump the ETag generation if this process wrote since the last bump; also a signal receiver."""
+    global _etags_stale
+    if not _etags_stale:
+        return
+    # Cleared first: a write during the bump marks them stale again.
+    _etags_stale = False
+    try:
+        caches[getattr(settings, 'ETAG_CACHE_ALIAS', 'default')].set(ETAG_GENERATION_KEY, time.time_ns(), None)
+    except ImproperlyConfigured:
+        # No REDIS_URL (e.g. migrate on the local SQLite fallback): no ETag
+        # was remembered either.
+        pass
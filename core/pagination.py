@@ -0,0 +1,265 @@
+"""
+Pagination for large tables: approximate counts and keyset (seek) pages.
+
+``approximate_count(queryset)`` avoids ``SELECT COUNT(*)`` over big tables:
+
+* an unfiltered queryset on a table the planner believes holds more than
+  ``PAGINATION['ESTIMATE_THRESHOLD']`` rows gets PostgreSQL's estimate
+  (``pg_class.reltuples``, refreshed by autovacuum's ANALYZE);
+* a filtered queryset is counted exactly up to
+  ``PAGINATION['EXACT_COUNT_LIMIT']`` rows, which reads at most that many;
+  past it, PostgreSQL's estimate for the query plan is used;
+* without estimates (another database, a table never analyzed) the exact
+  count is cached for ``PAGINATION['COUNT_CACHE_TIMEOUT']`` seconds.
+
+``ApproximatePaginator`` uses it and fetches pages starting
+``PAGINATION['KEYSET_OFFSET']`` rows or more in by seeking: it reads only the
+ordering columns of the row before the page (an index scan for the admin's
+``-pk``) and then ``WHERE (ordering) > (that row)`` instead of an OFFSET
+over whole rows and their joins. ``ApproximateCountAdminMixin`` puts it on a
+ModelAdmin::
+
+    @admin.register(Event)
+    class EventAdmin(ApproximateCountAdminMixin, admin.ModelAdmin):
+        ...
+
+``KeysetPaginator`` is pure keyset pagination for views and APIs: pages are
+addressed by an opaque cursor (``?after=...``) and cost the same however
+deep they are.
+"""
+import base64
+import json
+import logging
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from core.caching import get_or_compute, make_key
+
+logger = logging.getLogger(__name__)
+
+RELTUPLES_SQL = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+
+
+def pagination_settings():
+    return {
+        'ESTIMATE_THRESHOLD': 100000,
+        'EXACT_COUNT_LIMIT': 10000,
+        'COUNT_CACHE_TIMEOUT': 300,
+        'KEYSET_OFFSET': 10000,
+        **getattr(settings, 'PAGINATION', {}),
+    }
+
+
+def _is_unfiltered(queryset):
+    query = queryset.query
+    return not query.where and not query.distinct and not query.combinator and not query.is_sliced
+
+
+def table_estimate(queryset):
+    """PostgreSQL's estimate of the rows in the queryset's table, or None."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(RELTUPLES_SQL, [connection.ops.quote_name(queryset.model._meta.db_table)])
+        row = cursor.fetchone()
+    # -1 (PostgreSQL 14+) or 0 until the table is first analyzed.
+    return row[0] if row and row[0] > 0 else None
+
+
+def plan_estimate(queryset):
+    """PostgreSQL's estimate of the rows the queryset returns, or None."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    try:
+        plan = json.loads(queryset.explain(format='json'))
+    except (DatabaseError, ValueError):
+        logger.debug('Could not estimate the row count of %s', queryset.query, exc_info=True)
+        return None
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def cached_count(queryset, timeout, more_than=0):
+    """``queryset.count()``, cached for ``timeout`` seconds when it is over ``more_than``."""
+    sql, params = queryset.query.sql_with_params()
+    return get_or_compute(
+        make_key('count', queryset.db, sql, params), queryset.count, timeout,
+        should_cache=lambda count: count > more_than,
+    )
+
+
+def approximate_count(queryset):
+    """``(count, exact)`` for ``queryset``; see the module docstring for when it estimates."""
+    options = pagination_settings()
+    threshold, limit = options['ESTIMATE_THRESHOLD'], options['EXACT_COUNT_LIMIT']
+    if _is_unfiltered(queryset):
+        estimate = table_estimate(queryset)
+        if estimate is not None and estimate > threshold:
+            return estimate, False
+        if estimate is not None:
+            return queryset.count(), True
+        count = cached_count(queryset, options['COUNT_CACHE_TIMEOUT'], more_than=threshold)
+        return count, count <= threshold
+
+    # Reads at most limit + 1 rows.
+    bounded = queryset.order_by()[:limit + 1].count()
+    if bounded <= limit:
+        return bounded, True
+    estimate = plan_estimate(queryset)
+    if estimate is not None:
+        return max(estimate, bounded), False
+    return cached_count(queryset, options['COUNT_CACHE_TIMEOUT']), False
+
+
+def seek_ordering(queryset):
+    """
+    ``[(field name, descending), ...]`` if the queryset's ordering allows
+    seeking: plain non-null columns of its own model, ending in a unique one.
+    None otherwise.
+    """
+    opts = queryset.model._meta
+    ordering = queryset.query.order_by or opts.ordering
+    if not ordering or not all(isinstance(name, str) for name in ordering):
+        return None
+    fields = {}
+    for name in ordering:
+        descending = name.startswith('-')
+        name = name.lstrip('-+')
+        if '__' in name or name == '?':
+            return None
+        try:
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not getattr(field, 'concrete', False) or field.null:
+            return None
+        # A column ordered by twice (the admin may add it) sorts by the first.
+        fields.setdefault(field, descending)
+    if not list(fields)[-1].unique:
+        return None
+    return [(field.attname, descending) for field, descending in fields.items()]
+
+
+def after(ordering, values):
+    """The rows strictly after ``values`` in ``ordering``, as a Q."""
+    condition = Q()
+    for index, (name, descending) in enumerate(ordering):
+        step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[index]})
+        for (previous, _), value in zip(ordering[:index], values):
+            step &= Q(**{previous: value})
+        condition |= step
+    if len(ordering) == 1:
+        return condition
+    # Redundant, but a range on the first column the planner can use an index for.
+    name, descending = ordering[0]
+    return Q(**{f'{name}__{"lte" if descending else "gte"}': values[0]}) & condition
+
+
+class ApproximatePaginator(Paginator):
+    """Paginator with ``approximate_count`` and seeking for deep pages; ``count_is_exact`` tells which."""
+
+    @cached_property
+    def _counted(self):
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list), True
+        return approximate_count(self.object_list)
+
+    @cached_property
+    def count(self):
+        return self._counted[0]
+
+    @property
+    def count_is_exact(self):
+        return self._counted[1]
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        # An estimated count may be low: never cut the last page short.
+        if self.count_is_exact and top + self.orphans >= self.count:
+            top = self.count
+        ordering = seek_ordering(self.object_list) if hasattr(self.object_list, 'query') else None
+        if ordering is None or bottom < pagination_settings()['KEYSET_OFFSET']:
+            return self._get_page(self.object_list[bottom:top], number, self)
+
+        names = [name for name, _ in ordering]
+        boundary = self.object_list.values_list(*names)[bottom - 1:bottom].first()
+        if boundary is None:
+            return self._get_page(self.object_list.none(), number, self)
+        return self._get_page(self.object_list.filter(after(ordering, boundary))[:top - bottom], number, self)
+
+
+class ApproximateCountAdminMixin:
+    """ModelAdmin mixin for large tables: approximate counts, seeking for deep pages, no full count."""
+
+    paginator = ApproximatePaginator
+    # The "(N total)" next to filtered counts is a COUNT(*) of the whole table.
+    show_full_result_count = False
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Forward keyset pagination over an ordered queryset whose ordering ends in
+    a unique column::
+
+        page = KeysetPaginator(Event.objects.order_by('-created', 'pk'), 50).page(request.GET.get('after'))
+        # page.object_list, page.has_next, page.next_cursor
+
+    Raises ``InvalidPage`` for a cursor it didn't produce.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = seek_ordering(queryset)
+        if self.ordering is None:
+            raise ValueError(
+                'KeysetPaginator needs an ordering of non-null columns of the model ending in a unique one, '
+                f'e.g. order_by("-created", "pk"); got {queryset.query.order_by or queryset.model._meta.ordering}.'
+            )
+
+    def page(self, cursor=None):
+        queryset = self.queryset
+        if cursor:
+            queryset = queryset.filter(after(self.ordering, self.decode(cursor)))
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode([getattr(rows[-1], name) for name, _ in self.ordering])
+        return KeysetPage(rows, next_cursor)
+
+    def encode(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except ValueError:
+            raise InvalidPage('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise InvalidPage('Invalid cursor')
+        return values
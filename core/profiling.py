@@ -0,0 +1,325 @@
+"""
+Sampling profiler for requests, keeping recent profiles in Redis.
+
+``ProfilerMiddleware`` profiles:
+
+* ``PROFILER['SAMPLE_RATE']`` of requests, picked at random;
+* every request still running ``PROFILER['SLOW_THRESHOLD_MS']`` after it
+  started, from that moment on: the profile shows where the rest of the time
+  went;
+* requests with an ``X-Profile`` header, if its value is
+  ``PROFILER['TRIGGER_TOKEN']`` or the user is staff.
+
+One thread per process takes the stack of each profiled request's thread
+every ``PROFILER['INTERVAL_MS']`` with ``sys._current_frames()``, so nothing
+runs in the request thread itself. It only wakes up for requests being
+profiled and, otherwise, when the oldest running request reaches the slow
+threshold; requests that aren't profiled pay for a dict entry and a couple
+of counters. Under ``SERVER_MODE=asgi`` only the sync parts of a request
+are sampled, and streamed response bodies are never part of a profile.
+
+Each profile holds folded stacks (``frame;frame;frame count`` lines, what
+flamegraph.pl and speedscope read), the request's duration, status, SQL
+query count and time, and Redis calls. The last ``PROFILER['MAX_PROFILES']``
+are kept in Redis and listed in the admin at ``/admin/profiles/``.
+"""
+import functools
+import hmac
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.backends.cache import _REDIS_ERRORS, call_counter, per_process
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'profiler:index'
+BODIES_KEY = 'profiler:bodies'
+TRIGGER_HEADER = 'X-Profile'
+
+SAMPLED, SLOW, TRIGGERED = 'sampled', 'slow', 'triggered'
+
+current_profile = ContextVar('core.profiling.current_profile', default=None)
+
+# Push a profile and drop the ones past the newest ARGV[4]. Index entries
+# are the profile id (32 hex characters) followed by its summary JSON.
+# KEYS: index list, bodies hash. ARGV: id, index entry, body, max profiles
+STORE_SCRIPT = """
+redis.call('LPUSH', KEYS[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+local evicted = redis.call('LRANGE', KEYS[1], ARGV[4], -1)
+if #evicted > 0 then
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[4]) - 1)
+    for _, entry in ipairs(evicted) do
+        redis.call('HDEL', KEYS[2], string.sub(entry, 1, 32))
+    end
+end
+return #evicted
+"""
+
+
+def profiler_settings():
+    return {
+        'ENABLED': True,
+        'SAMPLE_RATE': 0.001,
+        'SLOW_THRESHOLD_MS': 1000,
+        'INTERVAL_MS': 5,
+        'TRIGGER_TOKEN': None,
+        'MAX_PROFILES': 200,
+        'MAX_STACK_DEPTH': 100,
+        'CACHE_ALIAS': 'default',
+        **getattr(settings, 'PROFILER', {}),
+    }
+
+
+class RequestProfile:
+    def __init__(self, thread_id, reason, slow_after):
+        self.thread_id = thread_id
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.deadline = self.started + slow_after
+        self.stacks = {}
+        self.samples = 0
+        self.finished = False
+        # 'sql', 'sql_ms' (from CoreConfig's execute wrapper), 'cache'
+        self.counters = Counter()
+
+    def record(self, frame, stop_code, max_depth):
+        stack = []
+        while frame is not None and frame.f_code is not stop_code and len(stack) < max_depth:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        key = tuple(stack)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def folded(self):
+        lines = []
+        # dict() copies atomically; the sampler may still be adding to it.
+        for stack, count in sorted(dict(self.stacks).items(), key=lambda item: -item[1]):
+            lines.append(f"{';'.join(frame_name(code) for code in reversed(stack))} {count}")
+        return '\n'.join(lines)
+
+
+@functools.lru_cache(maxsize=4096)
+def frame_name(code):
+    path = Path(code.co_filename)
+    parts = path.parts
+    # site-packages/django/db/models/query.py -> django/db/models/query.py
+    if 'site-packages' in parts:
+        path = Path(*parts[parts.index('site-packages') + 1:])
+    elif path.is_relative_to(settings.BASE_DIR):
+        path = path.relative_to(settings.BASE_DIR)
+    # co_qualname is new in Python 3.11; App Service runs 3.10.
+    return f"{path}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """One thread per process sampling the stacks of profiled requests."""
+
+    def __init__(self, interval, max_depth, stop_code):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stop_code = stop_code
+        self.active = {}
+        self.idle = True
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def add(self, profile):
+        self.active[profile.thread_id] = profile
+        if self.idle or profile.reason:
+            self.wake()
+
+    def remove(self, profile):
+        profile.finished = True
+        self.active.pop(profile.thread_id, None)
+
+    def wake(self):
+        self.idle = False
+        self._wake.set()
+
+    def run(self):
+        timeout = None
+        while True:
+            self._wake.wait(timeout)
+            self._wake.clear()
+            timeout = self.sample(time.perf_counter())
+            if timeout is None:
+                self.idle = True
+                # A request may have arrived after sample() looked.
+                if self.active:
+                    timeout = 0
+
+    def sample(self, now):
+        """Sample who needs it; returns how long to sleep (None: until woken)."""
+        profiles = list(self.active.values())
+        due = [profile for profile in profiles if profile.reason or now >= profile.deadline]
+        if due:
+            frames = sys._current_frames()
+            for profile in due:
+                frame = frames.get(profile.thread_id)
+                if frame is None or profile.finished:
+                    continue
+                if not profile.reason:
+                    profile.reason = SLOW
+                profile.record(frame, self.stop_code, self.max_depth)
+            return self.interval
+        if profiles:
+            return max(0, min(profile.deadline for profile in profiles) - now)
+        return None
+
+
+def get_sampler(options):
+    return per_process(
+        ('profiler', options['INTERVAL_MS'], options['MAX_STACK_DEPTH']),
+        lambda: StackSampler(
+            options['INTERVAL_MS'] / 1000, options['MAX_STACK_DEPTH'], ProfilerMiddleware.__call__.__code__,
+        ),
+    )
+
+
+def count_query(execute, sql, params, many, context):
+    """Execute wrapper adding every query to the current profile's counters."""
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.counters['sql'] += 1
+        profile.counters['sql_ms'] += (time.perf_counter() - start) * 1000
+
+
+def install_query_counting(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class ProfilerMiddleware:
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = profiler_settings()
+        self.slow_after = self.options['SLOW_THRESHOLD_MS'] / 1000
+
+    @property
+    def sampler(self):
+        # Looked up per request: with preload_app this instance is built in
+        # gunicorn's master, and each worker needs its own sampler thread.
+        return get_sampler(self.options)
+
+    def __call__(self, request):
+        if not self.options['ENABLED']:
+            return self.get_response(request)
+
+        reason = SAMPLED if random.random() < self.options['SAMPLE_RATE'] else None
+        token = self.options['TRIGGER_TOKEN']
+        header = request.headers.get(TRIGGER_HEADER)
+        # As bytes: compare_digest raises TypeError on non-ASCII str.
+        if header and token and hmac.compare_digest(header.encode(), token.encode()):
+            reason = TRIGGERED
+        profile = RequestProfile(threading.get_ident(), reason, self.slow_after)
+        profile_token, counter_token = current_profile.set(profile), call_counter.set(profile.counters)
+        sampler = self.sampler
+        sampler.add(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.remove(profile)
+            current_profile.reset(profile_token)
+            call_counter.reset(counter_token)
+
+        duration = time.perf_counter() - profile.started
+        if profile.reason or duration >= self.slow_after:
+            self.save(request, response, profile, duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Staff can trigger a profile without the token; the user is known
+        # only now, so the profile starts at the view.
+        profile = current_profile.get()
+        if profile is not None and not profile.reason and TRIGGER_HEADER in request.headers:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_staff:
+                profile.reason = TRIGGERED
+                self.sampler.wake()
+
+    def save(self, request, response, profile, duration):
+        match = getattr(request, 'resolver_match', None)
+        profile_id = uuid.uuid4().hex
+        summary = {
+            'id': profile_id,
+            'time': time.time(),
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'reason': profile.reason or SLOW,
+            'samples': profile.samples,
+            'interval_ms': self.options['INTERVAL_MS'],
+            'sql_queries': profile.counters['sql'],
+            'sql_ms': round(profile.counters['sql_ms'], 1),
+            'cache_calls': profile.counters['cache'],
+        }
+        body = zlib.compress(json.dumps({**summary, 'folded': profile.folded()}).encode())
+        store(profile_id, summary, body, self.options)
+
+
+def _redis(options):
+    return caches[options['CACHE_ALIAS']].client.get_client(write=True)
+
+
+def _guarded(options, call, fallback, message, *args):
+    # The cache's circuit breaker, when it has one, skips Redis while it's down.
+    guard = getattr(caches[options['CACHE_ALIAS']], '_guard', None)
+    try:
+        return guard(call, fallback) if guard else call()
+    except _REDIS_ERRORS:
+        logger.warning(message, *args, exc_info=True)
+        return fallback()
+
+
+def store(profile_id, summary, body, options):
+    def call():
+        client = _redis(options)
+        script = per_process(('profiler-script',), lambda: client.register_script(STORE_SCRIPT))
+        return script(
+            keys=[INDEX_KEY, BODIES_KEY],
+            args=[profile_id, profile_id + json.dumps(summary), body, options['MAX_PROFILES']],
+            client=client,
+        )
+
+    _guarded(options, call, lambda: None, 'Could not store profile %s', profile_id)
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first; none while Redis is unreachable."""
+    options = profiler_settings()
+    entries = _guarded(options, lambda: _redis(options).lrange(INDEX_KEY, 0, -1), list, 'Could not list profiles')
+    return [json.loads(entry[32:]) for entry in entries]
+
+
+def get_profile(profile_id):
+    options = profiler_settings()
+    body = _guarded(
+        options, lambda: _redis(options).hget(BODIES_KEY, profile_id), lambda: None,
+        'Could not load profile %s', profile_id,
+    )
+    return json.loads(zlib.decompress(body)) if body else None
@@ -0,0 +1,307 @@
+"""
+Query budgets and N+1 detection for requests and tests.
+
+A ``QueryRecorder`` counts the SQL run while it is active, with the time
+spent and, per normalized statement (its fingerprint: literals, parameters
+and ``IN`` lists collapsed), the line of project code that ran it. The same
+fingerprint run ``n_plus_one`` times or more from one line is an N+1.
+
+Views declare a budget where they are routed, in core/urls.py::
+
+    path('orders/', query_budget(views.orders, queries=5, db_time_ms=50), name='orders')
+
+and everything else gets ``QUERY_BUDGET['DEFAULT']``. ``QueryBudgetMiddleware``
+checks each request against its view's budget. With ``QUERY_BUDGET['MODE']``
+``'raise'`` (tests, staging) going over raises ``QueryBudgetExceeded``; with
+``'log'`` (production, and the default) ``SAMPLE_RATE`` of requests are
+recorded and the ones over budget are logged, never raised; ``'off'``
+records nothing.
+
+With ``QUERY_COMMENTS`` on, every statement also ends with a
+``/* path:line in function */`` comment naming that line, which
+pg_stat_statements keeps and ``manage.py query_report`` shows.
+
+In tests, ``QueryBudgetTestRunner`` turns on ``'raise'`` and fails every test
+whose own queries contain an N+1, and ``assert_query_budget(...)`` checks a
+block::
+
+    with assert_query_budget(queries=3):
+        list(Order.objects.select_related('customer'))
+"""
+import functools
+import logging
+import random
+import re
+import sys
+import time
+import unittest
+from asyncio import iscoroutinefunction
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, fields
+from pathlib import Path
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+logger = logging.getLogger(__name__)
+
+RAISE, LOG, OFF = 'raise', 'log', 'off'
+
+current_recorder = ContextVar('core.querybudget.current_recorder', default=None)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w".])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*(?:%s|\?|\$\d+)(?:\s*,\s*(?:%s|\?|\$\d+))*\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+# Project code that only passes queries through: never "the line that ran it".
+_CORE_DIR = Path(__file__).resolve().parent
+_PASS_THROUGH = tuple(
+    str(path) for path in (
+        _CORE_DIR / 'backends', _CORE_DIR / 'querybudget.py', _CORE_DIR / 'profiling.py', _CORE_DIR / 'telemetry.py',
+        _CORE_DIR / 'querycache.py', _CORE_DIR.parent / 'manage.py',
+    )
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request or test ran more, slower or more repetitive SQL than its budget."""
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    """Limits for one view or test; None means unlimited."""
+    queries: int = None
+    db_time_ms: float = None
+    # Queries beyond the first of each fingerprint.
+    duplicates: int = None
+    # Runs of one fingerprint from one line that count as an N+1.
+    n_plus_one: int = None
+
+
+def query_budget_settings():
+    return {
+        'MODE': OFF,
+        'SAMPLE_RATE': 0.01,
+        'DEFAULT': {},
+        'TEST': {},
+        **getattr(settings, 'QUERY_BUDGET', {}),
+    }
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """The statement's shape: ``WHERE id = 7`` and ``WHERE id = 8`` look alike."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _PLACEHOLDER_LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def project_path(filename):
+    """``filename`` relative to BASE_DIR if it is project code that runs queries, else None."""
+    base_dir = str(settings.BASE_DIR)
+    if not filename.startswith(base_dir) or 'site-packages' in filename or filename.startswith(_PASS_THROUGH):
+        return None
+    return str(Path(filename).relative_to(base_dir))
+
+
+def call_site():
+    """``path:line in function`` of the innermost project frame that ran the current query."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        path = project_path(frame.f_code.co_filename)
+        if path is not None:
+            return f'{path}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class QueryRecorder:
+    """Counts queries while active (``with QueryRecorder() as recorder:``); recorders nest."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time_ms = 0.0
+        self.fingerprints = Counter()
+        self.sites = Counter()
+        self._parent = None
+        self._token = None
+
+    def __enter__(self):
+        self._parent = current_recorder.get()
+        self._token = current_recorder.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        current_recorder.reset(self._token)
+
+    def add(self, sql, elapsed_ms, site):
+        shape = fingerprint(sql)
+        recorder = self
+        while recorder is not None:
+            recorder.queries += 1
+            recorder.db_time_ms += elapsed_ms
+            recorder.fingerprints[shape] += 1
+            recorder.sites[shape, site] += 1
+            recorder = recorder._parent
+
+    @property
+    def duplicates(self):
+        return self.queries - len(self.fingerprints)
+
+    def n_plus_one(self, threshold):
+        """``(fingerprint, call site, count)`` for every N+1, worst first."""
+        return [(shape, site, count) for (shape, site), count in self.sites.most_common() if count >= threshold]
+
+    def violations(self, budget):
+        problems = []
+        if budget.queries is not None and self.queries > budget.queries:
+            problems.append(f'{self.queries} queries (budget {budget.queries})')
+        if budget.db_time_ms is not None and self.db_time_ms > budget.db_time_ms:
+            problems.append(f'{self.db_time_ms:.1f} ms in the database (budget {budget.db_time_ms} ms)')
+        if budget.duplicates is not None and self.duplicates > budget.duplicates:
+            problems.append(f'{self.duplicates} repeated query shapes (budget {budget.duplicates})')
+        if budget.n_plus_one is not None:
+            for shape, site, count in self.n_plus_one(budget.n_plus_one):
+                problems.append(f'N+1: {count}x at {site}: {shape[:200]}')
+        return problems
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper feeding the active QueryRecorder, if any."""
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add(sql, (time.perf_counter() - start) * 1000, call_site())
+
+
+def install_query_recording(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def comment_call_site(execute, sql, params, many, context):
+    """Execute wrapper appending ``/* path:line in function */`` of the line that ran the statement."""
+    site = call_site().replace('*/', '*')
+    if params is not None:
+        # The comment goes through the driver's %-formatting with the SQL.
+        site = site.replace('%', '%%')
+    return execute(f'{sql} /* {site} */', params, many, context)
+
+
+def install_query_comments(sender, connection, **kwargs):
+    # Last, so the other wrappers (fingerprints, write tracking) see the SQL untagged.
+    if getattr(settings, 'QUERY_COMMENTS', False) and comment_call_site not in connection.execute_wrappers:
+        connection.execute_wrappers.append(comment_call_site)
+
+
+def query_budget(view=None, **limits):
+    """
+    Give a view a budget: ``query_budget(view, queries=5)`` in a URLconf, or
+    ``@query_budget(queries=5)``. Limits not given fall back to
+    ``QUERY_BUDGET['DEFAULT']``. Each call wraps the view, so one view
+    routed twice can have two budgets.
+    """
+    valid = {field.name for field in fields(QueryBudget)}
+    if set(limits) - valid:
+        raise TypeError(f'Unknown query budget limits {sorted(set(limits) - valid)}; use {sorted(valid)}.')
+
+    def decorator(view):
+        view = getattr(view, '__wrapped__', view) if hasattr(view, 'query_budget') else view
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                return await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                return view(request, *args, **kwargs)
+
+        wrapper.query_budget = limits
+        return wrapper
+
+    return decorator(view) if view is not None else decorator
+
+
+def budget_for(view_func, options):
+    return QueryBudget(**{**options['DEFAULT'], **getattr(view_func, 'query_budget', {})})
+
+
+@contextmanager
+def assert_query_budget(**limits):
+    """Fail (``QueryBudgetExceeded``) if the block goes over ``limits``."""
+    with QueryRecorder() as recorder:
+        yield recorder
+    problems = recorder.violations(QueryBudget(**limits))
+    if problems:
+        raise QueryBudgetExceeded('Query budget exceeded:\n  ' + '\n  '.join(problems))
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = query_budget_settings()
+        mode = options['MODE']
+        if mode == OFF or (mode == LOG and random.random() >= options['SAMPLE_RATE']):
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return response
+        problems = recorder.violations(budget_for(match.func, options))
+        if problems:
+            message = f'{request.method} {request.path} ({match.view_name}) went over its query budget:\n  ' + \
+                '\n  '.join(problems)
+            if mode == RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class QueryBudgetResult(unittest.TextTestResult):
+    """Records each test's own queries and fails it on an N+1 or QUERY_BUDGET['TEST'] overrun."""
+
+    def startTest(self, test):
+        self._recorder = QueryRecorder().__enter__()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        recorder, self._recorder = self._recorder, None
+        recorder.__exit__(None, None, None)
+        problems = recorder.violations(QueryBudget(**query_budget_settings()['TEST']))
+        if problems:
+            error = QueryBudgetExceeded(f'{test.id()} went over the test query budget:\n  ' + '\n  '.join(problems))
+            self.addFailure(test, (QueryBudgetExceeded, error, None))
+        super().stopTest(test)
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """DiscoverRunner with query budgets enforced on every request and test."""
+
+    def get_resultclass(self):
+        return super().get_resultclass() or QueryBudgetResult
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._query_budget = override_settings(QUERY_BUDGET={**query_budget_settings(), 'MODE': RAISE})
+        self._query_budget.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._query_budget.disable()
+        super().teardown_test_environment(**kwargs)
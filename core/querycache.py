@@ -0,0 +1,250 @@
+"""
+Opt-in cache of ORM query results in Redis, invalidated per table.
+
+``cached(queryset)`` (or ``.cache()`` on a ``CachingQuerySet``) keeps the
+queryset's rows, and its ``count()``, in the ``QUERY_CACHE['CACHE_ALIAS']``
+cache for ``QUERY_CACHE['TIMEOUT']`` seconds::
+
+    recent = cached(Order.objects.filter(status='open').select_related('customer'))[:50]
+
+Admin pages opt in with ``QueryCacheAdminMixin``.
+
+Every table has a generation number in Redis. An entry's key is made of the
+query's SQL and parameters and the generations of every table named in it,
+read in the same round trip as the entry itself. A write bumps the
+generations of the tables it touches, which makes every entry that read them
+unreachable; they expire on their own. Writes are seen by an execute wrapper
+on every connection, so ``save()``, ``update()``, ``bulk_create()``,
+``delete()`` and raw SQL run through a Django cursor all count; anything
+that bypasses Django's cursors (psycopg2's ``copy_expert``, another
+service) must call ``invalidate_tables(...)`` itself.
+
+Inside ``transaction.atomic()`` the bump waits for the commit, so other
+requests never cache what a transaction wrote and may still roll back, and
+the transaction itself reads the tables it wrote from the database. Results
+read from a replica are kept at most ``DATABASE_REPLICA_MAX_LAG`` seconds, as
+stale as the replica itself may be. While Redis is unreachable queries go to
+the database; a bump lost then leaves entries stale until they expire.
+"""
+import functools
+import hashlib
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet, FullResultSet, ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import QuerySet
+
+from core.backends.cache import _REDIS_ERRORS, per_process
+
+logger = logging.getLogger(__name__)
+
+GENERATION_PREFIX = 'querycache:generation:'
+ENTRY_PREFIX = 'querycache:entry:'
+
+# Hits, misses, and queries run uncached (in a transaction that wrote their
+# tables, too many rows, or Redis down), in this process.
+stats = Counter()
+
+_READ_TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+"([^"]+)"', re.IGNORECASE)
+_WRITE_TABLE_RE = re.compile(
+    r'\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|ALTER\s+TABLE|DROP\s+TABLE|COPY)'
+    r'\s+(?:ONLY\s+)?(?!SET\b)"?([\w.]+)"?',
+    re.IGNORECASE,
+)
+_WRITES = ('INSERT', 'UPDATE', 'DELETE', 'TRUNCA', 'ALTER ', 'DROP T', 'COPY ', 'WITH ', 'MERGE ')
+
+# The key of the entry for a query at its tables' current generations, and
+# the entry. KEYS: generation keys. ARGV: entry key prefix and query digest
+READ_SCRIPT = """
+local key = ARGV[1]
+for _, generation in ipairs(redis.call('MGET', unpack(KEYS))) do
+    key = key .. ':' .. (generation or '0')
+end
+return {key, redis.call('GET', key)}
+"""
+
+
+def query_cache_settings():
+    return {
+        'ENABLED': True,
+        'TIMEOUT': 300,
+        # Larger results are not stored.
+        'MAX_ROWS': 1000,
+        'CACHE_ALIAS': 'default',
+        **getattr(settings, 'QUERY_CACHE', {}),
+    }
+
+
+def _guarded(cache, call, fallback):
+    # The cache's circuit breaker, when it has one, skips Redis while it's down.
+    guard = getattr(cache, '_guard', None)
+    try:
+        return guard(call, fallback) if guard else call()
+    except _REDIS_ERRORS:
+        logger.warning('Query cache could not reach Redis', exc_info=True)
+        return fallback()
+    except ImproperlyConfigured:
+        # No REDIS_URL (e.g. migrate on the local SQLite fallback): nothing to
+        # read or invalidate.
+        return fallback()
+
+
+def invalidate_tables(*tables, cache_alias=None):
+    """Make every cached result that read ``tables`` stale; for writes Django doesn't see."""
+    if not tables:
+        return
+    cache = caches[cache_alias or query_cache_settings()['CACHE_ALIAS']]
+
+    def call():
+        pipeline = cache.client.get_client(write=True).pipeline(transaction=False)
+        for table in tables:
+            pipeline.incr(GENERATION_PREFIX + table)
+        pipeline.execute()
+
+    _guarded(cache, call, lambda: None)
+
+
+def written_tables(sql):
+    """Tables a statement writes to, or an empty set for reads."""
+    if not sql.lstrip()[:6].upper().startswith(_WRITES):
+        return set()
+    return {table.split('.')[-1] for table in _WRITE_TABLE_RE.findall(sql)}
+
+
+def track_writes(execute, sql, params, many, context):
+    """Execute wrapper bumping the generations of the tables a write touched."""
+    result = execute(sql, params, many, context)
+    tables = written_tables(sql)
+    if not tables:
+        return result
+    connection = context['connection']
+    if not connection.in_atomic_block:
+        invalidate_tables(*tables)
+        return result
+    # Bumped on commit. A rolled back transaction's tables are bumped with the
+    # next transaction's, which only costs some extra misses.
+    dirty = getattr(connection, 'querycache_dirty', None)
+    if dirty is None:
+        dirty = connection.querycache_dirty = set()
+    dirty |= tables
+    transaction.on_commit(lambda: _flush_dirty(connection), using=connection.alias)
+    return result
+
+
+def _flush_dirty(connection):
+    tables, connection.querycache_dirty = connection.querycache_dirty, set()
+    invalidate_tables(*tables)
+
+
+def install_write_tracking(sender, connection, **kwargs):
+    if track_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_writes)
+
+
+def cached_result(queryset, kind, compute, timeout=None):
+    """``compute()``, cached under the queryset's SQL and its tables' generations."""
+    options = query_cache_settings()
+    if not options['ENABLED']:
+        return compute()
+    connection = connections[queryset.db]
+    try:
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    except (EmptyResultSet, FullResultSet):
+        return compute()
+    tables = sorted(set(_READ_TABLE_RE.findall(sql)))
+    # Leftovers of a rolled back transaction only count inside a transaction.
+    dirty = getattr(connection, 'querycache_dirty', None) if connection.in_atomic_block else None
+    if not tables or queryset.query.select_for_update or (dirty and dirty.intersection(tables)):
+        stats['uncached'] += 1
+        return compute()
+
+    cache = caches[options['CACHE_ALIAS']]
+    digest = hashlib.sha1(
+        f'{settings.VIEW_CACHE_VERSION}:{kind}:{queryset._iterable_class.__name__}:{sql}:{params!r}'.encode()
+    ).hexdigest()
+
+    def read():
+        client = cache.client.get_client(write=True)
+        script = per_process(('querycache-script',), lambda: client.register_script(READ_SCRIPT))
+        return script(keys=[GENERATION_PREFIX + table for table in tables], args=[ENTRY_PREFIX + digest], client=client)
+
+    found = _guarded(cache, read, lambda: None)
+    if found is None:
+        stats['uncached'] += 1
+        return compute()
+    key, raw = found
+    if raw is not None:
+        stats['hits'] += 1
+        return cache.client.decode(raw)
+
+    stats['misses'] += 1
+    value = compute()
+    if isinstance(value, list) and len(value) > options['MAX_ROWS']:
+        return value
+    timeout = options['TIMEOUT'] if timeout is None else timeout
+    if queryset.db in getattr(settings, 'DATABASE_REPLICAS', []):
+        timeout = min(timeout, getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 30))
+    _guarded(cache, lambda: cache.client.get_client(write=True).set(key, cache.client.encode(value), ex=timeout),
+             lambda: None)
+    return value
+
+
+class QueryCacheMixin:
+    """QuerySet methods for ``.cache()``; see ``CachingQuerySet`` and ``cached()``."""
+
+    _cache_timeout = None
+    _cache_enabled = False
+
+    def cache(self, timeout=None):
+        clone = self._chain()
+        clone._cache_enabled, clone._cache_timeout = True, timeout
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._cache_enabled, clone._cache_timeout = self._cache_enabled, self._cache_timeout
+        return clone
+
+    def _fetch_all(self):
+        # Prefetches run after, uncached: their tables aren't in this SQL.
+        if self._result_cache is None and self._cache_enabled:
+            self._result_cache = cached_result(
+                self, 'rows', lambda: list(self._iterable_class(self)), self._cache_timeout,
+            )
+        super()._fetch_all()
+
+    def count(self):
+        if self._result_cache is not None or not self._cache_enabled:
+            return super().count()
+        return cached_result(self, 'count', super().count, self._cache_timeout)
+
+
+class CachingQuerySet(QueryCacheMixin, QuerySet):
+    """For models that opt in: ``objects = CachingQuerySet.as_manager()``."""
+
+
+@functools.lru_cache(maxsize=None)
+def _caching_class(queryset_class):
+    return type(f'Caching{queryset_class.__name__}', (QueryCacheMixin, queryset_class), {})
+
+
+def cached(queryset, timeout=None):
+    """``queryset`` with its results cached, whatever its QuerySet class."""
+    if not isinstance(queryset, QueryCacheMixin):
+        queryset = queryset._chain()
+        queryset.__class__ = _caching_class(type(queryset))
+    return queryset.cache(timeout)
+
+
+class QueryCacheAdminMixin:
+    """Cache a change list's rows and counts: ``class OrderAdmin(QueryCacheAdminMixin, admin.ModelAdmin)``."""
+
+    query_cache_timeout = None
+
+    def get_queryset(self, request):
+        return cached(super().get_queryset(request), self.query_cache_timeout)
+
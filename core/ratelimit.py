@@ -0,0 +1,390 @@
+"""
+Rate limiting on the Redis behind ``CACHES``, shared by every worker.
+
+Rules are a rate (``'300/m'``, ``'20/10s'``), what to count requests by, and
+an algorithm:
+
+* ``token_bucket`` (default): ``burst`` requests at once (default: the rate's
+  count), refilled evenly over the period.
+* ``sliding_window``: at most the rate's count in any period, estimated from
+  the current and previous fixed windows.
+
+``key`` is one or more of ``ip``, ``user``, ``user_or_ip`` and ``route``
+joined with ``+``: ``'user_or_ip'`` limits each client across the site,
+``'ip+route'`` each client on each URL pattern, ``'route'`` a URL pattern
+for everybody.
+
+``RateLimitMiddleware`` applies ``RATELIMIT_RULES`` to every view and adds
+the rules of views decorated with ``@ratelimit(...)``; views can also opt out
+with ``@ratelimit_exempt``. All the rules that apply to a request are checked
+and charged by one Lua script call, all or nothing. A denied request gets a
+429 with ``Retry-After``.
+
+Under load a process asks Redis for up to ``RATELIMIT_LOCAL_BATCH`` requests
+at a time for a client it has just seen, and spends the extra ones locally
+for at most ``RATELIMIT_LOCAL_TTL`` seconds; unspent ones are lost, so a
+client can only be limited slightly early, never late. Denials are
+remembered locally the same way. If Redis is unreachable requests are let
+through.
+"""
+import ipaddress
+import logging
+import math
+import re
+import threading
+import time
+from asyncio import iscoroutinefunction
+from dataclasses import dataclass
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from core.backends.cache import _REDIS_ERRORS, per_process
+
+logger = logging.getLogger(__name__)
+
+TOKEN_BUCKET, SLIDING_WINDOW = 'token_bucket', 'sliding_window'
+KEY_PREFIX = 'ratelimit'
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_RATE_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\w*\s*$')
+
+# Check every rule, then charge all of them or none. Grants up to ARGV[2]
+# requests at once, as many as the tightest rule allows.
+# KEYS: one per rule. ARGV: now (ms), wanted, then per rule: algorithm
+# ('tb' or 'sw'), limit, period (ms), burst.
+# Returns {granted, retry after (ms), remaining}.
+CHECK_SCRIPT = """
+local now = tonumber(ARGV[1])
+local grant = tonumber(ARGV[2])
+local retry = 0
+local state = {}
+for i, key in ipairs(KEYS) do
+    local at = 2 + (i - 1) * 4
+    local kind, limit = ARGV[at + 1], tonumber(ARGV[at + 2])
+    local period, burst = tonumber(ARGV[at + 3]), tonumber(ARGV[at + 4])
+    local available
+    if kind == 'tb' then
+        local rate = limit / period
+        local bucket = redis.call('HMGET', key, 't', 'ts')
+        local tokens = tonumber(bucket[1]) or burst
+        local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+        tokens = math.min(burst, tokens + elapsed * rate)
+        state[i] = tokens
+        available = math.floor(tokens)
+        if available < 1 then
+            retry = math.max(retry, math.ceil((1 - tokens) / rate))
+        end
+    else
+        local window = math.floor(now / period)
+        local elapsed = now - window * period
+        local counts = redis.call('MGET', key .. ':' .. window, key .. ':' .. (window - 1))
+        local current, previous = tonumber(counts[1]) or 0, tonumber(counts[2]) or 0
+        state[i] = window
+        available = math.floor(limit - current - previous * (period - elapsed) / period)
+        if available < 1 then
+            if current >= limit then
+                -- Full until the next window and its share of this one ages out.
+                retry = math.max(retry, period - elapsed + math.ceil(period * (current - limit + 1) / current))
+            else
+                local free_at = period - math.floor(period * (limit - 1 - current) / previous)
+                retry = math.max(retry, free_at - elapsed)
+            end
+        end
+    end
+    grant = math.min(grant, available)
+end
+if grant < 1 then
+    return {0, math.max(retry, 1), 0}
+end
+local remaining = nil
+for i, key in ipairs(KEYS) do
+    local at = 2 + (i - 1) * 4
+    local limit, period = tonumber(ARGV[at + 2]), tonumber(ARGV[at + 3])
+    local left
+    if ARGV[at + 1] == 'tb' then
+        left = state[i] - grant
+        redis.call('HSET', key, 't', tostring(left), 'ts', now)
+        redis.call('PEXPIRE', key, math.ceil(tonumber(ARGV[at + 4]) * period / limit) + 1000)
+    else
+        local counter = key .. ':' .. state[i]
+        left = limit - redis.call('INCRBY', counter, grant)
+        redis.call('PEXPIRE', counter, period * 2)
+    end
+    if remaining == nil or left < remaining then
+        remaining = left
+    end
+end
+return {grant, 0, math.max(0, math.floor(remaining))}
+"""
+
+
+def parse_rate(rate):
+    """``'300/m'`` -> ``(300, 60)``; ``'20/10s'`` -> ``(20, 10)``."""
+    match = _RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f'Invalid rate {rate!r}; use "<count>/<period>", e.g. "300/m" or "20/10s".')
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * _PERIODS[unit]
+
+
+@dataclass
+class Rule:
+    rate: str
+    key: str = 'user_or_ip'
+    algorithm: str = TOKEN_BUCKET
+    burst: int = None
+    methods: tuple = None
+    # Keeps the buckets of rules with the same key apart (e.g. two views).
+    group: str = ''
+
+    def __post_init__(self):
+        self.limit, self.period = parse_rate(self.rate)
+        if self.algorithm not in (TOKEN_BUCKET, SLIDING_WINDOW):
+            raise ValueError(f'Unknown rate limit algorithm {self.algorithm!r}.')
+        unknown = set(self.key.split('+')) - set(_IDENTITIES)
+        if unknown:
+            raise ValueError(f'Unknown rate limit key {"+".join(sorted(unknown))!r}; use {sorted(_IDENTITIES)}.')
+
+    def applies_to(self, request):
+        return not self.methods or request.method in self.methods
+
+    def redis_key(self, request):
+        """None when the request has nothing to count by (an anonymous 'user')."""
+        parts = []
+        for part in self.key.split('+'):
+            value = _IDENTITIES[part](request)
+            if value is None:
+                return None
+            parts.append(f'{part}={value}')
+        return ':'.join([KEY_PREFIX, self.group or '*', self.algorithm, self.rate, *parts])
+
+    def script_args(self):
+        burst = self.burst if self.burst is not None else self.limit
+        return ['tb' if self.algorithm == TOKEN_BUCKET else 'sw', self.limit, self.period * 1000, burst]
+
+
+def client_ip(request):
+    """
+    The client's address. Behind ``RATELIMIT_PROXY_COUNT`` proxies (App
+    Service's front ends) it's the one the outermost proxy appended to
+    X-Forwarded-For, which the client can't forge. IPv6 clients are counted
+    per /64, which is what one host usually gets.
+    """
+    address = request.META.get('REMOTE_ADDR', '')
+    proxies = getattr(settings, 'RATELIMIT_PROXY_COUNT', 0)
+    if proxies:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= proxies:
+            address = forwarded[-proxies]
+    # App Service appends the port: "203.0.113.7:51234", "[2001:db8::1]:51234"
+    if address.startswith('['):
+        address = address[1:].partition(']')[0]
+    elif address.count(':') == 1:
+        address = address.partition(':')[0]
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address or None
+    if ip.version == 6:
+        return str(ipaddress.ip_network(f'{ip}/64', strict=False).network_address)
+    return str(ip)
+
+
+def _user(request):
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def _user_or_ip(request):
+    user = _user(request)
+    return f'u{user}' if user is not None else f'ip{client_ip(request)}'
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return request.path_info
+    return match.route or match.view_name
+
+
+_IDENTITIES = {'ip': client_ip, 'user': _user, 'user_or_ip': _user_or_ip, 'route': _route}
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    retry_after: float = 0
+    remaining: int = None
+
+
+class LocalAllowance:
+    """
+    Requests granted by Redis but not yet spent, and recent denials, per set
+    of rule keys, in this process.
+    """
+
+    def __init__(self, ttl, batch, max_entries=10000):
+        self.ttl, self.batch, self.max_entries = ttl, batch, max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def take(self, keys, now):
+        """A local decision, or how many requests to ask Redis for."""
+        with self._lock:
+            entry = self._entries.get(keys)
+            if entry is None:
+                return None, 1
+            tokens, expires_at, denied_until, last_asked = entry
+            if now < denied_until:
+                return Decision(False, retry_after=denied_until - now), 0
+            if tokens > 0 and now < expires_at:
+                entry[0] -= 1
+                return Decision(True, remaining=None), 0
+            # Seen within the TTL: hot enough to batch.
+            return None, self.batch if now - last_asked < self.ttl else 1
+
+    def store(self, keys, now, granted, retry_after):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[1] > now or entry[2] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            denied_until = now + min(retry_after, self.ttl) if not granted else 0
+            self._entries[keys] = [max(granted - 1, 0), now + self.ttl, denied_until, now]
+
+
+class RateLimiter:
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+
+    @property
+    def allowance(self):
+        ttl = getattr(settings, 'RATELIMIT_LOCAL_TTL', 1.0)
+        batch = max(1, getattr(settings, 'RATELIMIT_LOCAL_BATCH', 10))
+        return per_process(('ratelimit-allowance', ttl, batch), lambda: LocalAllowance(ttl, batch))
+
+    def check(self, request, rules):
+        rules = [rule for rule in rules if rule.applies_to(request)]
+        keyed = [(rule, rule.redis_key(request)) for rule in rules]
+        keyed = [(rule, key) for rule, key in keyed if key is not None]
+        if not keyed:
+            return Decision(True)
+
+        keys = tuple(key for _, key in keyed)
+        now = time.monotonic()
+        allowance = self.allowance
+        decision, wanted = allowance.take(keys, now)
+        if decision is not None:
+            return decision
+
+        args = [int(time.time() * 1000), wanted]
+        for rule, _ in keyed:
+            args.extend(rule.script_args())
+        result = self._run(list(keys), args)
+        if result is None:
+            return Decision(True)
+        granted, retry_ms, remaining = (int(value) for value in result)
+        allowance.store(keys, now, granted, retry_ms / 1000)
+        if granted:
+            return Decision(True, remaining=remaining)
+        return Decision(False, retry_after=retry_ms / 1000, remaining=0)
+
+    def _run(self, keys, args):
+        """The script's result, or None (let the request through) if Redis is down."""
+        cache = caches[self.cache_alias]
+
+        def call():
+            client = cache.client.get_client(write=True)
+            script = per_process(('ratelimit-script',), lambda: client.register_script(CHECK_SCRIPT))
+            return script(keys=keys, args=args, client=client)
+
+        # The cache's circuit breaker, when it has one, skips Redis while it's down.
+        guard = getattr(cache, '_guard', None)
+        try:
+            return guard(call, lambda: None) if guard else call()
+        except _REDIS_ERRORS:
+            logger.warning('Rate limiter could not reach Redis; letting requests through', exc_info=True)
+            return None
+
+
+limiter = RateLimiter()
+
+
+def too_many_requests(decision):
+    response = HttpResponse('Too many requests.\n', status=429, content_type='text/plain')
+    response.headers['Retry-After'] = str(max(1, math.ceil(decision.retry_after)))
+    return response
+
+
+def rules_from_settings():
+    return per_process(
+        ('ratelimit-rules', repr(getattr(settings, 'RATELIMIT_RULES', ()))),
+        lambda: [Rule(**options) for options in getattr(settings, 'RATELIMIT_RULES', ())],
+    )
+
+
+def ratelimit(rate, key='user_or_ip', algorithm=TOKEN_BUCKET, burst=None, methods=None, group=None):
+    """
+    Limit a view. Stacks with other ``@ratelimit`` decorators and with
+    ``RATELIMIT_RULES``; each view gets its own buckets unless ``group`` is
+    shared.
+    """
+
+    def decorator(view):
+        rule = Rule(
+            rate, key=key, algorithm=algorithm, burst=burst,
+            methods=tuple(method.upper() for method in methods) if methods else None,
+            group=group or f'{view.__module__}.{view.__qualname__}',
+        )
+        rules = [rule, *getattr(view, 'ratelimit_rules', ())]
+        view = getattr(view, '__wrapped__', view) if hasattr(view, 'ratelimit_rules') else view
+
+        def denied(request):
+            # Without the middleware the decorator checks its own rules.
+            if getattr(request, 'ratelimit', None) is not None or not getattr(settings, 'RATELIMIT_ENABLED', True):
+                return None
+            request.ratelimit = limiter.check(request, rules)
+            return None if request.ratelimit.allowed else too_many_requests(request.ratelimit)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                # The check talks to Redis (and may load request.user); keep it off the event loop.
+                return await sync_to_async(denied)(request) or await view(request, *args, **kwargs)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                return denied(request) or view(request, *args, **kwargs)
+
+        wrapper.ratelimit_rules = rules
+        return wrapper
+
+    return decorator
+
+
+def ratelimit_exempt(view):
+    """Skip ``RATELIMIT_RULES`` for this view (e.g. health checks)."""
+    view.ratelimit_exempt = True
+    return view
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """
+    Apply ``RATELIMIT_RULES`` plus the view's own ``@ratelimit`` rules in one
+    check. Goes after AuthenticationMiddleware so ``user`` keys see the user.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(settings, 'RATELIMIT_ENABLED', True):
+            return None
+        rules = list(getattr(view_func, 'ratelimit_rules', ()))
+        if not getattr(view_func, 'ratelimit_exempt', False):
+            rules += rules_from_settings()
+        request.ratelimit = limiter.check(request, rules)
+        if not request.ratelimit.allowed:
+            return too_many_requests(request.ratelimit)
+        return None
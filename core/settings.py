@@ -12,6 +12,11 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from redis.retry import Retry
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,19 +42,34 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'core',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Outside the rest so profiles cover every middleware but static files.
+    'core.profiling.ProfilerMiddleware',
+    # Counts the queries of every middleware below, sessions and auth included.
+    'core.querybudget.QueryBudgetMiddleware',
+    # Outside everything that touches the body: ETags are computed on the
+    # uncompressed content, after sessions have added Vary: Cookie.
+    'core.middleware.CompressionMiddleware',
+    'core.middleware.ETagMiddleware',
+    'core.db_router.PrimaryPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After authentication, so per-user limits see the user.
+    'core.ratelimit.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-SESSION_ENGINE = "django.contrib.sessions.backends.cache"
+# Cache-only sessions that fall back to the database while Redis is
+# unavailable (see core/backends/sessions.py).
+SESSION_ENGINE = "core.backends.sessions"
 
 ROOT_URLCONF = 'core.urls'
 
@@ -71,16 +91,67 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'core.wsgi.application'
 
+ASGI_APPLICATION = 'core.asgi.application'
+
+# 'wsgi' (gthread workers) or 'asgi' (uvicorn workers); see gunicorn.conf.py.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Uses the flexible server provisioned by __main__.py whenever the WebApp
+# app settings are present; SQLite is only a local fallback.
+if all(os.getenv(name) for name in ('POSTGRES_DB', 'POSTGRES_USER', 'POSTGRES_HOST')):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'core.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB'),
+            'USER': os.getenv('POSTGRES_USER'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            # Persistent connections, checked before being reused by a request.
+            # Django can't reuse them safely under ASGI, where the pool below
+            # does the reusing instead.
+            'CONN_MAX_AGE': 0 if SERVER_MODE == 'asgi' else int(os.getenv('DB_CONN_MAX_AGE', '600')),
+            'CONN_HEALTH_CHECKS': True,
+            # PgBouncer in transaction mode may hand each transaction to a
+            # different backend, so named (server-side) cursors can't survive.
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('POSTGRES_PGBOUNCER') == 'transaction',
+            'OPTIONS': {
+                'sslmode': os.getenv('POSTGRES_SSLMODE', 'require'),
+                'connect_timeout': int(os.getenv('POSTGRES_CONNECT_TIMEOUT', '5')),
+                # Bounded per-process pool (see core/backends/postgresql).
+                'pool': {
+                    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '0')),
+                    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '4')),
+                    'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+                },
+            },
+        }
     }
-}
+    # Read replicas provisioned by __main__.py (postgresReplicas), used for
+    # reads by core.db_router.
+    for index, host in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica_{index}'] = {
+            **DATABASES['default'],
+            'HOST': host.strip(),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+DATABASE_REPLICA_HEALTH_CHECK_INTERVAL = int(os.getenv('DB_REPLICA_HEALTH_CHECK_INTERVAL', '10'))
+# Seconds of replay lag after which a replica is taken out of rotation.
+DATABASE_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '30'))
 
 
 # Password validation
@@ -103,14 +174,152 @@ AUTH_PASSWORD_VALIDATORS = [
 
 CACHES = {
         "default": {  
-            "BACKEND": "django_redis.cache.RedisCache",
+            # django_redis behind a per-process LRU; see core/backends/cache.py
+            "BACKEND": "core.backends.cache.TieredRedisCache",
             "LOCATION": os.environ.get('REDIS_URL'),
             "OPTIONS": {
                 "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                "LOCAL_MAX_ENTRIES": int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', '1000')),
+                # Upper bound (seconds) on serving a local entry whose
+                # invalidation message was lost.
+                "LOCAL_TIMEOUT": int(os.getenv('CACHE_LOCAL_TIMEOUT', '5')),
+                "INVALIDATION_CHANNEL": "cache-invalidation",
+                # Compact values for the 1 GB Redis; older pickled values
+                # are still readable (see core/backends/codecs.py).
+                "SERIALIZER": "core.backends.codecs.TaggedSerializer",
+                "SERIALIZER_FORMAT": os.getenv('CACHE_SERIALIZER', 'msgpack'),
+                "COMPRESSOR": "core.backends.codecs.TaggedCompressor",
+                "COMPRESSOR_ALGORITHM": os.getenv('CACHE_COMPRESSOR', 'zlib'),
+                "COMPRESS_MIN_LENGTH": int(os.getenv('CACHE_COMPRESS_MIN_LENGTH', '256')),
+                # Fail fast instead of blocking request threads on a slow or
+                # failing-over Redis; the circuit breaker then serves from
+                # local memory until Redis answers again.
+                "SOCKET_CONNECT_TIMEOUT": float(os.getenv('REDIS_CONNECT_TIMEOUT', '1')),
+                "SOCKET_TIMEOUT": float(os.getenv('REDIS_SOCKET_TIMEOUT', '0.5')),
+                "CONNECTION_POOL_CLASS": "redis.BlockingConnectionPool",
+                "CONNECTION_POOL_KWARGS": {
+                    "max_connections": int(os.getenv('REDIS_MAX_CONNECTIONS', '10')),
+                    "timeout": float(os.getenv('REDIS_POOL_TIMEOUT', '1')),
+                    "retry": Retry(ExponentialBackoff(cap=0.2, base=0.02), int(os.getenv('REDIS_RETRIES', '2'))),
+                    "retry_on_error": [RedisConnectionError, RedisTimeoutError],
+                },
+                "CIRCUIT_FAILURE_THRESHOLD": int(os.getenv('CACHE_CIRCUIT_FAILURE_THRESHOLD', '5')),
+                "CIRCUIT_RESET_TIMEOUT": int(os.getenv('CACHE_CIRCUIT_RESET_TIMEOUT', '30')),
         },
     }
 }
 
+# Background tasks on the same Redis (core/taskqueue.py); run them with
+# 'manage.py run_worker'. EAGER runs tasks inline, for stacks without workers.
+TASK_QUEUE = {
+    'PREFIX': 'tasks',
+    'EAGER': os.getenv('TASKS_EAGER', 'false').lower() == 'true',
+    # Seconds without a heartbeat (sent every third of it) before a running
+    # job is presumed lost with its worker and retried.
+    'LEASE_TIMEOUT': int(os.getenv('TASK_LEASE_TIMEOUT', '60')),
+    'RESULT_TTL': int(os.getenv('TASK_RESULT_TTL', '86400')),
+}
+
+# OpenTelemetry tracing (core/telemetry.py), sent to Application Insights when
+# App Service has its connection string. SAMPLE_RATIO of requests are traced.
+TRACING = {
+    'EXPORTER': os.getenv(
+        'TRACING_EXPORTER', 'azure' if os.getenv('APPLICATIONINSIGHTS_CONNECTION_STRING') else 'none'
+    ),
+    'SAMPLE_RATIO': float(os.getenv('TRACING_SAMPLE_RATIO', '0.1')),
+    'SERVICE_NAME': os.getenv('WEBSITE_SITE_NAME', 'cookiecutter-pulumi-django'),
+    'CONNECTION_STRING': os.getenv('APPLICATIONINSIGHTS_CONNECTION_STRING'),
+    # Seconds between exports of the cache circuit breaker metrics.
+    'METRICS_INTERVAL': int(os.getenv('TRACING_METRICS_INTERVAL', '60')),
+}
+
+# Sampling request profiler (core/profiling.py); profiles are listed at
+# /admin/profiles/. Requests slower than SLOW_THRESHOLD_MS are always kept.
+PROFILER = {
+    'ENABLED': os.getenv('PROFILER_ENABLED', 'true').lower() == 'true',
+    'SAMPLE_RATE': float(os.getenv('PROFILER_SAMPLE_RATE', '0.001')),
+    'SLOW_THRESHOLD_MS': int(os.getenv('PROFILER_SLOW_THRESHOLD_MS', '1000')),
+    'INTERVAL_MS': float(os.getenv('PROFILER_INTERVAL_MS', '5')),
+    # Requests with "X-Profile: <token>" are always profiled.
+    'TRIGGER_TOKEN': os.getenv('PROFILER_TRIGGER_TOKEN'),
+    'MAX_PROFILES': int(os.getenv('PROFILER_MAX_PROFILES', '200')),
+}
+
+# Query budgets (core/querybudget.py): per-view limits set in core/urls.py,
+# DEFAULT for the rest. MODE is 'raise' (tests, staging), 'log' (SAMPLE_RATE
+# of requests; the default, so an unset variable never turns an N+1 into a
+# 500) or 'off'; TEST_RUNNER forces 'raise' and Pulumi sets it per profile.
+# The same statement run N_PLUS_ONE times from one line is an N+1; TEST
+# applies to each test under TEST_RUNNER.
+QUERY_BUDGET = {
+    'MODE': os.getenv('QUERY_BUDGET_MODE', 'log'),
+    'SAMPLE_RATE': float(os.getenv('QUERY_BUDGET_SAMPLE_RATE', '0.01')),
+    'DEFAULT': {
+        'queries': int(os.getenv('QUERY_BUDGET_QUERIES', '30')),
+        'db_time_ms': float(os.getenv('QUERY_BUDGET_DB_TIME_MS', '500')),
+        'n_plus_one': int(os.getenv('QUERY_BUDGET_N_PLUS_ONE', '5')),
+    },
+    'TEST': {'n_plus_one': int(os.getenv('QUERY_BUDGET_N_PLUS_ONE', '5'))},
+}
+TEST_RUNNER = 'core.querybudget.QueryBudgetTestRunner'
+# Append /* path:line in function */ to every statement, for
+# 'manage.py query_report' (pg_stat_statements keeps the comment).
+QUERY_COMMENTS = os.getenv('QUERY_COMMENTS', 'true').lower() == 'true'
+
+# Rate limiting in Redis (core/ratelimit.py), per client across the site;
+# views add their own limits with @ratelimit. Rates are "<count>/<period>".
+RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
+RATELIMIT_RULES = [
+    {'key': 'user_or_ip', 'rate': os.getenv('RATELIMIT_RATE', '600/m'),
+     'burst': int(os.getenv('RATELIMIT_BURST', '100'))},
+    {'key': 'ip', 'rate': os.getenv('RATELIMIT_WRITE_RATE', '60/m'), 'algorithm': 'sliding_window',
+     'methods': ('POST', 'PUT', 'PATCH', 'DELETE')},
+]
+# Requests a process may take from Redis at once for a busy client, and how
+# long (seconds) it may spend them locally.
+RATELIMIT_LOCAL_BATCH = int(os.getenv('RATELIMIT_LOCAL_BATCH', '10'))
+RATELIMIT_LOCAL_TTL = float(os.getenv('RATELIMIT_LOCAL_TTL', '1'))
+# App Service's front end appends the client address to X-Forwarded-For.
+RATELIMIT_PROXY_COUNT = int(os.getenv('RATELIMIT_PROXY_COUNT', '1' if os.getenv('WEBSITE_SITE_NAME') else '0'))
+
+# Dynamic response compression (core/middleware.py); static files are
+# precompressed by WhiteNoise instead.
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '500'))
+COMPRESS_CONTENT_TYPES = (
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/xml', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+)
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_STREAM_FLUSH_SIZE = 16384
+
+# Seconds a response's ETag is remembered so a matching If-None-Match is
+# answered with a 304 before the view runs; any ORM write forgets them all.
+ETAG_CACHE_TIMEOUT = int(os.getenv('ETAG_CACHE_TIMEOUT', '300'))
+
+# ORM result cache (core/querycache.py) for querysets that opt in with
+# cached()/.cache(); any write to a table they read makes them stale.
+QUERY_CACHE = {
+    'ENABLED': os.getenv('QUERY_CACHE_ENABLED', 'true').lower() == 'true',
+    'TIMEOUT': int(os.getenv('QUERY_CACHE_TIMEOUT', '300')),
+    'MAX_ROWS': int(os.getenv('QUERY_CACHE_MAX_ROWS', '1000')),
+}
+
+# Large-table pagination (core/pagination.py): tables past ESTIMATE_THRESHOLD
+# rows get the planner's row estimate instead of COUNT(*), filtered lists are
+# counted exactly up to EXACT_COUNT_LIMIT, and pages from KEYSET_OFFSET rows in
+# seek instead of OFFSET.
+PAGINATION = {
+    'ESTIMATE_THRESHOLD': int(os.getenv('PAGINATION_ESTIMATE_THRESHOLD', '100000')),
+    'EXACT_COUNT_LIMIT': int(os.getenv('PAGINATION_EXACT_COUNT_LIMIT', '10000')),
+    'COUNT_CACHE_TIMEOUT': int(os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', '300')),
+    'KEYSET_OFFSET': int(os.getenv('PAGINATION_KEYSET_OFFSET', '10000')),
+}
+
+# Prefix for core.caching view/fragment keys; changing it (e.g. on deploy)
+# invalidates all of them at once without touching sessions.
+VIEW_CACHE_VERSION = os.getenv('VIEW_CACHE_VERSION', '1')
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -128,7 +337,24 @@ USE_TZ = True
 
 STATICFILES_DIRS = (str(BASE_DIR.joinpath('static')),)
 
-STATIC_URL = 'static/'
+# Points at the Front Door endpoint when __main__.py creates one (cdnEnabled);
+# WhiteNoise still serves the files from the path part.
+STATIC_URL = os.getenv('STATIC_URL', 'static/')
+
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed copies plus .gz and .br variants of
+# every file (brotli needs the Brotli package); WhiteNoise serves the hashed
+# names with a far-future 'immutable' Cache-Control, straight from memory
+# and without going through the middleware stack below it.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -0,0 +1,475 @@
+"""
+Background tasks on the Redis behind ``REDIS_URL``.
+
+Declare a task with ``@task`` in an app's ``tasks.py`` and enqueue it from a
+request instead of doing the work there::
+
+    @task(queue='emails', priority=HIGH, max_retries=5)
+    def send_welcome_email(user_id):
+        ...
+
+    job = send_welcome_email.delay(user.pk)
+    job.status  # 'queued', 'scheduled', 'running', 'succeeded' or 'failed'
+
+``python manage.py run_worker`` runs them (see that command for its
+concurrency options). Arguments and results go through JSON.
+
+Layout in Redis, under ``TASK_QUEUE['PREFIX']``:
+
+* ``job:<id>``: hash with the task, its arguments, state and result. It
+  expires ``result_ttl`` seconds after the job finishes.
+* ``queue:<name>``: sorted set of ready job ids scored by priority (0 is
+  highest), then enqueue time.
+* ``notify:<name>``: list a worker blocks on; one entry per ready job, up
+  to ``NOTIFY_LENGTH``.
+* ``scheduled``: sorted set of job ids by the time they become ready
+  (countdowns and retries with backoff).
+* ``running``: sorted set of claimed job ids by lease expiry. Workers renew
+  the leases of the jobs they run every third of ``LEASE_TIMEOUT``, until
+  the task's ``timeout`` if it has one. A job whose worker died (or that
+  overran its timeout) is reclaimed when its lease runs out and counts as a
+  failed attempt, so delivery is at-least-once. An attempt that ends after
+  its lease was reclaimed leaves the job as it is.
+"""
+import json
+import logging
+import random
+import threading
+import time
+import traceback
+import uuid
+from functools import wraps
+
+import redis
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from core.backends.cache import per_process
+from core.middleware import flush_etag_invalidation
+
+logger = logging.getLogger(__name__)
+
+HIGH, NORMAL, LOW = 0, 5, 9
+QUEUED, SCHEDULED, RUNNING, SUCCEEDED, FAILED = 'queued', 'scheduled', 'running', 'succeeded', 'failed'
+
+_registry = {}
+
+# Wakeups kept per queue. Workers busy with a backlog claim without waiting,
+# so pushes would otherwise pile up; more wakeups than threads waiting on a
+# queue only cause empty claims.
+NOTIFY_LENGTH = 100
+
+# Move the best ready job of the first non-empty queue to 'running'.
+# KEYS: running, queue... ARGV: lease deadline (ms)
+CLAIM_SCRIPT = """
+for i = 2, #KEYS do
+    local popped = redis.call('ZPOPMIN', KEYS[i])
+    if popped[1] then
+        redis.call('ZADD', KEYS[1], ARGV[1], popped[1])
+        return popped[1]
+    end
+end
+return false
+"""
+
+# Move scheduled jobs that are due to their queues and wake a worker for each.
+# KEYS: scheduled. ARGV: now (ms), key prefix, NOTIFY_LENGTH
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 500)
+for _, id in ipairs(due) do
+    redis.call('ZREM', KEYS[1], id)
+    local job = redis.call('HMGET', ARGV[2] .. 'job:' .. id, 'queue', 'score')
+    if job[1] then
+        redis.call('HSET', ARGV[2] .. 'job:' .. id, 'status', 'queued')
+        redis.call('ZADD', ARGV[2] .. 'queue:' .. job[1], job[2], id)
+        redis.call('LPUSH', ARGV[2] .. 'notify:' .. job[1], 1)
+        redis.call('LTRIM', ARGV[2] .. 'notify:' .. job[1], 0, ARGV[3] - 1)
+    end
+end
+return #due
+"""
+
+
+def queue_settings():
+    return {
+        'URL': settings.CACHES['default']['LOCATION'],
+        'PREFIX': 'tasks',
+        'EAGER': False,
+        'DEFAULT_QUEUE': 'default',
+        'RESULT_TTL': 24 * 3600,
+        'LEASE_TIMEOUT': 60,
+        **getattr(settings, 'TASK_QUEUE', {}),
+    }
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class Broker:
+    def __init__(self, url, prefix):
+        # No socket timeout: workers block on BRPOP for longer than the
+        # cache's (deliberately short) one.
+        self.redis = redis.Redis.from_url(url, socket_connect_timeout=5, health_check_interval=30)
+        self.prefix = f'{prefix}:'
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+        self._promote = self.redis.register_script(PROMOTE_SCRIPT)
+
+    def key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    def enqueue(self, job_id, fields, queue, score, run_at=None):
+        pipe = self.redis.pipeline()
+        job_key = self.key('job', job_id)
+        pipe.hset(job_key, mapping=fields)
+        if run_at is not None and run_at > now_ms():
+            pipe.hset(job_key, 'status', SCHEDULED)
+            pipe.zadd(self.key('scheduled'), {job_id: run_at})
+        else:
+            pipe.zadd(self.key('queue', queue), {job_id: score})
+            pipe.lpush(self.key('notify', queue), 1)
+            pipe.ltrim(self.key('notify', queue), 0, NOTIFY_LENGTH - 1)
+        pipe.execute()
+
+    def wait(self, queues, timeout):
+        """Block until a job may be ready in one of ``queues``."""
+        self.redis.brpop([self.key('notify', queue) for queue in queues], timeout=timeout)
+
+    def claim(self, queues, lease_timeout):
+        keys = [self.key('running')] + [self.key('queue', queue) for queue in queues]
+        job_id = self._claim(keys=keys, args=[now_ms() + lease_timeout * 1000])
+        return job_id.decode() if job_id else None
+
+    def extend(self, job_ids, lease_timeout):
+        # xx: a lease that already expired and was reclaimed stays gone.
+        self.redis.zadd(self.key('running'), dict.fromkeys(job_ids, now_ms() + lease_timeout * 1000), xx=True)
+
+    def release(self, job_id):
+        """Drop the lease; False if it had already expired and been reclaimed."""
+        return bool(self.redis.zrem(self.key('running'), job_id))
+
+    def schedule(self, job_id, run_at):
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key('job', job_id), 'status', SCHEDULED)
+        pipe.zadd(self.key('scheduled'), {job_id: run_at})
+        pipe.execute()
+
+    def finish(self, job_id, fields, result_ttl):
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key('job', job_id), mapping=fields)
+        pipe.expire(self.key('job', job_id), result_ttl)
+        pipe.execute()
+
+    def promote_due(self):
+        return self._promote(keys=[self.key('scheduled')], args=[now_ms(), self.prefix, NOTIFY_LENGTH])
+
+    def expired_leases(self):
+        return [job_id.decode() for job_id in self.redis.zrangebyscore(self.key('running'), '-inf', now_ms())]
+
+    def load(self, job_id):
+        fields = self.redis.hgetall(self.key('job', job_id))
+        return {key.decode(): value.decode() for key, value in fields.items()}
+
+    def depths(self, queues):
+        pipe = self.redis.pipeline()
+        for queue in queues:
+            pipe.zcard(self.key('queue', queue))
+        pipe.zcard(self.key('scheduled'))
+        pipe.zcard(self.key('running'))
+        *ready, scheduled, running = pipe.execute()
+        return {'ready': dict(zip(queues, ready)), 'scheduled': scheduled, 'running': running}
+
+
+def get_broker():
+    options = queue_settings()
+    return per_process(('taskqueue', options['URL'], options['PREFIX']), lambda: Broker(options['URL'], options['PREFIX']))
+
+
+class Job:
+    """Handle on an enqueued task; reads its state from Redis on access."""
+
+    def __init__(self, job_id, broker=None):
+        self.id = job_id
+        self._broker = broker or get_broker()
+
+    def __repr__(self):
+        return f'<Job {self.id}>'
+
+    def fetch(self):
+        return self._broker.load(self.id)
+
+    @property
+    def status(self):
+        return self.fetch().get('status')
+
+    @property
+    def result(self):
+        fields = self.fetch()
+        return json.loads(fields['result']) if 'result' in fields else None
+
+    @property
+    def error(self):
+        return self.fetch().get('error')
+
+    def wait(self, timeout=30, interval=0.1):
+        """Poll until the job succeeds or fails; returns its final status."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = self.status
+            if status in (SUCCEEDED, FAILED, None):
+                return status
+            time.sleep(interval)
+        return self.status
+
+
+class EagerJob:
+    """What ``delay()`` returns when ``TASK_QUEUE['EAGER']`` runs tasks inline."""
+
+    def __init__(self, status, result=None, error=None):
+        self.id = None
+        self.status, self.result, self.error = status, result, error
+
+    def wait(self, timeout=None, interval=None):
+        return self.status
+
+
+class Task:
+    def __init__(self, func, *, name=None, queue=None, priority=NORMAL, max_retries=3, retry_backoff=2,
+                 result_ttl=None, timeout=None):
+        self.func = func
+        self.name = name or f'{func.__module__}.{func.__qualname__}'
+        self.queue = queue
+        self.priority = priority
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.result_ttl = result_ttl
+        self.timeout = timeout
+        wraps(func)(self)
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.enqueue(args, kwargs)
+
+    def enqueue(self, args=(), kwargs=None, *, queue=None, priority=None, countdown=0):
+        options = queue_settings()
+        kwargs = kwargs or {}
+        if options['EAGER']:
+            try:
+                return EagerJob(SUCCEEDED, result=self.func(*args, **kwargs))
+            except Exception:
+                logger.exception('Task %s failed', self.name)
+                return EagerJob(FAILED, error=traceback.format_exc())
+
+        queue = queue or self.queue or options['DEFAULT_QUEUE']
+        priority = self.priority if priority is None else priority
+        if not HIGH <= priority <= LOW:
+            raise ValueError('Task priority must be between 0 (highest) and 9 (lowest).')
+        enqueued_at = now_ms()
+        # Priority first, then FIFO; enqueue times fit in 13 digits.
+        score = priority * 10 ** 13 + enqueued_at
+        job_id = uuid.uuid4().hex
+        fields = {
+            'task': self.name,
+            'args': json.dumps(list(args)),
+            'kwargs': json.dumps(kwargs),
+            'queue': queue,
+            'priority': priority,
+            'score': score,
+            'attempts': 0,
+            'status': QUEUED,
+            'enqueued_at': enqueued_at,
+        }
+        broker = get_broker()
+        broker.enqueue(job_id, fields, queue, score, run_at=enqueued_at + int(countdown * 1000) if countdown else None)
+        return Job(job_id, broker)
+
+
+def task(func=None, **options):
+    """Register ``func`` as a task; usable bare (``@task``) or with options."""
+
+    def decorator(func):
+        registered = Task(func, **options)
+        _registry[registered.name] = registered
+        return registered
+
+    return decorator(func) if func is not None else decorator
+
+
+def get_task(name):
+    if name not in _registry:
+        # Importing the module registers the task.
+        import_string(name)
+    return _registry[name]
+
+
+class Worker:
+    """Runs jobs from ``queues`` (listed in priority order) on ``concurrency`` threads."""
+
+    def __init__(self, queues, concurrency):
+        self.queues = queues
+        self.concurrency = concurrency
+        self.broker = get_broker()
+        self.options = queue_settings()
+        self.stopping = threading.Event()
+        self.stats = {'succeeded': 0, 'failed': 0, 'retried': 0, 'busy': 0}
+        self._stats_lock = threading.Lock()
+        # Running job ids and when to stop renewing their leases (None: never).
+        self.leases = {}
+        self._leases_lock = threading.Lock()
+        self._renewed_at = 0
+
+    def count(self, stat, delta=1):
+        with self._stats_lock:
+            self.stats[stat] += delta
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.consume, name=f'task-worker-{index}', daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        logger.info('Worker consuming %s with %d threads', ', '.join(self.queues), self.concurrency)
+        while not self.stopping.wait(1):
+            try:
+                self.renew_leases()
+                self.broker.promote_due()
+                self.reclaim_expired()
+            except redis.RedisError:
+                logger.warning('Task scheduler could not reach Redis', exc_info=True)
+        for thread in threads:
+            while thread.is_alive():
+                # Jobs still finishing keep their leases.
+                thread.join(1)
+                try:
+                    self.renew_leases()
+                except redis.RedisError:
+                    logger.warning('Task worker could not renew leases', exc_info=True)
+
+    def stop(self):
+        """Finish the jobs in progress and return from ``run()``."""
+        self.stopping.set()
+
+    def consume(self):
+        backoff = 1
+        while not self.stopping.is_set():
+            try:
+                job_id = self.broker.claim(self.queues, self.options['LEASE_TIMEOUT'])
+                if job_id is None:
+                    self.broker.wait(self.queues, timeout=1)
+                    continue
+                backoff = 1
+                self.execute(job_id)
+            except redis.RedisError:
+                logger.warning('Task worker lost Redis, retrying in %ds', backoff, exc_info=True)
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def execute(self, job_id):
+        fields = self.broker.load(job_id)
+        if not fields:
+            # Expired or deleted while queued.
+            self.release(job_id)
+            return
+        try:
+            current = get_task(fields['task'])
+        except (ImportError, KeyError):
+            if self.release(job_id):
+                self.record_failure(job_id, fields, None, f"Unknown task {fields['task']!r}")
+            return
+
+        with self._leases_lock:
+            self.leases[job_id] = time.monotonic() + current.timeout if current.timeout else None
+        attempts = int(fields['attempts']) + 1
+        self.broker.redis.hset(self.broker.key('job', job_id), mapping={
+            'status': RUNNING, 'attempts': attempts, 'started_at': now_ms(),
+        })
+        fields['attempts'] = attempts
+
+        self.count('busy')
+        close_old_connections()
+        try:
+            result = current.func(*json.loads(fields['args']), **json.loads(fields['kwargs']))
+        except Exception:
+            logger.exception('Task %s (%s) failed on attempt %d', current.name, job_id, attempts)
+            if self.release(job_id):
+                self.record_failure(job_id, fields, current, traceback.format_exc())
+        else:
+            if not self.release(job_id):
+                return
+            self.broker.finish(
+                job_id,
+                {'status': SUCCEEDED, 'result': json.dumps(result), 'finished_at': now_ms()},
+                self.result_ttl(current),
+            )
+            self.count('succeeded')
+        finally:
+            with self._leases_lock:
+                self.leases.pop(job_id, None)
+            close_old_connections()
+            flush_etag_invalidation()
+            self.count('busy', -1)
+
+    def release(self, job_id):
+        """
+        Drop the job's lease. False if it expired and was reclaimed meanwhile:
+        the job was retried or failed by the scheduler, and this attempt's
+        outcome must not overwrite that.
+        """
+        if self.broker.release(job_id):
+            return True
+        logger.warning('Task %s outlived its lease and was reclaimed; dropping the result of this attempt', job_id)
+        return False
+
+    def renew_leases(self):
+        """Heartbeat: push back the lease of every running job, every third of ``LEASE_TIMEOUT``."""
+        lease_timeout = self.options['LEASE_TIMEOUT']
+        now = time.monotonic()
+        if now - self._renewed_at < lease_timeout / 3:
+            return
+        with self._leases_lock:
+            job_ids = [job_id for job_id, deadline in self.leases.items() if deadline is None or now < deadline]
+        if job_ids:
+            self.broker.extend(job_ids, lease_timeout)
+        self._renewed_at = now
+
+    def record_failure(self, job_id, fields, current, error):
+        """Schedule a retry with backoff, or mark the job failed once out of retries."""
+        attempts = int(fields['attempts'])
+        if current is not None and attempts <= current.max_retries:
+            # Exponential backoff with jitter: backoff, 2*backoff, 4*backoff, ...
+            delay = current.retry_backoff * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+            self.broker.redis.hset(self.broker.key('job', job_id), 'error', error)
+            self.broker.schedule(job_id, now_ms() + int(delay * 1000))
+            self.count('retried')
+            return
+        self.broker.finish(
+            job_id, {'status': FAILED, 'error': error, 'finished_at': now_ms()}, self.result_ttl(current),
+        )
+        self.count('failed')
+
+    def reclaim_expired(self):
+        for job_id in self.broker.expired_leases():
+            # Only the process that removes the lease handles it.
+            if not self.broker.release(job_id):
+                continue
+            fields = self.broker.load(job_id)
+            if not fields:
+                continue
+            logger.warning('Task %s (%s) lease expired, its worker is gone or stuck', fields['task'], job_id)
+            try:
+                current = get_task(fields['task'])
+            except (ImportError, KeyError):
+                current = None
+            self.record_failure(job_id, fields, current, 'Lease expired before the task finished.')
+
+    def result_ttl(self, current):
+        return (current and current.result_ttl) or self.options['RESULT_TTL']
+
+    def health(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {'queues': self.queues, 'concurrency': self.concurrency, **stats, **self.broker.depths(self.queues)}
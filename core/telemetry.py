@@ -0,0 +1,191 @@
+"""
+OpenTelemetry tracing, exported to Application Insights.
+
+``configure_tracing()`` runs once per process, from core/wsgi.py and
+core/asgi.py before the application is built. It records:
+
+* a server span per request (opentelemetry-instrumentation-django), named
+  after the URL pattern; health checks and static files are left out;
+* a client span per SQL query, from an execute wrapper installed on every
+  database connection, replicas included (``django.db.alias`` tells them
+  apart);
+* a client span per Redis command or pipeline
+  (opentelemetry-instrumentation-redis): cache, sessions, rate limits and
+  the task queue alike.
+
+It also exports, every ``TRACING['METRICS_INTERVAL']`` seconds, the state of
+each cache's circuit breaker (core/backends/cache.py) in this process:
+``cache.circuit.open`` (1 while Redis is being bypassed) and the running
+counts ``cache.circuit.trips``, ``cache.circuit.failures`` and
+``cache.circuit.fallback_calls``, by ``cache.alias``. State changes are also
+logged as they happen (``Cache circuit ...: closed -> open``).
+
+``TRACING['SAMPLE_RATIO']`` of new traces are kept; requests arriving with a
+``traceparent`` header follow the caller's decision. Queries and Redis
+calls made outside any request (the task worker's polling, management
+commands) are never recorded on their own.
+
+``TRACING['EXPORTER']`` is ``azure`` (``APPLICATIONINSIGHTS_CONNECTION_STRING``),
+``console``, ``memory`` (kept in ``memory_exporter`` and
+``memory_metric_reader``, for tests and benchmarks) or ``none``.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.backends.signals import connection_created
+from opentelemetry import metrics, trace
+from opentelemetry.instrumentation.django import DjangoInstrumentor
+from opentelemetry.instrumentation.redis import RedisInstrumentor
+from opentelemetry.metrics import CallbackOptions, Observation
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import ConsoleMetricExporter, InMemoryMetricReader, PeriodicExportingMetricReader
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import Decision, ParentBased, Sampler, SamplingResult, TraceIdRatioBased
+from opentelemetry.trace import SpanKind
+
+logger = logging.getLogger(__name__)
+
+EXCLUDED_URLS = 'healthz,static/'
+
+memory_exporter = None
+memory_metric_reader = None
+_tracer = None
+
+
+def tracing_settings():
+    return {
+        'EXPORTER': 'none',
+        'SAMPLE_RATIO': 1.0,
+        'SERVICE_NAME': 'django',
+        'CONNECTION_STRING': None,
+        'METRICS_INTERVAL': 60,
+        **getattr(settings, 'TRACING', {}),
+    }
+
+
+def configure_tracing():
+    """Set up tracing for this process; a no-op when disabled or already done."""
+    global _tracer, memory_exporter, memory_metric_reader
+    options = tracing_settings()
+    if _tracer is not None or options['EXPORTER'] == 'none':
+        return
+
+    interval_ms = options['METRICS_INTERVAL'] * 1000
+    if options['EXPORTER'] == 'azure':
+        # Imported here: it pulls in azure-core, which nothing else needs.
+        from azure.monitor.opentelemetry.exporter import AzureMonitorMetricExporter, AzureMonitorTraceExporter
+        processor = BatchSpanProcessor(AzureMonitorTraceExporter(connection_string=options['CONNECTION_STRING']))
+        metric_reader = PeriodicExportingMetricReader(
+            AzureMonitorMetricExporter(connection_string=options['CONNECTION_STRING']), interval_ms,
+        )
+    elif options['EXPORTER'] == 'console':
+        processor = SimpleSpanProcessor(ConsoleSpanExporter())
+        metric_reader = PeriodicExportingMetricReader(ConsoleMetricExporter(), interval_ms)
+    elif options['EXPORTER'] == 'memory':
+        memory_exporter = InMemorySpanExporter()
+        processor = SimpleSpanProcessor(memory_exporter)
+        metric_reader = memory_metric_reader = InMemoryMetricReader()
+    else:
+        raise ValueError(f"Unknown TRACING['EXPORTER'] {options['EXPORTER']!r}; use azure, console, memory or none.")
+
+    # With gunicorn's preload_app this runs in the master; the batch
+    # processor and the metric reader restart their export threads in each
+    # forked worker.
+    resource = Resource.create({SERVICE_NAME: options['SERVICE_NAME']})
+    provider = TracerProvider(resource=resource, sampler=RequestSampler(options['SAMPLE_RATIO']))
+    provider.add_span_processor(processor)
+    trace.set_tracer_provider(provider)
+
+    DjangoInstrumentor().instrument(tracer_provider=provider, excluded_urls=EXCLUDED_URLS)
+    RedisInstrumentor().instrument(tracer_provider=provider)
+    _tracer = trace.get_tracer(__name__, tracer_provider=provider)
+    connection_created.connect(install_query_tracing, dispatch_uid='core.telemetry.install_query_tracing')
+
+    meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
+    metrics.set_meter_provider(meter_provider)
+    meter = meter_provider.get_meter(__name__)
+    meter.create_observable_gauge(
+        'cache.circuit.open', [observe_circuits('open')],
+        description='1 while the circuit is open and calls skip Redis',
+    )
+    for name, description in CIRCUIT_COUNTERS.items():
+        meter.create_observable_counter(f'cache.circuit.{name}', [observe_circuits(name)], description=description)
+    logger.info('Tracing %.0f%% of requests to %s', options['SAMPLE_RATIO'] * 100, options['EXPORTER'])
+
+
+class RequestSampler(Sampler):
+    """Parent-based ratio sampling that drops client spans with no parent."""
+
+    def __init__(self, ratio):
+        self.delegate = ParentBased(TraceIdRatioBased(ratio))
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None,
+                      trace_state=None):
+        if kind == SpanKind.CLIENT and not trace.get_current_span(parent_context).get_span_context().is_valid:
+            return SamplingResult(Decision.DROP)
+        return self.delegate.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+
+    def get_description(self):
+        return f'RequestSampler{{{self.delegate.get_description()}}}'
+
+
+# cache.circuit.<name> counters: description; values come from CircuitBreaker.stats().
+CIRCUIT_COUNTERS = {
+    'trips': 'Times the circuit opened',
+    'failures': 'Redis calls that failed with a connection error or timeout',
+    'fallback_calls': 'Calls served by the local fallback instead of Redis',
+}
+_CIRCUIT_STATS = {'trips': 'circuit_open', 'failures': 'circuit_failures', 'fallback_calls': 'circuit_fallback_calls'}
+
+
+def circuit_stats():
+    """``{alias: CircuitBreaker.stats()}`` for the caches that have a breaker."""
+    stats = {}
+    for alias in settings.CACHES:
+        cache = caches[alias]
+        if hasattr(cache, 'breaker'):
+            stats[alias] = cache.breaker.stats()
+    return stats
+
+
+def observe_circuits(name):
+    def callback(options: CallbackOptions):
+        for alias, stats in circuit_stats().items():
+            if name == 'open':
+                value = int(stats['circuit_state'] != 'closed')
+            else:
+                value = stats.get(_CIRCUIT_STATS[name], 0)
+            yield Observation(value, {'cache.alias': alias})
+
+    return callback
+
+
+def install_query_tracing(sender, connection, **kwargs):
+    if trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(trace_query)
+
+
+def trace_query(execute, sql, params, many, context):
+    if not trace.get_current_span().is_recording():
+        # Outside a sampled request the span would be dropped anyway.
+        return execute(sql, params, many, context)
+    connection = context['connection']
+    database = str(connection.settings_dict.get('NAME') or '')
+    operation = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else 'SQL'
+    attributes = {
+        'db.system': connection.vendor,
+        'db.name': database,
+        'db.operation': operation,
+        'db.statement': sql,
+        'django.db.alias': connection.alias,
+    }
+    if connection.settings_dict.get('HOST'):
+        attributes['server.address'] = connection.settings_dict['HOST']
+    if connection.settings_dict.get('PORT'):
+        attributes['server.port'] = int(connection.settings_dict['PORT'])
+    with _tracer.start_as_current_span(f'{operation} {database}', kind=SpanKind.CLIENT, attributes=attributes):
+        return execute(sql, params, many, context)
@@ -13,10 +13,20 @@ Class-based views
 Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
+Query budgets (core/querybudget.py)
+    Wrap a view to cap what it may run per request; the rest get QUERY_BUDGET['DEFAULT']:
+        path('orders/', query_budget(views.orders, queries=5, db_time_ms=50), name='orders')
 """
 from django.contrib import admin
 from django.urls import path
 
+from core import views
+from core.querybudget import query_budget
+
 urlpatterns = [
+    path('admin/profiles/', query_budget(admin.site.admin_view(views.profiles), queries=3), name='profiles'),
+    path('admin/profiles/<str:profile_id>/', query_budget(admin.site.admin_view(views.profile_download), queries=3),
+         name='profile-download'),
     path('admin/', admin.site.urls),
+    path('healthz/', query_budget(views.health, queries=1), name='health'),
 ]
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import render
+
+from core.async_cache import get_async_cache
+from core.middleware import etag_exempt
+from core.profiling import get_profile, list_profiles
+from core.ratelimit import ratelimit_exempt
+
+logger = logging.getLogger(__name__)
+
+
+def _health_response(results):
+    status = {}
+    for name, result in zip(('database', 'cache'), results):
+        if result is not True:
+            logger.warning('Health check for %s failed: %r', name, result)
+        status[name] = 'ok' if result is True else 'error'
+    healthy = all(result is True for result in results)
+    return JsonResponse(status, status=200 if healthy else 503)
+
+
+def _ping_cache():
+    cache = caches['default']
+
+    def call():
+        return cache.client.get_client(write=True).ping()
+
+    # The cache's circuit breaker, when it has one, skips Redis while it's down.
+    guard = getattr(cache, '_guard', None)
+    if not (guard(call, lambda: False) if guard else call()):
+        raise ConnectionError('Redis circuit is open')
+
+
+if settings.SERVER_MODE == 'asgi':
+    @ratelimit_exempt
+    async def health(request):
+        """Check the database and Redis concurrently; 503 if either is down."""
+
+        async def check_database():
+            await ContentType.objects.aexists()
+            return True
+
+        async def check_cache():
+            if not await get_async_cache().ping():
+                raise ConnectionError('Redis circuit is open')
+            return True
+
+        results = await asyncio.gather(check_database(), check_cache(), return_exceptions=True)
+        return _health_response(results)
+else:
+    @ratelimit_exempt
+    def health(request):
+        """
+        Check the database and Redis; 503 if either is down. Sync under WSGI,
+        where an async view would get a new event loop (and Redis pool) per
+        probe.
+        """
+        results = []
+        for check in (ContentType.objects.exists, _ping_cache):
+            try:
+                check()
+                results.append(True)
+            except Exception as error:
+                results.append(error)
+        return _health_response(results)
+
+
+@etag_exempt
+def profiles(request):
+    """Admin page listing the profiles kept by core.profiling."""
+    entries = list_profiles()
+    for entry in entries:
+        entry['time'] = datetime.fromtimestamp(entry['time'], timezone.utc)
+    return render(request, 'core/profiles.html', {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': entries,
+    })
+
+
+@etag_exempt
+def profile_download(request, profile_id):
+    """A profile as folded stacks (flamegraph.pl, speedscope) or, with ?format=json, everything."""
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise Http404('Profile not found; it may have been rotated out.')
+    if request.GET.get('format') == 'json':
+        response, extension = JsonResponse(profile), 'json'
+    else:
+        response, extension = HttpResponse(profile['folded'], content_type='text/plain'), 'folded.txt'
+    response.headers['Content-Disposition'] = f'attachment; filename="profile-{profile_id}.{extension}"'
+    return response
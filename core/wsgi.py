@@ -11,6 +11,10 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from core.telemetry import configure_tracing
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
+# Before the application loads its middleware: it adds the tracing one.
+configure_tracing()
 application = get_wsgi_application()
@@ -0,0 +1,116 @@
+"""
+Gunicorn configuration for App Service.
+
+Worker and thread counts are computed from the CPUs and memory available to
+the container (cgroup v1/v2 limits included) instead of being hardcoded.
+Every value can be overridden through an App Service app setting of the
+same name in upper case prefixed with GUNICORN_, e.g. GUNICORN_WORKERS=3.
+GUNICORN_MAX_WORKERS and GUNICORN_MAX_THREADS (set from the sizing profile
+by __main__.py) only cap the computed counts.
+"""
+import math
+import multiprocessing
+import os
+from pathlib import Path
+
+
+def _read(path):
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit():
+    """CPUs this container may use, honouring cgroup CPU quotas."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else multiprocessing.cpu_count()
+    quota = _read('/sys/fs/cgroup/cpu.max')  # cgroup v2: "<quota> <period>"
+    if quota:
+        quota, _, period = quota.partition(' ')
+        if quota != 'max':
+            cpus = min(cpus, int(quota) / int(period))
+    else:  # cgroup v1
+        quota, period = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'), _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+        if quota and period and int(quota) > 0:
+            cpus = min(cpus, int(quota) / int(period))
+    return max(cpus, 1)
+
+
+def memory_limit():
+    """Bytes of memory this container may use, or None if unknown."""
+    limits = []
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read(path)
+        # cgroup v1 reports "no limit" as a huge number close to 2**63.
+        if value and value != 'max' and int(value) < 2 ** 60:
+            limits.append(int(value))
+    try:
+        limits.append(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    except (ValueError, OSError, AttributeError):
+        pass
+    return min(limits) if limits else None
+
+
+def setting(name, default, cast=str):
+    value = os.getenv(f'GUNICORN_{name.upper()}')
+    return default if value in (None, '') else cast(value)
+
+
+def default_workers():
+    # (2 x CPU) + 1, capped by how many workers fit in memory.
+    workers = 2 * math.ceil(cpu_limit()) + 1
+    memory = memory_limit()
+    if memory:
+        per_worker = setting('worker_memory_mb', 200, int) * 1024 * 1024
+        workers = min(workers, max(memory // per_worker, 1))
+    return int(workers)
+
+
+def default_threads(workers):
+    # Four requests in flight per (2 x CPU) + 1 worker slot, spread over the
+    # workers memory allowed, and no more than their memory headroom holds:
+    # a worker's threads share its memory.
+    threads = math.ceil(4 * (2 * math.ceil(cpu_limit()) + 1) / workers)
+    memory = memory_limit()
+    if memory:
+        headroom = memory // workers - setting('worker_memory_mb', 200, int) * 1024 * 1024
+        threads = min(threads, headroom // (setting('thread_memory_mb', 32, int) * 1024 * 1024))
+    return int(max(threads, 1))
+
+
+def capped(computed, name):
+    cap = setting(name, None, int)
+    return computed if cap is None else max(min(computed, cap), 1)
+
+
+# SERVER_MODE=asgi serves core.asgi with uvicorn workers instead (threads is
+# then unused: each uvicorn worker runs a single event loop).
+asgi = os.getenv('SERVER_MODE', 'wsgi') == 'asgi'
+
+wsgi_app = setting('wsgi_app', 'core.asgi:application' if asgi else 'core.wsgi:application')
+bind = setting('bind', f"0.0.0.0:{os.getenv('PORT', '8000')}")
+chdir = setting('chdir', os.getenv('APP_PATH', '/home/site/wwwroot'))
+
+workers = setting('workers', capped(default_workers(), 'max_workers'), int)
+threads = setting('threads', capped(default_threads(workers), 'max_threads'), int)
+worker_class = setting('worker_class', 'uvicorn.workers.UvicornWorker' if asgi else 'gthread')
+timeout = setting('timeout', 60, int)
+graceful_timeout = setting('graceful_timeout', 30, int)
+keepalive = setting('keepalive', 5, int)
+
+# Import Django once in the master; workers fork with it already loaded,
+# which shortens cold start and shares read-only memory between them.
+preload_app = setting('preload_app', True, lambda value: value.lower() in ('1', 'true', 'yes'))
+
+# The heartbeat file is touched by every worker on every request loop; keep
+# it on tmpfs so it never blocks on App Service's network-mounted disk.
+worker_tmp_dir = setting('worker_tmp_dir', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+# Recycle workers periodically to contain memory growth, with jitter so they
+# don't all restart at once.
+max_requests = setting('max_requests', 1000, int)
+max_requests_jitter = setting('max_requests_jitter', 100, int)
+
+accesslog = setting('accesslog', '-')
+errorlog = setting('errorlog', '-')
+loglevel = setting('loglevel', 'info')
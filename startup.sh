@@ -1,5 +1,7 @@
-# startup.sh is used by infra/resources.bicep to automate database migrations and isn't used by the sample application
-python manage.py migrate
-gunicorn --workers 2 --threads 4 --timeout 60 --access-logfile \
-    '-' --error-logfile '-' --bind=0.0.0.0:8000 \
-     --chdir=/home/site/wwwroot azureproject.wsgi
\ No newline at end of file
+# startup.sh is the App Service startup command (set in __main__.py); worker
+# counts and the rest of the server settings live in gunicorn.conf.py.
+# Migrations go straight to the server port: the advisory lock taken by
+# migrate_once is session-level and wouldn't survive PgBouncer's transaction
+# pooling.
+POSTGRES_PORT="${POSTGRES_DIRECT_PORT:-5432}" python manage.py migrate_once
+gunicorn --config gunicorn.conf.py
@@ -0,0 +1,4 @@
+# Startup command of the task worker WebApp (set in __main__.py). It answers
+# App Service's HTTP pings on $PORT itself; concurrency and queues come from
+# TASK_WORKER_CONCURRENCY / TASK_WORKER_QUEUES.
+python manage.py run_worker